@@ -1,7 +1,99 @@
 # agente.py
 
-from database import AlimentoRepository, tabela_regras
-from sqlalchemy import select, func
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from alternativas import DIRETORIO_ALTERNATIVAS, IndiceAlternativas
+from catalogo import (Alternativa, CatalogoNutrientes, ItemRefeicao, NutrientesAlimento, ResultadoAnalise,
+                      ResultadoRefeicao)
+from database import AlimentoRepository, calcular_hash_nutrientes
+
+
+# Ordem dos indicadores dentro da mascara de 5 bits, o primeiro e o bit menos significativo
+INDICADORES = ("sodio_alto", "gordura_alta", "fibra_baixa", "proteina_alta", "carboidrato_alto")
+
+
+def compilar_tabela_decisao(regras) -> tuple:
+    # Transforma a lista de regras numa tabela com uma posicao para cada combinacao de indicadores
+    # Cada posicao guarda o indice da primeira regra que vale para aquela combinacao
+    tabela = []
+    for mascara in range(2 ** len(INDICADORES)):
+        indicadores = {nome: bool(mascara >> bit & 1) for bit, nome in enumerate(INDICADORES)}
+        for indice, regra in enumerate(regras):
+            if any(all(indicadores[nome] == valor for nome, valor in condicao.items())
+                   for condicao in regra["condicoes"]):
+                tabela.append(indice)
+                break
+        else:
+            raise ValueError(f"Nenhuma regra cobre a combinação de indicadores {indicadores}")
+    return tuple(tabela)
+
+
+class CacheAnalises:
+    # Guarda os resultados do analisar_alimento para os alimentos mais pedidos nao irem ao banco de novo
+    # Tem tamanho maximo (sai o usado ha mais tempo) e validade em segundos para cada resultado
+    # A chave junta o nome do alimento com a configuracao de limites e a versao das regras
+
+    def __init__(self, tamanho_maximo=1024, validade=300.0):
+        self.tamanho_maximo = tamanho_maximo
+        self.validade = validade
+        self._itens = OrderedDict()
+        self._trava = threading.Lock()
+        # Muda a cada invalidacao para descartar resultados calculados antes dela
+        self.geracao = 0
+        self.acertos = 0
+        self.falhas = 0
+        self.remocoes = 0
+
+    def obter(self, chave):
+        with self._trava:
+            item = self._itens.get(chave)
+            if item is not None and time.monotonic() - item[1] > self.validade:
+                del self._itens[chave]
+                self.remocoes += 1
+                item = None
+            if item is None:
+                self.falhas += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return item[0]
+
+    def guardar(self, chave, resultado, geracao):
+        # So guarda se nada foi invalidado enquanto o resultado era calculado
+        if self.tamanho_maximo <= 0:
+            return
+        with self._trava:
+            if geracao != self.geracao:
+                return
+            self._itens[chave] = (resultado, time.monotonic())
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.tamanho_maximo:
+                self._itens.popitem(last=False)
+                self.remocoes += 1
+
+    def invalidar_alimentos(self, nomes):
+        # Tira do cache os resultados dos alimentos que mudaram no banco, em qualquer configuracao
+        nomes = set(nomes)
+        with self._trava:
+            self.geracao += 1
+            for chave in [chave for chave in self._itens if chave[0] in nomes]:
+                del self._itens[chave]
+                self.remocoes += 1
+
+    def limpar(self):
+        with self._trava:
+            self.geracao += 1
+            self.remocoes += len(self._itens)
+            self._itens.clear()
+
+    def estatisticas(self) -> dict:
+        with self._trava:
+            return {"itens": len(self._itens), "acertos": self.acertos, "falhas": self.falhas,
+                    "remocoes": self.remocoes}
 
 
 class AgenteDeRisco:
@@ -14,9 +106,98 @@ class AgenteDeRisco:
     LIMITE_PROTEINA_ALTA = 10.0
     LIMITE_CARBOIDRATO_ALTO = 30.0
 
-    def __init__(self, repo: AlimentoRepository):
+    # Nomes dos limites na mesma ordem do configuracao_limites
+    NOMES_LIMITES = ("LIMITE_SODIO_ALTO", "LIMITE_GORDURA_ALTA", "LIMITE_FIBRA_BAIXA", "LIMITE_PROTEINA_ALTA",
+                     "LIMITE_CARBOIDRATO_ALTO")
+
+    # Resultado padrao quando o alimento nao existe no banco
+    RESULTADO_NAO_ENCONTRADO = ResultadoAnalise(
+        "CINZA", "Não Encontrado", "Dados do alimento não encontrados no sistema.", 0.0, 0.0, 0.0, 0.0, 0.0
+    )
+
+    # Regras de decisao declaradas como dados, na ordem de prioridade
+    # Cada regra vale se alguma das condicoes for verdadeira e cada condicao exige valores para os indicadores
+    # A primeira regra que valer define o risco, igual a uma cascata de if elif
+    REGRAS_DECISAO = (
+        # Regras para risco vermelho
+        # Caso critico com muito sodio e muita gordura
+        {"risco": "VERMELHO", "classificacao": "Risco Crítico (Múltiplos Fatores)",
+         "padrao_regra": "Alto Sódio e Alta Gordura Saturada",
+         "condicoes": [{"sodio_alto": True, "gordura_alta": True}]},
+        # Caso com muito sodio muito carboidrato e pouca fibra
+        {"risco": "VERMELHO", "classificacao": "Risco Crítico (Sódio e Carboidratos)",
+         "padrao_regra": "Alto Sódio e Alto Carboidrato com Baixa Fibra",
+         "condicoes": [{"sodio_alto": True, "carboidrato_alto": True, "fibra_baixa": True}]},
+        # Caso com muita gordura muito carboidrato e pouca fibra
+        {"risco": "VERMELHO", "classificacao": "Risco Crítico (Gordura e Carboidratos)",
+         "padrao_regra": "Alta Gordura Saturada e Alto Carboidrato com Baixa Fibra",
+         "condicoes": [{"gordura_alta": True, "carboidrato_alto": True, "fibra_baixa": True}]},
+
+        # Regras para risco amarelo
+        # Alimento com energia vazia muito carboidrato pouca fibra e sem proteina
+        {"risco": "AMARELO", "classificacao": "Risco Moderado (Carboidratos Sem Benefício)",
+         "padrao_regra": "muita energia",
+         "condicoes": [{"carboidrato_alto": True, "fibra_baixa": True, "proteina_alta": False}]},
+        # Alimento com muito carboidrato mas compensado por fibra ou proteina
+        {"risco": "AMARELO", "classificacao": "Risco Moderado (Alto Carboidrato Compensado)",
+         "padrao_regra": "parcialmente compensado",
+         "condicoes": [{"carboidrato_alto": True, "fibra_baixa": False},
+                       {"carboidrato_alto": True, "proteina_alta": True}]},
+        # Alimento com apenas um fator de risco isolado como so sodio ou so gordura
+        {"risco": "AMARELO", "classificacao": "Risco Moderado (Fator Isolado)",
+         "padrao_regra": "Apresenta um fator de risco isolado",
+         "condicoes": [{"sodio_alto": True, "gordura_alta": False, "carboidrato_alto": False, "fibra_baixa": False},
+                       {"gordura_alta": True, "sodio_alto": False, "carboidrato_alto": False, "fibra_baixa": False}]},
+
+        # Regras para risco verde
+        # Perfil ideal com riscos controlados e bons nutrientes
+        {"risco": "VERDE", "classificacao": "Risco Baixo (Perfil Ideal)",
+         "padrao_regra": "Fibra OU Proteína alta",
+         "condicoes": [{"sodio_alto": False, "gordura_alta": False, "carboidrato_alto": False, "fibra_baixa": True},
+                       {"sodio_alto": False, "gordura_alta": False, "carboidrato_alto": False, "proteina_alta": True}]},
+        # Todos os fatores de risco estao baixos
+        {"risco": "VERDE", "classificacao": "Risco Baixo (Fatores Controlados)",
+         "padrao_regra": "Todos os fatores críticos",
+         "condicoes": [{"sodio_alto": False, "gordura_alta": False, "carboidrato_alto": False}]},
+        # Caso nao caia em nenhuma regra anterior mantem verde
+        {"risco": "VERDE", "classificacao": "Risco Baixo (Outros Fatores)",
+         "padrao_regra": "Todos os fatores críticos",
+         "condicoes": [{}]},
+    )
+
+    def __init__(self, repo: AlimentoRepository, regras_decisao=None, tamanho_cache=1024, validade_cache=300.0,
+                 diretorio_alternativas=DIRETORIO_ALTERNATIVAS):
         # Recebe o repositorio para poder acessar os dados do banco
         self.repo = repo
+        # Cache dos resultados por alimento, avisado pelo repositorio quando algum alimento muda
+        # Com tamanho_cache=0 nada e guardado
+        self.cache = CacheAnalises(tamanho_cache, validade_cache)
+        self._configuracao_cache = None
+        repo.registrar_ouvinte_alteracao(self.cache.invalidar_alimentos)
+        # Monta a tabela de decisao uma vez so, a classificacao vira so um acesso por indice
+        self.regras_decisao = tuple(regras_decisao) if regras_decisao is not None else self.REGRAS_DECISAO
+        self._tabela_decisao = compilar_tabela_decisao(self.regras_decisao)
+        # Regras guardadas em memoria, carregadas na primeira analise
+        self._regras = []
+        self._descricoes_regras = None
+        self._versao_regras = None
+        # Indice das alternativas VERDE, montado ou lido do disco na primeira sugestao
+        # Com diretorio_alternativas=None ele fica so na memoria
+        self.diretorio_alternativas = diretorio_alternativas
+        self._indice_alternativas = None
+        self._trava_alternativas = threading.Lock()
+
+    def fechar(self):
+        # Tira os ouvintes deste agente do repositorio, o cache e o indice de alternativas deixam de ser avisados
+        # O repositorio so guarda referencias fracas, mas agentes de vida curta podem sair na hora com o with
+        self.repo.remover_ouvinte_alteracao(self.cache.invalidar_alimentos)
+        self.repo.remover_ouvinte_alteracao(self._avisar_indice_alternativas)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excecao):
+        self.fechar()
 
     def _limpar_string(self, texto: str) -> str:
         # Remove pontuacoes e deixa o texto em minusculo para facilitar a busca
@@ -24,117 +205,309 @@ class AgenteDeRisco:
                                                                                                           '').strip()
         return texto
 
+    def _carregar_regras(self):
+        # Le a tabela de regras uma vez so e guarda em memoria
+        # Tambem ja resolve a descricao de todas as regras de decisao
+        # O mapa novo e montado inteiro antes de trocar o antigo, assim outras threads nunca veem ele pela metade
+        versao = self.repo.versao_regras
+        self._regras = [(nivel_risco, descricao, descricao.lower()) for nivel_risco, descricao in self.repo.obter_regras()]
+        descricoes = {}
+        for regra in self.regras_decisao:
+            chave = (regra["risco"], regra["padrao_regra"])
+            descricoes[chave] = self._resolver_descricao_regra(*chave)
+        self._descricoes_regras = descricoes
+        self._versao_regras = versao
+
+    def _resolver_descricao_regra(self, nivel_risco: str, padrao_regra: str):
+        # Procura nas regras em memoria a descricao que contem o padrao igual ao LIKE que era feito no banco
+        padrao_busca_agente = self._limpar_string(padrao_regra)
+        padroes = [padrao_busca_agente]
+
+        # Se nao encontrar de primeira tenta buscar apenas pela palavra energia
+        if padrao_busca_agente == "muita energia":
+            padroes.append(self._limpar_string('energia'))
+
+        for padrao in padroes:
+            for nivel, descricao, descricao_minuscula in self._regras:
+                if nivel == nivel_risco and padrao in descricao_minuscula:
+                    return descricao
+
+        return f"[ERRO] Descrição da regra '{padrao_regra}' não encontrada no DB para o risco {nivel_risco}"
+
     def _buscar_descricao_regra(self, nivel_risco: str, padrao_regra: str):
-        # Procura no banco de dados a descricao da regra que foi ativada
+        # Devolve a descricao da regra que foi ativada usando o mapa em memoria
         try:
-            # Limpa o texto de busca para evitar erros de formatacao
-            padrao_busca_agente = self._limpar_string(padrao_regra)
-
-            with self.repo.engine.connect() as connection:
-                # Prepara a consulta no banco usando busca que ignora maiusculas e minusculas
-                stmt = select(tabela_regras.c.descricao_regra).where(
-                    (tabela_regras.c.nivel_risco == nivel_risco) &
-                    (func.lower(tabela_regras.c.descricao_regra).like(f"%{padrao_busca_agente}%"))
-                ).limit(1)
-
-                resultado = connection.execute(stmt).fetchone()
-
-                # Se nao encontrar de primeira tenta buscar apenas pela palavra energia
-                if not resultado and padrao_busca_agente == "muita energia":
-                    stmt = select(tabela_regras.c.descricao_regra).where(
-                        (tabela_regras.c.nivel_risco == nivel_risco) &
-                        (func.lower(tabela_regras.c.descricao_regra).like(f"%{self._limpar_string('energia')}%"))
-                    ).limit(1)
-                    resultado = connection.execute(stmt).fetchone()
-
-                return resultado[
-                    0] if resultado else f"[ERRO] Descrição da regra '{padrao_regra}' não encontrada no DB para o risco {nivel_risco}"
+            # Recarrega as regras so se a tabela mudou desde a ultima leitura
+            if self._descricoes_regras is None or self._versao_regras != self.repo.versao_regras:
+                self._carregar_regras()
+
+            chave = (nivel_risco, padrao_regra)
+            descricao = self._descricoes_regras.get(chave)
+            if descricao is None:
+                # Padrao que as regras de decisao nao usam, resolve uma vez e guarda para as proximas
+                descricao = self._resolver_descricao_regra(nivel_risco, padrao_regra)
+                self._descricoes_regras[chave] = descricao
+            return descricao
         except Exception as e:
             # Retorna mensagem de erro caso a consulta falhe
             return f"[ERRO INTERNO NO DB] Falha ao consultar: {e}"
 
-    def analisar_alimento(self, nome_alimento: str) -> tuple:
+    def calcular_mascara(self, sodio, gordura, fibra, proteina, carboidrato):
+        # Verifica se cada nutriente esta acima ou abaixo dos limites e junta tudo numa mascara de 5 bits
+        # Funciona tanto com numeros soltos quanto com arrays do numpy
+        return ((sodio > self.LIMITE_SODIO_ALTO)
+                | ((gordura > self.LIMITE_GORDURA_ALTA) << 1)
+                | ((fibra < self.LIMITE_FIBRA_BAIXA) << 2)
+                | ((proteina > self.LIMITE_PROTEINA_ALTA) << 3)
+                | ((carboidrato > self.LIMITE_CARBOIDRATO_ALTO) << 4))
+
+    def classificar(self, sodio, gordura, fibra, proteina, carboidrato) -> dict:
+        # Devolve a regra de decisao ativada pelos nutrientes com um unico acesso na tabela
+        return self.regras_decisao[self._tabela_decisao[self.calcular_mascara(sodio, gordura, fibra, proteina, carboidrato)]]
+
+    def classificar_matriz(self, matriz):
+        # Recebe uma matriz do numpy com uma linha por alimento e os 5 nutrientes nas colunas
+        # Calcula a mascara coluna por coluna e devolve o indice da regra de cada linha de uma vez
+        import numpy as np
+
+        return self.classificar_colunas(*np.asarray(matriz, dtype=float).reshape(-1, 5).T)
+
+    def classificar_colunas(self, sodio, gordura, fibra, proteina, carboidrato):
+        # Mesmo resultado do classificar_matriz mas com um array do numpy separado para cada nutriente
+        # Serve para arrays mapeados do disco (snapshot) sem precisar juntar as colunas numa matriz
+        import numpy as np
+
+        return np.asarray(self._tabela_decisao)[self.calcular_mascara(sodio, gordura, fibra, proteina, carboidrato)]
+
+    def classificar_linhas(self, linhas) -> list[tuple]:
+        # Classifica linhas que ja vieram do banco no formato (nome, sodio, gordura, fibra, proteina, carboidrato)
+        # Devolve o risco e a classificacao de cada linha sem fazer nenhuma consulta
+        if not linhas:
+            return []
+        regras = [(regra["risco"], regra["classificacao"]) for regra in self.regras_decisao]
+        return [regras[indice] for indice in CatalogoNutrientes.de_linhas(linhas).classificar(self).tolist()]
+
+    def configuracao_limites(self) -> tuple:
+        # Valores atuais dos limites, mudar qualquer um deles muda a chave do cache
+        return tuple(getattr(self, nome) for nome in self.NOMES_LIMITES)
+
+    def definir_limites(self, limites):
+        # Troca os limites so deste agente, na mesma ordem do configuracao_limites
+        for nome, valor in zip(self.NOMES_LIMITES, limites):
+            setattr(self, nome, float(valor))
+
+    def analisar_alimento(self, nome_alimento: str) -> ResultadoAnalise:
         # Aplica as regras de classificacao verde amarelo ou vermelho no alimento
+        # Alimentos pedidos ha pouco tempo vem do cache sem consultar o banco
+        configuracao = (self.configuracao_limites(), self.repo.versao_regras)
+        if configuracao != self._configuracao_cache:
+            # Limites ou regras mudaram, nenhum resultado guardado vale mais
+            self.cache.limpar()
+            self._configuracao_cache = configuracao
+
+        chave = (nome_alimento, configuracao)
+        resultado = self.cache.obter(chave)
+        if resultado is None:
+            geracao = self.cache.geracao
+            resultado = self._analisar_no_banco(nome_alimento)
+            self.cache.guardar(chave, resultado, geracao)
+        return resultado
+
+    def _analisar_no_banco(self, nome_alimento: str) -> ResultadoAnalise:
+        # Faz a analise de verdade buscando os nutrientes no banco
 
         dados = self.repo.obter_dados_nutricionais(nome_alimento)
 
         if not dados:
-            return "CINZA", "Não Encontrado", "Dados do alimento não encontrados no sistema.", 0.0, 0.0, 0.0, 0.0, 0.0
+            return self.RESULTADO_NAO_ENCONTRADO
 
         sodio, gordura, fibra, proteina, carboidrato = dados
 
-        # Verifica se cada nutriente esta acima ou abaixo dos limites definidos
-        is_sodio_alto = sodio > self.LIMITE_SODIO_ALTO
-        is_gordura_alta = gordura > self.LIMITE_GORDURA_ALTA
-        is_fibra_baixa = fibra < self.LIMITE_FIBRA_BAIXA
-        is_proteina_alta = proteina > self.LIMITE_PROTEINA_ALTA
-        is_carboidrato_alto = carboidrato > self.LIMITE_CARBOIDRATO_ALTO
+        # Descobre qual regra foi ativada pela combinacao dos limites
+        regra = self.classificar(sodio, gordura, fibra, proteina, carboidrato)
 
-        # Comeca a verificar as regras de decisao
+        # Busca o texto completo da regra no banco de dados para exibir ao usuario
+        descricao = self._buscar_descricao_regra(regra["risco"], regra["padrao_regra"])
 
-        # Regras para risco vermelho
-        # Caso critico com muito sodio e muita gordura
-        if is_sodio_alto and is_gordura_alta:
-            risco = "VERMELHO"
-            classificacao = "Risco Crítico (Múltiplos Fatores)"
-            padrao_regra = "Alto Sódio e Alta Gordura Saturada"
+        return ResultadoAnalise(regra["risco"], regra["classificacao"], descricao,
+                                sodio, gordura, fibra, proteina, carboidrato)
 
-        # Caso com muito sodio muito carboidrato e pouca fibra
-        elif is_sodio_alto and is_carboidrato_alto and is_fibra_baixa:
-            risco = "VERMELHO"
-            classificacao = "Risco Crítico (Sódio e Carboidratos)"
-            padrao_regra = "Alto Sódio e Alto Carboidrato com Baixa Fibra"
+    def hash_configuracao(self) -> str:
+        # Resume os limites e a tabela de decisao num texto curto
+        # Se esse texto mudar todas as classificacoes guardadas precisam ser refeitas
+        regras = [(regra["risco"], regra["classificacao"]) for regra in self.regras_decisao]
+        descricao = repr((self.configuracao_limites(), self._tabela_decisao, regras))
+        return hashlib.sha1(descricao.encode("utf-8")).hexdigest()[:16]
 
-        # Caso com muita gordura muito carboidrato e pouca fibra
-        elif is_gordura_alta and is_carboidrato_alto and is_fibra_baixa:
-            risco = "VERMELHO"
-            classificacao = "Risco Crítico (Gordura e Carboidratos)"
-            padrao_regra = "Alta Gordura Saturada e Alto Carboidrato com Baixa Fibra"
+    def montar_classificacoes(self, linhas, hash_configuracao=None) -> list[dict]:
+        # Classifica linhas no formato (id, sodio, gordura, fibra, proteina, carboidrato)
+        # e monta os registros usados pelo gravar_classificacoes do repositorio
+        if not linhas:
+            return []
+        hash_configuracao = hash_configuracao or self.hash_configuracao()
+        indices_regra = CatalogoNutrientes.de_linhas([linha[:6] for linha in linhas]).classificar(self).tolist()
+        return [
+            {"id_alimento": linha[0], "risco": self.regras_decisao[indice]["risco"],
+             "classificacao": self.regras_decisao[indice]["classificacao"], "id_regra": indice,
+             "hash_nutrientes": calcular_hash_nutrientes(linha[1:6]), "hash_configuracao": hash_configuracao}
+            for linha, indice in zip(linhas, indices_regra)
+        ]
 
-        # Regras para risco amarelo
+    def sincronizar_classificacoes(self, conferir_nutrientes=False, tamanho_lote=10000) -> int:
+        # Reclassifica so os alimentos novos, os que mudaram e os que foram classificados com outros limites
+        # No sqlite os gatilhos apagam a classificacao de quem mudou, entao basta olhar os pendentes
+        # Com conferir_nutrientes=True tambem compara o hash de todos os nutrientes (para outros bancos)
+        hash_configuracao = self.hash_configuracao()
 
-        # Alimento com energia vazia muito carboidrato pouca fibra e sem proteina
-        elif is_carboidrato_alto and is_fibra_baixa and not is_proteina_alta:
-            risco = "AMARELO"
-            classificacao = "Risco Moderado (Carboidratos Sem Benefício)"
-            # Chave unica para busca no banco
-            padrao_regra = "muita energia"
+        if conferir_nutrientes:
+            desatualizados = []
+            for lote in self.repo.iterar_lotes_nutrientes_classificados(tamanho_lote):
+                desatualizados.extend(linha[0] for linha in lote if calcular_hash_nutrientes(linha[1:6]) != linha[6])
+            self.repo.remover_classificacoes(desatualizados)
 
-        # Alimento com muito carboidrato mas compensado por fibra ou proteina
-        elif is_carboidrato_alto and (not is_fibra_baixa or is_proteina_alta):
-            risco = "AMARELO"
-            classificacao = "Risco Moderado (Alto Carboidrato Compensado)"
-            padrao_regra = "parcialmente compensado"
+        total = 0
+        while True:
+            pendentes = self.repo.obter_alimentos_pendentes_classificacao(hash_configuracao, tamanho_lote)
+            if not pendentes:
+                return total
+            self.repo.gravar_classificacoes(self.montar_classificacoes(pendentes, hash_configuracao))
+            total += len(pendentes)
 
-        # Alimento com apenas um fator de risco isolado como so sodio ou so gordura
-        elif (is_sodio_alto and not is_gordura_alta and not is_carboidrato_alto and not is_fibra_baixa) or \
-                (is_gordura_alta and not is_sodio_alto and not is_carboidrato_alto and not is_fibra_baixa):
-            risco = "AMARELO"
-            classificacao = "Risco Moderado (Fator Isolado)"
-            padrao_regra = "Apresenta um fator de risco isolado"
+    def analisar_alimentos_paralelo(self, nomes_alimentos, max_threads=None) -> list[tuple]:
+        # Roda o analisar_alimento de varios alimentos em threads, cada uma com sua conexao do pool
+        # Devolve os resultados na mesma ordem dos nomes
+        with ThreadPoolExecutor(max_workers=max_threads or self.repo.tamanho_pool) as executor:
+            return list(executor.map(self.analisar_alimento, nomes_alimentos))
 
-        # Regras para risco verde
+    def analisar_alimentos_lote(self, nomes_alimentos=None) -> list[ResultadoAnalise]:
+        # Aplica as mesmas regras do analisar_alimento em varios alimentos de uma vez
+        # Se nenhum nome for passado analisa todos os alimentos do banco
+        # As linhas do banco viram um CatalogoNutrientes (uma coluna por nutriente) classificado com o numpy
+        # Os nomes viram lista antes da consulta, um gerador seria consumido por ela e nao sobraria nada
+        nomes = None if nomes_alimentos is None else list(nomes_alimentos)
+        linhas = self.repo.obter_dados_nutricionais_lote(nomes)
+        if nomes is None:
+            nomes = [linha[0] for linha in linhas]
 
-        # Perfil ideal com riscos controlados e bons nutrientes
-        elif not is_sodio_alto and not is_gordura_alta and not is_carboidrato_alto and (
-                is_fibra_baixa or is_proteina_alta):
-            risco = "VERDE"
-            classificacao = "Risco Baixo (Perfil Ideal)"
-            padrao_regra = "Fibra OU Proteína alta"
+        if not linhas:
+            return [self.RESULTADO_NAO_ENCONTRADO for _ in nomes]
 
-        # Todos os fatores de risco estao baixos
-        elif not is_sodio_alto and not is_gordura_alta and not is_carboidrato_alto:
-            risco = "VERDE"
-            classificacao = "Risco Baixo (Fatores Controlados)"
-            padrao_regra = "Todos os fatores críticos"
+        catalogo = CatalogoNutrientes.de_linhas(linhas, coluna_nome=0)
+        del linhas
+        return self.analisar_catalogo(catalogo, None if nomes_alimentos is None else nomes)
 
-        # Caso nao caia em nenhuma regra anterior mantem verde
-        else:
-            risco = "VERDE"
-            classificacao = "Risco Baixo (Outros Fatores)"
-            padrao_regra = "Todos os fatores críticos"
+    def analisar_catalogo(self, catalogo: CatalogoNutrientes, nomes_alimentos=None) -> list[ResultadoAnalise]:
+        # Analisa os alimentos de um catalogo ja carregado (do banco, do snapshot ou da memoria) sem consultar o banco
+        # Sem nomes devolve o resultado de todos os alimentos do catalogo na ordem dele
+        indices_regra = catalogo.classificar(self)
+        resultados_regra = self._resultados_regras(indices_regra)
 
-        # Busca o texto completo da regra no banco de dados para exibir ao usuario
-        descricao = self._buscar_descricao_regra(risco, padrao_regra)
+        def resultado(posicao):
+            if posicao is None:
+                return self.RESULTADO_NAO_ENCONTRADO
+            return ResultadoAnalise(*resultados_regra[int(indices_regra[posicao])], *catalogo.nutrientes(posicao))
+
+        # Devolve os resultados na mesma ordem dos nomes pedidos
+        if nomes_alimentos is None:
+            return [resultado(posicao) for posicao in range(len(catalogo))]
+        return [resultado(catalogo.posicao(nome)) for nome in nomes_alimentos]
+
+    def _resultados_regras(self, indices_regra) -> dict:
+        # Risco, classificacao e descricao de cada regra que aparece nos indices, a descricao e buscada uma vez so
+        import numpy as np
+
+        resultados_regra = {}
+        for indice in np.unique(indices_regra).tolist():
+            regra = self.regras_decisao[indice]
+            resultados_regra[indice] = (regra["risco"], regra["classificacao"],
+                                        self._buscar_descricao_regra(regra["risco"], regra["padrao_regra"]))
+        return resultados_regra
+
+    def analisar_refeicao(self, itens) -> ResultadoRefeicao:
+        # Analisa uma refeicao (ou um dia) dada como pares (nome do alimento, gramas)
+        return self.analisar_refeicoes([itens])[0]
+
+    def analisar_refeicoes(self, refeicoes) -> list[ResultadoRefeicao]:
+        # Analisa varias refeicoes de uma vez, cada uma uma lista de pares (nome do alimento, gramas)
+        # Os alimentos de todas as refeicoes sao buscados numa consulta so e cada alimento e classificado uma vez
+        # As porcoes e os totais de cada refeicao sao calculados com o numpy para todos os itens juntos
+        import numpy as np
+
+        refeicoes = [list(itens) for itens in refeicoes]
+        nomes = [nome for itens in refeicoes for nome, _ in itens]
+        gramas = np.array([float(quantidade) for itens in refeicoes for _, quantidade in itens], dtype=float)
+        if not np.all(np.isfinite(gramas) & (gramas >= 0)):
+            raise ValueError("As gramas de cada alimento devem ser um número maior ou igual a zero.")
 
-        return risco, classificacao, descricao, sodio, gordura, fibra, proteina, carboidrato
\ No newline at end of file
+        linhas = self.repo.obter_dados_nutricionais_lote(list(dict.fromkeys(nomes))) if nomes else []
+        catalogo = CatalogoNutrientes.de_linhas(linhas, coluna_nome=0)
+        del linhas
+        indices_regra = catalogo.classificar(self)
+        resultados_regra = self._resultados_regras(indices_regra)
+
+        # Alimento que nao existe aponta para uma linha de zeros no fim da matriz
+        ausente = len(catalogo)
+        indices = np.array([ausente if posicao is None else posicao for posicao in map(catalogo.posicao, nomes)],
+                           dtype=np.intp)
+        matriz = np.vstack([catalogo.matriz().reshape(-1, 5), np.zeros((1, 5))])
+        porcoes = matriz[indices] * (gramas / 100.0)[:, None]
+
+        # Soma as porcoes e as gramas (so dos alimentos encontrados) de cada refeicao
+        numero_refeicao = np.repeat(np.arange(len(refeicoes)), [len(itens) for itens in refeicoes])
+        gramas_encontradas = np.where(indices < ausente, gramas, 0.0)
+        total_gramas = np.bincount(numero_refeicao, weights=gramas_encontradas, minlength=len(refeicoes)).astype(float)
+        totais = np.zeros((len(refeicoes), 5))
+        for coluna in range(5):
+            totais[:, coluna] = np.bincount(numero_refeicao, weights=porcoes[:, coluna], minlength=len(refeicoes))
+
+        # Nutrientes por 100g da refeicao, sem gramas (so alimentos que nao existem) a refeicao fica sem classificacao
+        com_gramas = total_gramas > 0
+        por_100g = np.divide(totais * 100.0, total_gramas[:, None], out=np.zeros_like(totais),
+                             where=com_gramas[:, None])
+        indices_refeicao = self.classificar_matriz(por_100g).tolist()
+        resultados_refeicao = self._resultados_regras(np.asarray(indices_refeicao, dtype=np.intp)[com_gramas])
+
+        # Analise por 100g de cada alimento distinto, a ultima posicao e a dos que nao existem
+        analises = [ResultadoAnalise(*resultados_regra[indice], *catalogo.nutrientes(posicao))
+                    for posicao, indice in enumerate(indices_regra.tolist())] + [self.RESULTADO_NAO_ENCONTRADO]
+        itens_analisados = [
+            ItemRefeicao(nome, quantidade, analises[indice], NutrientesAlimento(*porcao))
+            for nome, quantidade, indice, porcao in zip(nomes, gramas.tolist(), indices.tolist(), porcoes.tolist())
+        ]
+
+        resultados = []
+        inicio = 0
+        for numero, itens in enumerate(refeicoes):
+            if com_gramas[numero]:
+                analise = ResultadoAnalise(*resultados_refeicao[indices_refeicao[numero]], *por_100g[numero].tolist())
+            else:
+                analise = self.RESULTADO_NAO_ENCONTRADO
+            resultados.append(ResultadoRefeicao(analise, float(total_gramas[numero]),
+                                                NutrientesAlimento(*totais[numero].tolist()),
+                                                itens_analisados[inicio:inicio + len(itens)]))
+            inicio += len(itens)
+        return resultados
+
+    def _avisar_indice_alternativas(self, nomes):
+        indice = self._indice_alternativas
+        if indice is not None:
+            indice.marcar_alterados(nomes)
+
+    def indice_alternativas(self) -> IndiceAlternativas:
+        # Indice atualizado com as ultimas alteracoes do banco, montado de novo se os limites ou as regras mudaram
+        with self._trava_alternativas:
+            indice = self._indice_alternativas
+            if indice is None or indice.precisa_reconstruir():
+                if indice is None:
+                    self.repo.registrar_ouvinte_alteracao(self._avisar_indice_alternativas)
+                indice = self._indice_alternativas = IndiceAlternativas.abrir(self, self.diretorio_alternativas)
+        indice.aplicar_alteracoes()
+        return indice
+
+    def sugerir_alternativas(self, nome_alimento: str, k=5) -> list[Alternativa]:
+        # Os k alimentos VERDE com nutrientes mais parecidos com o do alimento informado
+        # Devolve lista vazia se o alimento nao existir no banco
+        dados = self.repo.obter_dados_nutricionais(nome_alimento)
+        if not dados:
+            return []
+        return self.indice_alternativas().buscar(dados, k, excluir=nome_alimento)
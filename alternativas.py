@@ -0,0 +1,328 @@
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+from catalogo import COLUNAS_CATALOGO, Alternativa, CatalogoNutrientes, NutrientesAlimento
+from estatistica import calcular_estatisticas_agregadas
+
+# Pasta padrao do indice de alternativas gravado em disco
+DIRETORIO_ALTERNATIVAS = "indice_alternativas"
+
+# O manifesto e gravado por ultimo, como no snapshot, entao um indice sem manifesto e ignorado
+ARQUIVO_MANIFESTO = "manifesto.json"
+ARQUIVO_NUTRIENTES = "nutrientes.npy"
+ARQUIVO_REGRAS = "regras.npy"
+ARQUIVO_NOMES = "nomes.jsonl"
+# Alteracoes aplicadas depois da ultima gravacao completa, uma linha [nome, nutrientes ou null, regra] por alimento
+# O manifesto guarda quantos bytes dele valem, o que passar disso (gravacao interrompida) e ignorado
+ARQUIVO_ALTERACOES = "alteracoes.jsonl"
+VERSAO_INDICE = 2
+
+# Risco dos alimentos sugeridos como alternativa
+RISCO_ALTERNATIVA = "VERDE"
+
+# Com mais alimentos alterados que esta fracao do indice ele e montado de novo em vez de atualizado um a um
+# A mesma fracao limita o arquivo de alteracoes, passando dela o indice e gravado inteiro de novo
+FRACAO_RECONSTRUCAO = 0.1
+
+
+def _posicoes_verdes(agente, indices_regra):
+    # Posicoes dos alimentos cuja regra ativada tem o risco das alternativas
+    import numpy as np
+
+    verde = np.asarray([regra["risco"] == RISCO_ALTERNATIVA for regra in agente.regras_decisao], dtype=bool)
+    return np.flatnonzero(verde[indices_regra])
+
+
+def assinatura_dados(repo) -> list:
+    # Resumo da tabela de alimentos tirado dos totais mantidos pelos gatilhos (5 linhas, sem ler os alimentos)
+    # Qualquer insercao, alteracao ou remocao muda a quantidade ou as somas
+    agregadas = repo.obter_estatisticas_agregadas()
+    return [list(agregadas.get(coluna, (0, 0.0, 0.0))) for coluna in COLUNAS_CATALOGO]
+
+
+class IndiceAlternativas:
+    # Indice dos alimentos VERDE para achar os mais parecidos com um alimento qualquer
+    # Os 5 nutrientes sao padronizados (menos a media, dividido pelo desvio padrao da tabela inteira) e a busca e
+    # uma comparacao com todos os vetores de uma vez no numpy, com a distancia calculada por produto escalar
+    # Alteracoes avisadas pelo repositorio (marcar_alterados) sao aplicadas so nos alimentos que mudaram e, se o
+    # indice veio de uma pasta, acrescentadas no arquivo de alteracoes junto com a assinatura nova no manifesto
+
+    def __init__(self, agente, medias, desvios, hash_configuracao, assinatura, capacidade=1024):
+        import numpy as np
+
+        self.agente = agente
+        self.medias = np.asarray(medias, dtype=np.float64)
+        self.desvios = np.asarray(desvios, dtype=np.float64)
+        self.hash_configuracao = hash_configuracao
+        self.assinatura = assinatura
+        self.quantidade = 0
+        self.vetores = np.zeros((capacidade, len(COLUNAS_CATALOGO)), dtype=np.float32)
+        self.normas = np.zeros(capacidade, dtype=np.float32)
+        self.nutrientes = np.zeros((capacidade, len(COLUNAS_CATALOGO)), dtype=np.float64)
+        self.indices_regra = np.zeros(capacidade, dtype=np.uint8)
+        self.ativos = np.zeros(capacidade, dtype=bool)
+        self.nomes = []
+        self.posicoes = {}
+        self._alterados = set()
+        self._trava = threading.Lock()
+        # Pasta onde o indice foi lido ou gravado, e o tamanho da gravacao completa e das alteracoes depois dela
+        self.diretorio = None
+        self._quantidade_gravada = 0
+        self._bytes_alteracoes = 0
+        self._entradas_alteracoes = 0
+
+    @classmethod
+    def construir(cls, agente, tamanho_lote=10000) -> "IndiceAlternativas":
+        # Le a tabela de alimentos, classifica todos e guarda so os VERDE
+        repo = agente.repo
+        assinatura = assinatura_dados(repo)
+        acumuladores = calcular_estatisticas_agregadas(repo.obter_estatisticas_agregadas())
+        medias = [acumuladores[coluna].media for coluna in COLUNAS_CATALOGO]
+        # Coluna sem variacao nenhuma nao pesa na distancia, divide por 1 para nao dividir por zero
+        desvios = [acumuladores[coluna].desvio_padrao() or 1.0 for coluna in COLUNAS_CATALOGO]
+
+        catalogo = CatalogoNutrientes.do_repositorio(repo, com_nomes=True, tamanho_lote=tamanho_lote)
+        indices_regra = catalogo.classificar(agente)
+        verdes = _posicoes_verdes(agente, indices_regra)
+        indice = cls(agente, medias, desvios, agente.hash_configuracao(), assinatura, max(len(verdes), 1024))
+        indice._acrescentar([catalogo.nomes[posicao] for posicao in verdes.tolist()], catalogo.matriz()[verdes],
+                            indices_regra[verdes])
+        return indice
+
+    @classmethod
+    def abrir(cls, agente, diretorio=DIRETORIO_ALTERNATIVAS) -> "IndiceAlternativas":
+        # Usa o indice gravado se ele for da mesma tabela e dos mesmos limites e regras, senao monta e grava um novo
+        indice = cls.carregar(agente, diretorio) if diretorio else None
+        if indice is None:
+            indice = cls.construir(agente)
+            if diretorio:
+                indice.salvar(diretorio)
+        return indice
+
+    @classmethod
+    def carregar(cls, agente, diretorio=DIRETORIO_ALTERNATIVAS):
+        # Le o indice gravado, None se ele nao existir ou nao valer mais para a tabela e os limites atuais
+        import numpy as np
+
+        try:
+            with open(os.path.join(diretorio, ARQUIVO_MANIFESTO), encoding="utf-8") as arquivo:
+                manifesto = json.load(arquivo)
+        except (OSError, ValueError):
+            return None
+        if (not isinstance(manifesto, dict) or manifesto.get("versao") != VERSAO_INDICE
+                or manifesto.get("hash_configuracao") != agente.hash_configuracao()
+                or manifesto.get("assinatura") != assinatura_dados(agente.repo)):
+            return None
+
+        try:
+            nutrientes = np.load(os.path.join(diretorio, ARQUIVO_NUTRIENTES))
+            indices_regra = np.load(os.path.join(diretorio, ARQUIVO_REGRAS))
+            with open(os.path.join(diretorio, ARQUIVO_NOMES), encoding="utf-8") as arquivo:
+                nomes = [json.loads(linha) for linha in arquivo]
+            # Vale a ultima alteracao de cada nome, na ordem em que foram gravadas
+            alteracoes = {}
+            if manifesto.get("bytes_alteracoes"):
+                with open(os.path.join(diretorio, ARQUIVO_ALTERACOES), "rb") as arquivo:
+                    conteudo = arquivo.read(manifesto["bytes_alteracoes"])
+                if len(conteudo) != manifesto["bytes_alteracoes"]:
+                    return None
+                for linha in conteudo.decode("utf-8").splitlines():
+                    nome, valores, indice_regra = json.loads(linha)
+                    alteracoes[nome] = (valores, indice_regra)
+        except (OSError, ValueError):
+            return None
+        if not len(nomes) == len(nutrientes) == len(indices_regra) == manifesto["quantidade"]:
+            return None
+
+        indice = cls(agente, manifesto["medias"], manifesto["desvios"], manifesto["hash_configuracao"],
+                     manifesto["assinatura"], max(len(nomes) + len(alteracoes), 1024))
+        if alteracoes:
+            # Os alimentos alterados saem da gravacao completa e entram de novo no fim, sem deixar posicoes vazias
+            mantidos = np.asarray([nome not in alteracoes for nome in nomes], dtype=bool)
+            nomes = [nome for nome, mantido in zip(nomes, mantidos.tolist()) if mantido]
+            nutrientes, indices_regra = nutrientes[mantidos], indices_regra[mantidos]
+        indice._acrescentar(nomes, nutrientes, indices_regra)
+        novos = [(nome, valores, indice_regra) for nome, (valores, indice_regra) in alteracoes.items()
+                 if valores is not None]
+        if novos:
+            indice._acrescentar([nome for nome, _, _ in novos], np.asarray([valores for _, valores, _ in novos]),
+                                np.asarray([indice_regra for _, _, indice_regra in novos], dtype=np.uint8))
+        indice.diretorio = diretorio
+        indice._quantidade_gravada = manifesto["quantidade"]
+        indice._bytes_alteracoes = manifesto.get("bytes_alteracoes", 0)
+        indice._entradas_alteracoes = manifesto.get("entradas_alteracoes", 0)
+        return indice
+
+    def salvar(self, diretorio=DIRETORIO_ALTERNATIVAS):
+        # Grava o indice inteiro e passa a gravar as proximas alteracoes nesta pasta
+        with self._trava:
+            self._salvar(diretorio)
+
+    def _salvar(self, diretorio):
+        # Grava so os alimentos ativos, os removidos nao vao para o disco
+        # Os vetores padronizados nao sao gravados, eles saem dos nutrientes com as medias e desvios do manifesto
+        import numpy as np
+
+        posicoes = np.flatnonzero(self.ativos[:self.quantidade])
+        nomes = [self.nomes[posicao] for posicao in posicoes.tolist()]
+
+        os.makedirs(diretorio, exist_ok=True)
+        caminho_manifesto = os.path.join(diretorio, ARQUIVO_MANIFESTO)
+        if os.path.exists(caminho_manifesto):
+            os.remove(caminho_manifesto)
+        np.save(os.path.join(diretorio, ARQUIVO_NUTRIENTES), self.nutrientes[posicoes])
+        np.save(os.path.join(diretorio, ARQUIVO_REGRAS), self.indices_regra[posicoes])
+        with open(os.path.join(diretorio, ARQUIVO_NOMES), "w", encoding="utf-8") as arquivo:
+            arquivo.writelines(json.dumps(nome, ensure_ascii=False) + "\n" for nome in nomes)
+        if os.path.exists(os.path.join(diretorio, ARQUIVO_ALTERACOES)):
+            os.remove(os.path.join(diretorio, ARQUIVO_ALTERACOES))
+
+        self.diretorio = diretorio
+        self._quantidade_gravada = len(nomes)
+        self._bytes_alteracoes = self._entradas_alteracoes = 0
+        self._gravar_manifesto()
+
+    def _gravar_manifesto(self):
+        manifesto = {
+            "versao": VERSAO_INDICE,
+            "criado_em": datetime.now(timezone.utc).isoformat(),
+            "quantidade": self._quantidade_gravada,
+            "bytes_alteracoes": self._bytes_alteracoes,
+            "entradas_alteracoes": self._entradas_alteracoes,
+            "medias": self.medias.tolist(),
+            "desvios": self.desvios.tolist(),
+            "hash_configuracao": self.hash_configuracao,
+            "assinatura": self.assinatura,
+        }
+        caminho_manifesto = os.path.join(self.diretorio, ARQUIVO_MANIFESTO)
+        temporario = caminho_manifesto + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as arquivo:
+            json.dump(manifesto, arquivo, ensure_ascii=False, indent=2)
+        os.replace(temporario, caminho_manifesto)
+
+    def _gravar_alteracoes(self, alteracoes):
+        # Acrescenta as alteracoes no arquivo e so depois troca o manifesto com a assinatura nova
+        # Com alteracoes demais desde a ultima gravacao completa grava o indice inteiro de novo
+        if self._entradas_alteracoes + len(alteracoes) > max(1000, FRACAO_RECONSTRUCAO * self._quantidade_gravada):
+            self._salvar(self.diretorio)
+            return
+        conteudo = "".join(json.dumps(alteracao, ensure_ascii=False) + "\n" for alteracao in alteracoes)
+        conteudo = conteudo.encode("utf-8")
+        with open(os.path.join(self.diretorio, ARQUIVO_ALTERACOES), "ab") as arquivo:
+            # Descarta o que uma gravacao interrompida deixou depois da parte valida
+            arquivo.truncate(self._bytes_alteracoes)
+            arquivo.write(conteudo)
+        self._bytes_alteracoes += len(conteudo)
+        self._entradas_alteracoes += len(alteracoes)
+        self._gravar_manifesto()
+
+    def padronizar(self, nutrientes):
+        import numpy as np
+
+        return ((np.asarray(nutrientes, dtype=np.float64) - self.medias) / self.desvios).astype(np.float32)
+
+    def _garantir_capacidade(self, quantidade):
+        # Dobra os arrays quando eles enchem, assim acrescentar um alimento custa O(1) na media
+        import numpy as np
+
+        capacidade = len(self.vetores)
+        if quantidade <= capacidade:
+            return
+        while capacidade < quantidade:
+            capacidade *= 2
+        for nome in ("vetores", "normas", "nutrientes", "indices_regra", "ativos"):
+            antigo = getattr(self, nome)
+            novo = np.zeros((capacidade,) + antigo.shape[1:], dtype=antigo.dtype)
+            novo[:self.quantidade] = antigo[:self.quantidade]
+            setattr(self, nome, novo)
+
+    def _acrescentar(self, nomes, nutrientes, indices_regra):
+        import numpy as np
+
+        if not len(nomes):
+            return
+        inicio, fim = self.quantidade, self.quantidade + len(nomes)
+        self._garantir_capacidade(fim)
+        vetores = self.padronizar(nutrientes)
+        self.vetores[inicio:fim] = vetores
+        self.normas[inicio:fim] = np.einsum("ij,ij->i", vetores, vetores)
+        self.nutrientes[inicio:fim] = nutrientes
+        self.indices_regra[inicio:fim] = indices_regra
+        self.ativos[inicio:fim] = True
+        for posicao, nome in enumerate(nomes, start=inicio):
+            self.posicoes[nome] = posicao
+        self.nomes.extend(nomes)
+        self.quantidade = fim
+
+    def marcar_alterados(self, nomes):
+        # Chamado quando o repositorio avisa que alimentos mudaram, so anota os nomes para o aplicar_alteracoes
+        with self._trava:
+            self._alterados.update(nomes)
+
+    def precisa_reconstruir(self) -> bool:
+        # Limites ou regras do agente mudaram, alterados demais para valer a pena atualizar um por um, ou as posicoes
+        # dos alimentos removidos (que continuam nos arrays) ja ocupam mais da metade do indice
+        return (self.agente.hash_configuracao() != self.hash_configuracao
+                or len(self._alterados) > max(1000, FRACAO_RECONSTRUCAO * len(self.posicoes))
+                or self.quantidade - len(self.posicoes) > max(1000, len(self.posicoes)))
+
+    def aplicar_alteracoes(self):
+        # Tira os alimentos alterados do indice e coloca de volta os que continuam existindo e sao VERDE
+        with self._trava:
+            if not self._alterados:
+                return
+            nomes, self._alterados = list(self._alterados), set()
+            # A assinatura e lida antes dos alimentos: uma gravacao no meio deixa a assinatura velha e o indice
+            # gravado e montado de novo na proxima abertura, em vez de ser aceito sem essa gravacao
+            assinatura = assinatura_dados(self.agente.repo)
+            linhas = self.agente.repo.obter_dados_nutricionais_lote(nomes)
+            for nome in nomes:
+                posicao = self.posicoes.pop(nome, None)
+                if posicao is not None:
+                    self.ativos[posicao] = False
+            alteracoes = {nome: [nome, None, None] for nome in nomes}
+            if linhas:
+                catalogo = CatalogoNutrientes.de_linhas(linhas, coluna_nome=0)
+                indices_regra = catalogo.classificar(self.agente)
+                verdes = _posicoes_verdes(self.agente, indices_regra)
+                nomes_verdes = [catalogo.nomes[posicao] for posicao in verdes.tolist()]
+                matriz = catalogo.matriz()[verdes]
+                self._acrescentar(nomes_verdes, matriz, indices_regra[verdes])
+                for nome, valores, indice_regra in zip(nomes_verdes, matriz.tolist(), indices_regra[verdes].tolist()):
+                    alteracoes[nome] = [nome, valores, indice_regra]
+            self.assinatura = assinatura
+            if self.diretorio:
+                try:
+                    self._gravar_alteracoes(list(alteracoes.values()))
+                except OSError:
+                    # Sem conseguir gravar o manifesto fica com a assinatura velha e o indice e montado de novo
+                    # na proxima abertura, a busca continua com o indice em memoria
+                    pass
+
+    def buscar(self, nutrientes, k=5, excluir=None) -> list[Alternativa]:
+        # Os k alimentos VERDE mais proximos dos nutrientes informados, do mais parecido para o menos parecido
+        import numpy as np
+
+        consulta = self.padronizar(nutrientes)
+        with self._trava:
+            quantidade = self.quantidade
+            # |v - q|^2 = |v|^2 - 2 v.q + |q|^2, o ultimo termo e igual para todos e nao muda a ordem
+            distancias = self.normas[:quantidade] - 2.0 * (self.vetores[:quantidade] @ consulta)
+            distancias[~self.ativos[:quantidade]] = np.inf
+            posicao_excluida = self.posicoes.get(excluir)
+            if posicao_excluida is not None:
+                distancias[posicao_excluida] = np.inf
+
+            k = min(k, int(np.count_nonzero(np.isfinite(distancias))))
+            if k <= 0:
+                return []
+            melhores = np.argpartition(distancias, k - 1)[:k]
+            melhores = melhores[np.argsort(distancias[melhores], kind="stable")]
+            quadrado_consulta = float(consulta @ consulta)
+            regras = self.agente.regras_decisao
+            return [Alternativa(self.nomes[posicao], max(float(distancias[posicao]) + quadrado_consulta, 0.0) ** 0.5,
+                                regras[int(self.indices_regra[posicao])]["classificacao"],
+                                NutrientesAlimento(*self.nutrientes[posicao].tolist()))
+                    for posicao in melhores.tolist()]
@@ -0,0 +1,239 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from database import AlimentoRepository
+from agente import AgenteDeRisco
+from cli import calcular_tabela_estatisticas, gravar_relatorio_csv
+
+# Tamanhos padrao das tabelas sinteticas de alimentos
+TAMANHOS_PADRAO = (10000, 1000000, 10000000)
+
+ARQUIVO_RESULTADOS = "benchmark_resultados.json"
+ARQUIVO_BASE = "benchmark_base.json"
+
+# Refeicoes sinteticas analisadas em cada chamada do analisar_refeicoes
+REFEICOES_POR_LOTE = 100
+
+# Quanto uma medida pode piorar em relacao a base (0.25 = 25%) antes de contar como regressao
+TOLERANCIA_PADRAO = 0.25
+
+
+def _nome_sintetico(indice) -> str:
+    return f"Alimento Sintetico {indice:08d}"
+
+
+def gerar_csv_sintetico(caminho_arquivo, quantidade, semente=42):
+    # Grava um csv com o mesmo cabecalho do dados_alimentos.csv e nutrientes sorteados
+    # As distribuicoes passam dos dois lados dos limites do agente para todas as regras aparecerem
+    sorteio = random.Random(semente)
+    with open(caminho_arquivo, "w", newline="", encoding="utf-8") as arquivo:
+        writer = csv.writer(arquivo)
+        writer.writerow(["nome_alimento", "sodio", "gordura_saturada", "fibra", "proteina", "carboidrato"])
+        for inicio in range(0, quantidade, 10000):
+            writer.writerows(
+                (_nome_sintetico(indice),
+                 round(sorteio.lognormvariate(4.5, 1.5), 1),
+                 round(sorteio.lognormvariate(0.0, 1.2), 1),
+                 round(sorteio.expovariate(1 / 2.5), 1),
+                 round(sorteio.lognormvariate(1.8, 0.9), 1),
+                 round(sorteio.uniform(0.0, 90.0), 1))
+                for indice in range(inicio, min(inicio + 10000, quantidade))
+            )
+
+
+def pico_rss_mb():
+    # Maior memoria residente usada pelo processo ate agora, None onde o modulo resource nao existe
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # No macOS o valor vem em bytes, no Linux em kilobytes
+    return pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024
+
+
+def _percentis(duracoes) -> dict:
+    # p50, p90 e p99 das duracoes (em segundos) convertidos para ms
+    ordenadas = sorted(duracoes)
+    return {f"p{int(fracao * 100)}_ms": ordenadas[min(len(ordenadas) - 1, int(fracao * len(ordenadas)))] * 1000
+            for fracao in (0.5, 0.9, 0.99)}
+
+
+def _medir(funcao, argumentos, itens_por_chamada=1) -> dict:
+    # Chama a funcao uma vez para cada argumento e devolve vazao (itens por segundo), percentis e o pico de memoria
+    duracoes = []
+    for argumento in argumentos:
+        inicio = time.perf_counter()
+        funcao(argumento)
+        duracoes.append(time.perf_counter() - inicio)
+    total = sum(duracoes)
+    return {"chamadas": len(duracoes), "duracao_s": total,
+            "vazao": len(duracoes) * itens_por_chamada / total if total else None,
+            **_percentis(duracoes), "pico_rss_mb": pico_rss_mb()}
+
+
+def medir_tamanho(quantidade, pasta, amostras=1000, tamanho_lote=1000, repeticoes=3, semente=42) -> dict:
+    # Gera a tabela sintetica com a quantidade de alimentos pedida e mede cada operacao
+    caminho_csv = os.path.join(pasta, "alimentos_sinteticos.csv")
+    print(f"Gerando {quantidade} alimentos sintéticos...")
+    gerar_csv_sintetico(caminho_csv, quantidade, semente)
+
+    repo = AlimentoRepository(os.path.join(pasta, "benchmark.db"))
+    try:
+        repo.preparar_banco()
+        resultados = {"inserir_dados_csv": _medir(repo.inserir_dados_csv, [caminho_csv], quantidade)}
+
+        sorteio = random.Random(semente)
+        nomes = [_nome_sintetico(sorteio.randrange(quantidade)) for _ in range(amostras)]
+        lotes = [[_nome_sintetico(sorteio.randrange(quantidade)) for _ in range(tamanho_lote)]
+                 for _ in range(max(1, amostras // tamanho_lote))]
+
+        resultados["obter_dados_nutricionais"] = _medir(repo.obter_dados_nutricionais, nomes)
+        repo_memoria = AlimentoRepository(os.path.join(pasta, "benchmark.db"), em_memoria=True)
+        try:
+            repo_memoria.carregar_memoria()
+            resultados["obter_dados_nutricionais_memoria"] = _medir(repo_memoria.obter_dados_nutricionais, nomes)
+        finally:
+            repo_memoria.fechar_conexao()
+
+        # Sem cache cada chamada vai ao banco, com cache a segunda passada mede so a memoria
+        resultados["analisar_alimento"] = _medir(AgenteDeRisco(repo, tamanho_cache=0).analisar_alimento, nomes)
+        agente = AgenteDeRisco(repo, tamanho_cache=amostras)
+        for nome in nomes:
+            agente.analisar_alimento(nome)
+        resultados["analisar_alimento_cache"] = _medir(agente.analisar_alimento, nomes)
+
+        resultados["analisar_alimentos_lote"] = _medir(agente.analisar_alimentos_lote, lotes, tamanho_lote)
+
+        # Refeicoes de 3 a 12 alimentos com porcoes de 20g a 300g, a vazao e em refeicoes por segundo
+        refeicoes = [[(_nome_sintetico(sorteio.randrange(quantidade)), sorteio.randint(20, 300))
+                      for _ in range(sorteio.randint(3, 12))] for _ in range(amostras)]
+        resultados["analisar_refeicoes"] = _medir(
+            agente.analisar_refeicoes,
+            [refeicoes[inicio:inicio + REFEICOES_POR_LOTE] for inicio in range(0, len(refeicoes), REFEICOES_POR_LOTE)],
+            REFEICOES_POR_LOTE)
+        resultados["estatisticas"] = _medir(lambda _: calcular_tabela_estatisticas(repo), range(repeticoes),
+                                            quantidade)
+
+        caminho_relatorio = os.path.join(pasta, "relatorio.csv")
+        resultados["exportar_relatorio_csv"] = _medir(
+            lambda _: gravar_relatorio_csv(repo, caminho_relatorio), range(repeticoes), quantidade)
+        resultados["exportar_relatorio_csv_risco"] = _medir(
+            lambda _: gravar_relatorio_csv(repo, caminho_relatorio, agente), range(repeticoes), quantidade)
+        return resultados
+    finally:
+        repo.fechar_conexao()
+
+
+def _medir_em_processo(quantidade, argumentos) -> dict:
+    # Cada tamanho roda num processo separado para o pico de memoria ser so daquele tamanho
+    pasta = tempfile.mkdtemp(prefix=f"benchmark_{quantidade}_", dir=argumentos.pasta)
+    try:
+        saida = os.path.join(pasta, "resultado.json")
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--executar-tamanho", str(quantidade),
+                        "--pasta", pasta, "--saida", saida, "--amostras", str(argumentos.amostras),
+                        "--tamanho-lote", str(argumentos.tamanho_lote), "--repeticoes", str(argumentos.repeticoes)],
+                       check=True)
+        with open(saida, encoding="utf-8") as arquivo:
+            return json.load(arquivo)
+    finally:
+        if not argumentos.manter:
+            shutil.rmtree(pasta, ignore_errors=True)
+
+
+def comparar_com_base(resultados, base, tolerancia=TOLERANCIA_PADRAO) -> list[str]:
+    # Compara vazao (maior e melhor) e p99 (menor e melhor) de cada operacao com a base
+    # Devolve a descricao de cada medida que piorou mais que a tolerancia
+    regressoes = []
+    for tamanho, operacoes in resultados.items():
+        for operacao, medidas in operacoes.items():
+            anterior = base.get(tamanho, {}).get(operacao)
+            if not anterior:
+                continue
+            if anterior.get("vazao") and medidas.get("vazao") is not None \
+                    and medidas["vazao"] < anterior["vazao"] * (1 - tolerancia):
+                regressoes.append(f"{tamanho} {operacao}: vazão {medidas['vazao']:.1f}/s "
+                                  f"(base {anterior['vazao']:.1f}/s)")
+            if anterior.get("p99_ms") and medidas["p99_ms"] > anterior["p99_ms"] * (1 + tolerancia):
+                regressoes.append(f"{tamanho} {operacao}: p99 {medidas['p99_ms']:.3f} ms "
+                                  f"(base {anterior['p99_ms']:.3f} ms)")
+    return regressoes
+
+
+def exibir_resultados(resultados):
+    for tamanho, operacoes in resultados.items():
+        print(f"\n--- {tamanho} alimentos ---")
+        print(f"{'OPERAÇÃO':<32}{'VAZÃO/s':>14}{'P50 ms':>12}{'P99 ms':>12}{'RSS MB':>10}")
+        for operacao, medidas in operacoes.items():
+            pico = medidas["pico_rss_mb"]
+            print(f"{operacao:<32}{medidas['vazao'] or 0:>14.1f}{medidas['p50_ms']:>12.3f}{medidas['p99_ms']:>12.3f}"
+                  f"{pico if pico is not None else float('nan'):>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede o desempenho do Agente Nutricional com tabelas sintéticas")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=list(TAMANHOS_PADRAO),
+                        help="Quantidades de alimentos das tabelas sintéticas")
+    parser.add_argument("--amostras", type=int, default=1000, help="Consultas medidas uma a uma em cada tamanho")
+    parser.add_argument("--tamanho-lote", type=int, default=1000, help="Alimentos em cada análise em lote")
+    parser.add_argument("--repeticoes", type=int, default=3, help="Repetições das leituras da tabela inteira")
+    parser.add_argument("--saida", default=ARQUIVO_RESULTADOS, help="Arquivo JSON com os resultados")
+    parser.add_argument("--base", default=ARQUIVO_BASE, help="Arquivo JSON com os resultados de referência")
+    parser.add_argument("--gravar-base", action="store_true", help="Grava os resultados como a nova base")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA_PADRAO,
+                        help="Piora aceita em relação à base antes de falhar (0.25 = 25%%)")
+    parser.add_argument("--pasta", default=None, help="Pasta para os bancos temporários")
+    parser.add_argument("--manter", action="store_true", help="Não apaga os bancos e csv gerados")
+    parser.add_argument("--executar-tamanho", type=int, default=None, help=argparse.SUPPRESS)
+    argumentos = parser.parse_args()
+
+    if argumentos.executar_tamanho is not None:
+        # Processo filho: mede um tamanho so e grava o resultado para o processo principal
+        resultado = medir_tamanho(argumentos.executar_tamanho, argumentos.pasta, argumentos.amostras,
+                                  argumentos.tamanho_lote, argumentos.repeticoes)
+        with open(argumentos.saida, "w", encoding="utf-8") as arquivo:
+            json.dump(resultado, arquivo)
+        return
+
+    if argumentos.pasta:
+        # O mkdtemp nao cria a pasta pai, entao uma --pasta nova precisa existir antes
+        os.makedirs(argumentos.pasta, exist_ok=True)
+    resultados = {str(tamanho): _medir_em_processo(tamanho, argumentos) for tamanho in argumentos.tamanhos}
+    exibir_resultados(resultados)
+
+    with open(argumentos.saida, "w", encoding="utf-8") as arquivo:
+        json.dump({"gerado_em": datetime.now(timezone.utc).isoformat(), "python": platform.python_version(),
+                   "plataforma": platform.platform(), "resultados": resultados}, arquivo, ensure_ascii=False, indent=2)
+    print(f"\nResultados gravados em {argumentos.saida}")
+
+    if argumentos.gravar_base:
+        shutil.copyfile(argumentos.saida, argumentos.base)
+        print(f"Base atualizada em {argumentos.base}")
+        return
+
+    if not os.path.exists(argumentos.base):
+        print(f"Sem base em {argumentos.base} para comparar, use --gravar-base para criar uma.")
+        return
+
+    with open(argumentos.base, encoding="utf-8") as arquivo:
+        regressoes = comparar_com_base(resultados, json.load(arquivo)["resultados"], argumentos.tolerancia)
+    if regressoes:
+        print(f"\nREGRESSÃO DE DESEMPENHO ({len(regressoes)} medidas piores que a base):", file=sys.stderr)
+        for regressao in regressoes:
+            print(f"  {regressao}", file=sys.stderr)
+        sys.exit(1)
+    print("Nenhuma regressão em relação à base.")
+
+
+if __name__ == '__main__':
+    main()
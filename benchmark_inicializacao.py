@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Pasta onde estao o main.py e os outros modulos do projeto
+PASTA_PROJETO = os.path.dirname(os.path.abspath(__file__))
+
+# Textos que marcam na saida do main.py que o menu e a lista de alimentos ja apareceram
+TEXTO_MENU = "Escolha uma op".encode("utf-8")
+TEXTO_LISTA = "sair:".encode("utf-8")
+
+# Modulos que nao deveriam ser importados antes do menu aparecer
+MODULOS_PESADOS = ("sqlalchemy", "numpy", "database", "agente", "snapshot")
+
+
+def medir_imports(modulo="main") -> dict:
+    # Roda o python com -X importtime e devolve o tempo de import (em ms) de cada modulo de primeiro nivel
+    # Os modulos importados por dentro de outros entram no tempo acumulado de quem importou
+    processo = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+                              cwd=PASTA_PROJETO, capture_output=True, text=True, check=True)
+    modulos = {}
+    importados = set()
+    for linha in processo.stderr.splitlines():
+        if not linha.startswith("import time:") or "cumulative" in linha:
+            continue
+        _, acumulado, nome = linha[len("import time:"):].split("|")
+        importados.add(nome.strip().split(".")[0])
+        # Modulo de primeiro nivel nao tem espaco extra antes do nome
+        if not nome.startswith("  "):
+            modulos[nome.strip()] = int(acumulado) / 1000
+    return {"modulos": modulos, "total_ms": sum(modulos.values()),
+            "pesados_importados": sorted(importados.intersection(MODULOS_PESADOS))}
+
+
+def _ler_ate(processo, texto, inicio) -> float:
+    # Le a saida do processo ate o texto aparecer e devolve quantos ms se passaram desde o inicio
+    lido = b""
+    while texto not in lido:
+        pedaco = os.read(processo.stdout.fileno(), 65536)
+        if not pedaco:
+            raise RuntimeError(f"O programa terminou antes de mostrar {texto!r}.")
+        lido += pedaco
+    return (time.perf_counter() - inicio) * 1000
+
+
+def medir_execucao(diretorio) -> tuple:
+    # Abre o main.py e mede o tempo ate o primeiro menu e ate a primeira lista de alimentos (banco pronto)
+    inicio = time.perf_counter()
+    processo = subprocess.Popen([sys.executable, "-u", os.path.join(PASTA_PROJETO, "main.py")], cwd=diretorio,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        primeiro_menu = _ler_ate(processo, TEXTO_MENU, inicio)
+        processo.stdin.write(b"2\n")
+        processo.stdin.flush()
+        primeira_lista = _ler_ate(processo, TEXTO_LISTA, inicio)
+        processo.communicate(b"s\n6\n", timeout=60)
+    finally:
+        if processo.poll() is None:
+            processo.kill()
+    return primeiro_menu, primeira_lista
+
+
+def resumir(valores) -> dict:
+    return {"mediana_ms": statistics.median(valores), "minimo_ms": min(valores), "maximo_ms": max(valores)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede o tempo de import e de inicializacao do main.py")
+    parser.add_argument("--repeticoes", type=int, default=5, help="Quantas vezes abrir o programa")
+    parser.add_argument("--diretorio", default=".", help="Pasta onde o programa roda (banco e csv ficam nela)")
+    parser.add_argument("--json", help="Arquivo para gravar o resultado em JSON")
+    parser.add_argument("--limite-menu-ms", type=float, default=None,
+                        help="Falha (codigo 1) se a mediana ate o primeiro menu passar deste valor")
+    argumentos = parser.parse_args()
+    # O Popen falha com cwd inexistente, e uma pasta nova e o caso de medir a primeira execucao do zero
+    os.makedirs(argumentos.diretorio, exist_ok=True)
+
+    imports = medir_imports()
+    print(f"Import do main: {imports['total_ms']:.1f} ms")
+    for nome, tempo in sorted(imports["modulos"].items(), key=lambda item: item[1], reverse=True)[:10]:
+        print(f"  {nome:<30} {tempo:>8.1f} ms")
+    if imports["pesados_importados"]:
+        print(f"Aviso: importados antes do menu: {', '.join(imports['pesados_importados'])}")
+
+    # A primeira execucao pode criar o banco e ler o csv, ela e mostrada separada das outras
+    execucoes = [medir_execucao(argumentos.diretorio) for _ in range(argumentos.repeticoes + 1)]
+    primeira, demais = execucoes[0], execucoes[1:] or execucoes
+    resultado = {
+        "imports": imports,
+        "primeira_execucao": {"primeiro_menu_ms": primeira[0], "primeira_lista_ms": primeira[1]},
+        "primeiro_menu": resumir([menu for menu, _ in demais]),
+        "primeira_lista": resumir([lista for _, lista in demais]),
+    }
+
+    print(f"Primeira execução: menu em {primeira[0]:.1f} ms, lista em {primeira[1]:.1f} ms")
+    for chave, titulo in (("primeiro_menu", "Até o menu"), ("primeira_lista", "Até a lista (banco pronto)")):
+        resumo = resultado[chave]
+        print(f"{titulo:<28} mediana {resumo['mediana_ms']:>8.1f} ms  "
+              f"min {resumo['minimo_ms']:>8.1f} ms  max {resumo['maximo_ms']:>8.1f} ms")
+
+    if argumentos.json:
+        with open(argumentos.json, "w", encoding="utf-8") as arquivo:
+            json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+
+    if argumentos.limite_menu_ms is not None and resultado["primeiro_menu"]["mediana_ms"] > argumentos.limite_menu_ms:
+        print(f"Regressão: menu levou mais de {argumentos.limite_menu_ms:.0f} ms.")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
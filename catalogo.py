@@ -0,0 +1,202 @@
+import threading
+from array import array
+from typing import NamedTuple
+
+# Colunas de nutrientes na mesma ordem do banco e do csv
+COLUNAS_CATALOGO = ("sodio", "gordura_saturada", "fibra", "proteina", "carboidrato")
+
+# Quantidade de alimentos processados de uma vez nos calculos com numpy
+TAMANHO_BLOCO_CATALOGO = 1000000
+
+# Cada nivel de risco vira um numero pequeno, guardado num byte por alimento em vez de um texto
+# Riscos novos (de regras de decisao personalizadas) ganham o proximo numero na primeira vez que aparecem
+_riscos = ["VERDE", "AMARELO", "VERMELHO", "CINZA"]
+_codigos_risco = {risco: codigo for codigo, risco in enumerate(_riscos)}
+_trava_riscos = threading.Lock()
+
+
+def codigo_risco(risco: str) -> int:
+    codigo = _codigos_risco.get(risco)
+    if codigo is None:
+        with _trava_riscos:
+            codigo = _codigos_risco.get(risco)
+            if codigo is None:
+                codigo = _codigos_risco[risco] = len(_riscos)
+                _riscos.append(risco)
+    return codigo
+
+
+def nome_risco(codigo: int) -> str:
+    return _riscos[codigo]
+
+
+class NutrientesAlimento(NamedTuple):
+    # Nutrientes de um alimento por 100g, devolvido pelas consultas de um alimento so
+    sodio: float
+    gordura_saturada: float
+    fibra: float
+    proteina: float
+    carboidrato: float
+
+
+class ResultadoAnalise(NamedTuple):
+    # Resultado do analisar_alimento, continua sendo uma tupla de 8 posicoes para quem desempacota
+    risco: str
+    classificacao: str
+    descricao: str
+    sodio: float
+    gordura_saturada: float
+    fibra: float
+    proteina: float
+    carboidrato: float
+
+
+class ItemRefeicao(NamedTuple):
+    # Um alimento de uma refeicao: a analise dele por 100g (a mesma do analisar_alimento) e os nutrientes da porcao
+    nome: str
+    gramas: float
+    analise: ResultadoAnalise
+    porcao: NutrientesAlimento
+
+
+class ResultadoRefeicao(NamedTuple):
+    # Analise de uma refeicao ou de um dia inteiro
+    # A classificacao usa os nutrientes por 100g da refeicao (totais divididos pelas gramas), como os limites do agente
+    # Os alimentos que nao existem no banco aparecem nos itens mas ficam fora dos totais e das gramas
+    analise: ResultadoAnalise
+    gramas: float
+    totais: NutrientesAlimento
+    itens: list
+
+
+class Alternativa(NamedTuple):
+    # Alimento sugerido no lugar de outro, com a distancia entre os nutrientes padronizados dos dois
+    nome: str
+    distancia: float
+    classificacao: str
+    nutrientes: NutrientesAlimento
+
+
+class CatalogoNutrientes:
+    # Guarda muitos alimentos como colunas (um array por nutriente) em vez de uma tupla por alimento
+    # Cada alimento ocupa 8 bytes por nutriente, mais 8 do id e 1 da regra ativada quando eles existem
+    # As colunas podem ser array('d'), arrays do numpy ou arrays mapeados do disco (snapshot)
+    __slots__ = ("colunas", "ids", "_nomes", "_posicoes", "indices_regra")
+
+    def __init__(self, colunas, nomes=None, ids=None):
+        self.colunas = dict(zip(COLUNAS_CATALOGO, (colunas[coluna] for coluna in COLUNAS_CATALOGO)))
+        self.ids = ids
+        self._nomes = nomes
+        self._posicoes = None
+        # Indice da regra de decisao de cada alimento, preenchido pelo classificar
+        self.indices_regra = None
+
+    @classmethod
+    def de_linhas(cls, linhas, coluna_nome=None, coluna_id=None):
+        # Monta o catalogo a partir de linhas vindas do banco, os nutrientes sao sempre as 5 ultimas colunas
+        # coluna_nome e coluna_id dizem em que posicao da linha ficam o nome e o id, se existirem
+        colunas = {coluna: array("d") for coluna in COLUNAS_CATALOGO}
+        nomes = [] if coluna_nome is not None else None
+        ids = array("q") if coluna_id is not None else None
+        catalogo = cls(colunas, nomes, ids)
+        catalogo.estender(linhas, coluna_nome, coluna_id)
+        return catalogo
+
+    @classmethod
+    def do_repositorio(cls, repo, com_nomes=False, tamanho_lote=10000):
+        # Le a tabela de alimentos inteira em lotes direto para as colunas, sem guardar as linhas
+        if not com_nomes:
+            catalogo = cls.de_linhas([])
+            for lote in repo.iterar_lotes_nutrientes(tamanho_lote):
+                catalogo.estender(lote)
+            return catalogo
+        catalogo = cls.de_linhas([], coluna_nome=1, coluna_id=0)
+        for lote in repo.iterar_lotes_alimentos(tamanho_lote):
+            catalogo.estender(lote, coluna_nome=1, coluna_id=0)
+        return catalogo
+
+    def estender(self, linhas, coluna_nome=None, coluna_id=None):
+        # Acrescenta linhas no fim das colunas, so funciona com colunas array('d')
+        if not linhas:
+            return
+        transpostas = list(zip(*linhas))
+        for coluna, valores in zip(COLUNAS_CATALOGO, transpostas[-5:]):
+            self.colunas[coluna].extend(valores)
+        if coluna_nome is not None:
+            self._nomes.extend(transpostas[coluna_nome])
+            self._posicoes = None
+        if coluna_id is not None:
+            self.ids.extend(transpostas[coluna_id])
+        self.indices_regra = None
+
+    def __len__(self):
+        return len(self.colunas["sodio"])
+
+    @property
+    def nomes(self):
+        return self._nomes
+
+    def posicao(self, nome):
+        # Posicao do alimento nas colunas, o mapa de nomes so e montado na primeira busca
+        if self._posicoes is None:
+            self._posicoes = {nome: posicao for posicao, nome in enumerate(self.nomes)}
+        return self._posicoes.get(nome)
+
+    def nutrientes(self, posicao) -> NutrientesAlimento:
+        return NutrientesAlimento(*(float(self.colunas[coluna][posicao]) for coluna in COLUNAS_CATALOGO))
+
+    def colunas_numpy(self) -> list:
+        # As colunas como arrays do numpy, sem copia (array('d') e lido direto pelo buffer)
+        import numpy as np
+
+        return [np.frombuffer(self.colunas[coluna], dtype=np.float64) if isinstance(self.colunas[coluna], array)
+                else self.colunas[coluna] for coluna in COLUNAS_CATALOGO]
+
+    def matriz(self):
+        # Junta as colunas numa matriz com uma linha por alimento, aqui sim os dados sao copiados
+        import numpy as np
+
+        return np.column_stack(self.colunas_numpy())
+
+    def iterar_blocos(self, tamanho_bloco=TAMANHO_BLOCO_CATALOGO):
+        # Entrega fatias das colunas (inicio, colunas) sem copiar, para limitar a memoria dos calculos
+        colunas = self.colunas_numpy()
+        for inicio in range(0, len(self), tamanho_bloco):
+            yield inicio, [coluna[inicio:inicio + tamanho_bloco] for coluna in colunas]
+
+    def classificar(self, agente, tamanho_bloco=TAMANHO_BLOCO_CATALOGO):
+        # Guarda e devolve o indice da regra de decisao de cada alimento (um byte por alimento)
+        import numpy as np
+
+        indices = np.empty(len(self), dtype=np.uint8)
+        for inicio, colunas in self.iterar_blocos(tamanho_bloco):
+            indices[inicio:inicio + len(colunas[0])] = agente.classificar_colunas(*colunas)
+        self.indices_regra = indices
+        return indices
+
+    def codigos_risco(self, agente):
+        # Codigo do risco de cada alimento (ver codigo_risco), calculado a partir das regras ativadas
+        import numpy as np
+
+        tabela = np.array([codigo_risco(regra["risco"]) for regra in agente.regras_decisao], dtype=np.uint8)
+        return tabela[self.classificar(agente)]
+
+    def contar_por_risco(self, agente) -> dict:
+        # Quantidade de alimentos em cada risco segundo os limites e regras do agente
+        import numpy as np
+
+        quantidades = np.bincount(self.codigos_risco(agente), minlength=len(_riscos)).tolist()
+        return {nome_risco(codigo): quantidade for codigo, quantidade in enumerate(quantidades) if quantidade}
+
+    def estatisticas(self) -> dict:
+        # Acumuladores de media e variancia de cada nutriente, coluna por coluna
+        from estatistica import calcular_estatisticas_numpy
+
+        return {coluna: calcular_estatisticas_numpy(valores, (coluna,))[coluna]
+                for coluna, valores in zip(COLUNAS_CATALOGO, self.colunas_numpy())}
+
+    def sketches(self, k=200, tamanho_bloco=10000) -> dict:
+        # Resumos de percentis e moda de cada nutriente, os mesmos do calcular_sketches_colunas
+        from estatistica import calcular_sketches_catalogos
+
+        return calcular_sketches_catalogos([self], k, tamanho_bloco)
@@ -1,9 +1,23 @@
+from __future__ import annotations
+
 import os
 import csv
 import sys
-from database import AlimentoRepository
-from agente import AgenteDeRisco
-from estatistica import calcular_media, calcular_variancia_e_desvio
+from typing import TYPE_CHECKING
+
+from catalogo import CatalogoNutrientes
+from estatistica import calcular_estatisticas_agregadas, calcular_sketches_catalogos
+
+# O banco e o agente puxam o SQLAlchemy, que e lento de importar
+# Aqui eles so aparecem nas anotacoes, assim o menu pode ser mostrado antes de qualquer import pesado
+if TYPE_CHECKING:
+    from database import AlimentoRepository
+    from agente import AgenteDeRisco
+
+
+# Nomes mostrados por pagina na listagem de alimentos (3 colunas de 20 linhas)
+ALIMENTOS_POR_PAGINA = 60
+COLUNAS_LISTAGEM = 3
 
 
 class Cor:
@@ -18,8 +32,9 @@ class Cor:
 
 
 def limpar_tela():
-    # Limpa a tela do terminal dependendo do sistema operacional
-    os.system('cls' if os.name == 'nt' else 'clear')
+    # Limpa a tela com codigos ANSI (os mesmos das cores), sem abrir um processo do cls ou do clear
+    # Volta o cursor para o topo, apaga a tela e o historico de rolagem
+    print("\033[H\033[2J\033[3J", end="", flush=True)
 
 
 def formatar_alerta(risco: str, classificacao: str) -> str:
@@ -44,7 +59,8 @@ def exibir_menu():
     print(f"{Cor.VERDE}2{Cor.RESET}. Listar Alimentos Disponíveis")
     print(f"{Cor.VERDE}3{Cor.RESET}. Exportar Relatório CSV (Dados Brutos)")
     print(f"{Cor.VERDE}4{Cor.RESET}. Análise Estatística (Média, Desvio Padrão)")
-    print(f"{Cor.VERMELHO}5{Cor.RESET}. Sair")
+    print(f"{Cor.VERDE}5{Cor.RESET}. Métricas de Desempenho")
+    print(f"{Cor.VERMELHO}6{Cor.RESET}. Sair")
     print(f"{Cor.AZUL}-----------------------------------------{Cor.RESET}")
     return input("Escolha uma opção: ")
 
@@ -58,8 +74,23 @@ def exibir_analise(agente: AgenteDeRisco):
     if not nome_digitado:
         return
 
-    # Arruma o nome para ficar igual ao que esta no banco com a primeira letra maiuscula
-    nome_padronizado = nome_digitado.title()
+    # Acha o nome como esta no banco mesmo sem acento ou com maiusculas e minusculas diferentes
+    nome_padronizado = agente.repo.buscar_nome_alimento(nome_digitado)
+
+    # Se nao achar mostra os nomes mais parecidos para o usuario escolher
+    if nome_padronizado is None:
+        sugestoes = agente.repo.buscar_alimentos_parecidos(nome_digitado)
+        if sugestoes:
+            print(f"\n{Cor.AMARELO}Alimento não encontrado. Você quis dizer:{Cor.RESET}")
+            for i, sugestao in enumerate(sugestoes, start=1):
+                print(f"  {Cor.VERDE}{i}{Cor.RESET}. {sugestao}")
+            escolha = input("Escolha o número do alimento (ENTER para cancelar): ").strip()
+            if escolha.isdigit() and 1 <= int(escolha) <= len(sugestoes):
+                nome_padronizado = sugestoes[int(escolha) - 1]
+
+    # Sem nenhuma escolha segue com o nome digitado e o agente informa que nao encontrou
+    if nome_padronizado is None:
+        nome_padronizado = nome_digitado.title()
 
     # Pede pro agente analisar esse alimento
     resultado = agente.analisar_alimento(nome_padronizado)
@@ -80,91 +111,210 @@ def exibir_analise(agente: AgenteDeRisco):
     print(f"  > Fibra: {fibra:.2f} g")
     print(f"  > Proteína: {proteina:.2f} g")
 
+    # Para alimento de risco alto mostra alimentos saudaveis com nutrientes parecidos
+    if risco == "VERMELHO":
+        alternativas = agente.sugerir_alternativas(nome_padronizado, k=3)
+        if alternativas:
+            print(f"\n{Cor.VERDE}Alternativas mais saudáveis e parecidas:{Cor.RESET}")
+            for alternativa in alternativas:
+                print(f"  > {alternativa.nome} ({alternativa.classificacao})")
+
     input(f"\nPressione {Cor.AZUL}ENTER{Cor.RESET} para continuar...")
 
 
 def listar_alimentos(repo: AlimentoRepository):
-    # Mostra todos os nomes de alimentos que estao no banco
-    limpar_tela()
-    print(f"{Cor.AZUL}--- ALIMENTOS DISPONÍVEIS ---\n{Cor.RESET}")
-
-    alimentos = repo.obter_todos_alimentos()
+    # Mostra os nomes de alimentos do banco uma pagina por vez, com filtro pelo comeco do nome
+    # Cada pagina busca so os nomes dela no banco, a lista inteira nunca e carregada
+    prefixo = None
+    # Ultimo nome antes de cada pagina ja mostrada, para poder voltar
+    inicios = [None]
+    while True:
+        # Um nome a mais so para saber se existe proxima pagina
+        alimentos = repo.listar_alimentos_pagina(inicios[-1], ALIMENTOS_POR_PAGINA + 1, prefixo)
+        tem_proxima = len(alimentos) > ALIMENTOS_POR_PAGINA
+        alimentos = alimentos[:ALIMENTOS_POR_PAGINA]
 
-    if not alimentos:
-        print(f"{Cor.VERMELHO}Nenhum alimento encontrado no banco de dados.{Cor.RESET}")
-        return
+        limpar_tela()
+        filtro = f" (começando com '{prefixo}')" if prefixo else ""
+        print(f"{Cor.AZUL}--- ALIMENTOS DISPONÍVEIS{filtro} - PÁGINA {len(inicios)} ---\n{Cor.RESET}")
 
-    # Organiza a lista em colunas para ficar bonito
-    max_len = max(len(a) for a in alimentos) if alimentos else 0
-    cols = 3
-    for i, alimento in enumerate(alimentos):
-        print(f"{alimento:<{max_len + 3}}", end="")
-        if (i + 1) % cols == 0:
+        if not alimentos:
+            print(f"{Cor.VERMELHO}Nenhum alimento encontrado no banco de dados.{Cor.RESET}")
+        else:
+            # Organiza a pagina em colunas para ficar bonito
+            max_len = max(len(a) for a in alimentos)
+            for i, alimento in enumerate(alimentos):
+                print(f"{alimento:<{max_len + 3}}", end="")
+                if (i + 1) % COLUNAS_LISTAGEM == 0:
+                    print()
             print()
 
-    print("\n")
-    input(f"Pressione {Cor.AZUL}ENTER{Cor.RESET} para continuar...")
-
-
-def exportar_relatorio_csv(repo: AlimentoRepository):
+        opcoes = []
+        if tem_proxima:
+            opcoes.append(f"{Cor.AZUL}ENTER{Cor.RESET} próxima página")
+        if len(inicios) > 1:
+            opcoes.append(f"{Cor.AZUL}v{Cor.RESET} voltar")
+        opcoes.append(f"{Cor.AZUL}/texto{Cor.RESET} filtrar pelo começo do nome ({Cor.AZUL}/{Cor.RESET} limpa)")
+        sair = f"{Cor.AZUL}s{Cor.RESET}" if tem_proxima else f"{Cor.AZUL}ENTER{Cor.RESET} ou {Cor.AZUL}s{Cor.RESET}"
+        opcoes.append(f"{sair} sair")
+        escolha = input("\n" + " | ".join(opcoes) + ": ").strip()
+
+        if escolha.startswith("/"):
+            prefixo = escolha[1:].strip() or None
+            inicios = [None]
+        elif escolha.lower() == "v" and len(inicios) > 1:
+            inicios.pop()
+        elif escolha == "" and tem_proxima:
+            inicios.append(alimentos[-1])
+        elif escolha == "" or escolha.lower() == "s":
+            return
+
+
+def gravar_relatorio_csv(repo: AlimentoRepository, caminho_saida="relatorio_nutricional.csv",
+                         agente: AgenteDeRisco = None) -> int:
+    # Grava o relatorio csv lendo e escrevendo os alimentos aos poucos, devolve quantos foram gravados
+    # Com agente grava tambem o risco e a classificacao calculados de cada alimento
+    cabecalho = ["Nome_Alimento", "Sodio", "Gordura_Saturada", "Fibra", "Proteina", "Carboidrato"]
+    if agente is not None:
+        cabecalho += ["Risco", "Classificacao"]
+
+    total = 0
+    with open(caminho_saida, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(cabecalho)
+        for lote in repo.iterar_lotes_relatorio():
+            if agente is not None:
+                writer.writerows(tuple(linha) + classificacao
+                                 for linha, classificacao in zip(lote, agente.classificar_linhas(lote)))
+            else:
+                writer.writerows(lote)
+            total += len(lote)
+    return total
+
+
+def exportar_relatorio_csv(repo: AlimentoRepository, agente: AgenteDeRisco = None,
+                           caminho_saida="relatorio_nutricional.csv"):
     # Cria um arquivo csv com todos os dados
-    caminho_saida = "relatorio_nutricional.csv"
-    dados = repo.obter_dados_relatorio()
+    # Os alimentos sao lidos e gravados aos poucos para a memoria nao crescer com o tamanho da tabela
 
-    cabecalho = ["Nome_Alimento", "Sodio", "Gordura_Saturada", "Fibra", "Proteina", "Carboidrato"]
+    # Se tiver agente pergunta se deve gravar tambem o risco calculado de cada alimento
+    incluir_risco = False
+    if agente is not None:
+        incluir_risco = input("Incluir o risco calculado pelo agente? (s/N): ").strip().lower() == 's'
 
     try:
-        with open(caminho_saida, 'w', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow(cabecalho)
-            writer.writerows(dados)
-        print(f"\n{Cor.VERDE}SUCESSO:{Cor.RESET} Relatório exportado para {caminho_saida}")
+        total = gravar_relatorio_csv(repo, caminho_saida, agente if incluir_risco else None)
+        print(f"\n{Cor.VERDE}SUCESSO:{Cor.RESET} Relatório com {total} alimentos exportado para {caminho_saida}")
     except Exception as e:
         print(f"\n{Cor.VERMELHO}ERRO:{Cor.RESET} Não foi possível exportar o arquivo: {e}")
 
     input(f"\nPressione {Cor.AZUL}ENTER{Cor.RESET} para continuar...")
 
 
+def calcular_tabela_estatisticas(repo: AlimentoRepository) -> dict:
+    # Junta o que a tela de estatisticas mostra de cada nutriente
+    # media, variancia e desvio padrao e os percentis P50, P90 e P99
+    # Usa os totais mantidos pelo banco, a conta nao depende do tamanho da tabela
+    acumuladores = calcular_estatisticas_agregadas(repo.obter_estatisticas_agregadas())
+
+    # Os percentis vem de resumos de tamanho fixo montados enquanto os nutrientes sao lidos do banco
+    # Cada lote vira um catalogo com uma coluna por nutriente antes de entrar nos resumos
+    sketches = calcular_sketches_catalogos(CatalogoNutrientes.de_linhas(lote)
+                                           for lote in repo.iterar_lotes_nutrientes())
+
+    tabela = {}
+    for coluna, acumulador in acumuladores.items():
+        p50, p90, p99 = (valor or 0.0 for valor in sketches[coluna][0].percentis([0.5, 0.9, 0.99]))
+        tabela[coluna] = (acumulador.quantidade, acumulador.media, acumulador.variancia(),
+                          acumulador.desvio_padrao(), p50, p90, p99)
+    return tabela
+
+
 def exibir_estatisticas(repo: AlimentoRepository):
     # Calcula e mostra media e variacao dos nutrientes
     limpar_tela()
     print(f"{Cor.AZUL}--- ANÁLISE ESTATÍSTICA NUTRICIONAL (DISPERSÃO) ---\n{Cor.RESET}")
-    alimentos = repo.obter_todos_alimentos()
-    print(f"{Cor.MAGENTA}Cálculos baseados em {len(alimentos)} alimentos do BD.{Cor.RESET}\n")
 
-    colunas_analise = ["sodio", "gordura_saturada", "fibra", "proteina", "carboidrato"]
+    tabela = calcular_tabela_estatisticas(repo)
+    quantidade = tabela["sodio"][0]
+    print(f"{Cor.MAGENTA}Cálculos baseados em {quantidade} alimentos do BD.{Cor.RESET}\n")
 
-    print(f"{'NUTRIENTE':<20}{'MÉDIA':>10}{'VAR.':>10}{'DESV. PADRÃO':>15}")
-    print("=" * 55)
+    print(f"{'NUTRIENTE':<20}{'MÉDIA':>10}{'VAR.':>10}{'DESV. PADRÃO':>15}{'P50':>10}{'P90':>10}{'P99':>10}")
+    print("=" * 85)
 
-    for coluna in colunas_analise:
-        # Busca todos os valores daquela coluna no banco
-        dados = repo.obter_valores_coluna(coluna)
+    for coluna, (_, media, variancia, desvio_padrao, p50, p90, p99) in tabela.items():
+        print(f"{coluna.upper():<20}{media:>10.2f}{variancia:>10.2f}{desvio_padrao:>15.2f}"
+              f"{p50:>10.2f}{p90:>10.2f}{p99:>10.2f}")
 
-        # Faz as contas matematicas
-        media = calcular_media(dados)
-        variancia, desvio_padrao = calcular_variancia_e_desvio(dados)
+    print("\n*Unidades: Sódio (mg), Outros (g). Percentis aproximados.")
+    input(f"\nPressione {Cor.AZUL}ENTER{Cor.RESET} para continuar...")
 
-        print(f"{coluna.upper():<20}{media:>10.2f}{variancia:>10.2f}{desvio_padrao:>15.2f}")
 
-    print("\n*Unidades: Sódio (mg), Outros (g).")
-    input(f"\nPressione {Cor.AZUL}ENTER{Cor.RESET} para continuar...")
+def exibir_metricas():
+    # Mostra os tempos e contadores das operacoes instrumentadas e das consultas SQL
+    import metricas
 
+    limpar_tela()
+    print(f"{Cor.AZUL}--- MÉTRICAS DE DESEMPENHO ---\n{Cor.RESET}")
+
+    if not metricas.metricas_ativas():
+        print(f"{Cor.AMARELO}As métricas estão desligadas "
+              f"(defina {metricas.VARIAVEL_METRICAS}=1 para ligar desde o início).{Cor.RESET}")
+        if input("Ligar agora? (s/N): ").strip().lower() == 's':
+            metricas.ativar()
+            print(f"{Cor.VERDE}Métricas ligadas, use o sistema e volte aqui para ver os números.{Cor.RESET}")
+        input(f"\nPressione {Cor.AZUL}ENTER{Cor.RESET} para continuar...")
+        return
 
-def menu_principal(agente: AgenteDeRisco, repo: AlimentoRepository):
+    dados = metricas.metricas.para_dict()
+    for titulo, grupo in (("OPERAÇÃO", dados["operacoes"]), ("CONSULTA SQL", dados["consultas_sql"])):
+        print(f"{titulo:<48}{'CHAMADAS':>10}{'TOTAL ms':>12}{'MÉDIA ms':>12}{'MÁX. ms':>12}{'ERROS':>7}")
+        print("=" * 101)
+        for nome, valores in sorted(grupo.items(), key=lambda item: item[1]["segundos"], reverse=True):
+            media = valores["segundos"] / valores["chamadas"]
+            print(f"{nome:<48}{valores['chamadas']:>10}{valores['segundos'] * 1000:>12.2f}{media * 1000:>12.3f}"
+                  f"{valores['maximo'] * 1000:>12.3f}{valores['erros']:>7}")
+        if not grupo:
+            print(f"{Cor.CINZA}Nada medido ainda.{Cor.RESET}")
+        print()
+
+    formato = input("Salvar em arquivo? (j = JSON, p = Prometheus, ENTER = não): ").strip().lower()
+    if formato in ('j', 'p'):
+        caminho = "metricas_agente.json" if formato == 'j' else "metricas_agente.prom"
+        try:
+            if formato == 'j':
+                metricas.metricas.exportar_json(caminho)
+            else:
+                with open(caminho, 'w', encoding='utf-8') as file:
+                    file.write(metricas.metricas.para_prometheus())
+            print(f"{Cor.VERDE}SUCESSO:{Cor.RESET} Métricas gravadas em {caminho}")
+        except OSError as e:
+            print(f"{Cor.VERMELHO}ERRO:{Cor.RESET} Não foi possível gravar o arquivo: {e}")
+        input(f"\nPressione {Cor.AZUL}ENTER{Cor.RESET} para continuar...")
+
+
+def menu_principal(agente: AgenteDeRisco = None, repo: AlimentoRepository = None, preparar_agente=None):
     # Mantem o programa rodando ate a pessoa escolher sair
+    # Sem agente o preparar_agente e chamado na primeira opcao que precisa do banco
+    # Assim o menu aparece na hora e quem so abre e sai nao espera o banco ficar pronto
     while True:
         opcao = exibir_menu()
 
+        if agente is None and opcao in ('1', '2', '3', '4'):
+            agente = preparar_agente()
+            repo = agente.repo
+
         if opcao == '1':
             exibir_analise(agente)
         elif opcao == '2':
             listar_alimentos(repo)
         elif opcao == '3':
-            exportar_relatorio_csv(repo)
+            exportar_relatorio_csv(repo, agente)
         elif opcao == '4':
             exibir_estatisticas(repo)
         elif opcao == '5':
+            exibir_metricas()
+        elif opcao == '6':
             print(f"{Cor.AZUL}\nEncerrando o Agente Nutricional. Até mais!{Cor.RESET}")
             break
         else:
@@ -220,13 +370,19 @@ def criar_arquivo_dados_csv():
 
 def inicializar_projeto():
     # Prepara tudo cria as tabelas e carrega os dados do arquivo
-    repo = AlimentoRepository()
+    from database import AlimentoRepository, memoria_pelo_ambiente
+    from snapshot import carregar_dados_iniciais
+
+    # Com AGENTE_MEMORIA=1 as leituras de alimentos e regras passam a vir da memoria
+    repo = AlimentoRepository(em_memoria=memoria_pelo_ambiente())
 
     print("\n--- INICIALIZAÇÃO DO SISTEMA ---")
-    repo.criar_esquema()
-    repo.inserir_regras()
+    # Tabelas e regras so sao criadas quando o marcador de versao do esquema nao confere
+    repo.preparar_banco()
     criar_arquivo_dados_csv()
-    repo.inserir_dados_csv("dados_alimentos.csv")
+    carregar_dados_iniciais(repo, "dados_alimentos.csv")
+    if repo.em_memoria:
+        repo.carregar_memoria()
     print("--- BANCO DE DADOS PRONTO ---\n")
     return repo
 
@@ -239,7 +395,11 @@ if __name__ == '__main__':
         repo = inicializar_projeto()
 
         # 2. Cria a inteligencia do agente
+        from agente import AgenteDeRisco
+
         agente = AgenteDeRisco(repo)
+        # Reclassifica so os alimentos novos ou alterados desde a ultima execucao
+        agente.sincronizar_classificacoes()
 
         # 3. Abre o menu pro usuario
         menu_principal(agente, repo)
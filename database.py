@@ -1,15 +1,70 @@
 import csv
+import difflib
+import hashlib
 import os
-from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String, Float, select, insert
+import struct
+import threading
+import types
+import unicodedata
+import weakref
+from itertools import islice
+from datetime import datetime, timezone
+from sqlalchemy import (create_engine, event, inspect, MetaData, Table, Column, Index, Integer, String, Float,
+                        DateTime, ForeignKey, select, insert, update, delete, func, text, bindparam, tuple_, or_)
+from sqlalchemy.dialects.sqlite import insert as insert_sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DatabaseError, IntegrityError, OperationalError
+from sqlalchemy.pool import QueuePool
+
+from catalogo import NutrientesAlimento
+from indice_memoria import IndiceAlimentos
 
 # Configura os metadados e as tabelas do banco
 metadata = MetaData()
 
+# Quantidade maxima de nomes por consulta IN para nao passar do limite de parametros do sqlite
+TAMANHO_BLOCO_CONSULTA = 900
+
+# Quantidade de linhas do csv gravadas de uma vez na carga em lote
+TAMANHO_BLOCO_CSV = 10000
+
+# Configuracoes aplicadas em toda conexao nova com o sqlite
+# O modo WAL deixa varias leituras acontecerem junto com uma escrita
+# Ele fica gravado no arquivo, entao conexoes somente leitura nao precisam (nem podem) ativar
+PRAGMA_WAL = "PRAGMA journal_mode=WAL"
+PRAGMAS_SQLITE = (
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Versao do esquema criado pelo criar_esquema, gravada na tabela de metadados
+# Deve aumentar sempre que tabelas, colunas, indices, gatilhos ou regras iniciais mudarem
+VERSAO_ESQUEMA = 3
+CHAVE_VERSAO_ESQUEMA = "versao_esquema"
+
+# Com AGENTE_MEMORIA=1 o programa abre o repositorio no modo em_memoria
+VARIAVEL_MEMORIA = "AGENTE_MEMORIA"
+
+# Quantidade de nomes por pagina na listagem paginada de alimentos
+TAMANHO_PAGINA_ALIMENTOS = 50
+
+# Maior caractere do unicode, o nome normalizado que comeca com um prefixo fica entre o prefixo e prefixo + ele
+MAIOR_CARACTERE = "\U0010ffff"
+
+# Colunas de nutrientes na mesma ordem do arquivo csv
+COLUNAS_NUTRIENTES = ("sodio", "gordura_saturada", "fibra", "proteina", "carboidrato")
+
 # Define como e a tabela de alimentos
 tabela_alimentos = Table(
     "Alimentos", metadata,
     Column('id', Integer, primary_key=True),
     Column('nome_alimento', String, unique=True, nullable=False),
+    # Nome sem acentos e em minusculo para a busca nao depender de como o usuario digitou
+    Column('nome_normalizado', String, index=True),
     Column('sodio', Float, nullable=False),
     Column('gordura_saturada', Float, nullable=False),
     Column('fibra', Float, nullable=False),
@@ -17,6 +72,10 @@ tabela_alimentos = Table(
     Column('carboidrato', Float, nullable=False)
 )
 
+# A listagem paginada anda pelos alimentos em ordem de (nome normalizado, nome) a partir do ultimo nome mostrado
+# Com este indice cada pagina e o filtro por prefixo leem so as linhas da pagina, sem ordenar a tabela
+Index("ix_alimentos_normalizado_nome", tabela_alimentos.c.nome_normalizado, tabela_alimentos.c.nome_alimento)
+
 # Define como e a tabela de regras
 tabela_regras = Table(
     "Regras", metadata,
@@ -25,25 +84,384 @@ tabela_regras = Table(
     Column('descricao_regra', String, nullable=False)
 )
 
+# Define a tabela com os totais de cada nutriente para calcular media e variancia sem ler a tabela inteira
+# Tem uma linha por coluna de nutriente e e mantida pelos gatilhos criados no criar_esquema
+tabela_estatisticas = Table(
+    "EstatisticasNutrientes", metadata,
+    Column('coluna', String, primary_key=True),
+    Column('quantidade', Integer, nullable=False),
+    Column('soma', Float, nullable=False),
+    Column('soma_quadrados', Float, nullable=False)
+)
+
+# Define a tabela com o ultimo risco calculado para cada alimento
+# A regra e a posicao dela nas regras de decisao do agente
+# Os hashes dizem com quais nutrientes e com qual configuracao de limites e regras o risco foi calculado
+tabela_classificacoes = Table(
+    "classificacoes", metadata,
+    Column('id_alimento', Integer, ForeignKey("Alimentos.id", ondelete="CASCADE"), primary_key=True),
+    Column('risco', String, nullable=False, index=True),
+    Column('classificacao', String, nullable=False),
+    Column('id_regra', Integer, nullable=False),
+    Column('classificado_em', DateTime, nullable=False),
+    Column('hash_nutrientes', String),
+    Column('hash_configuracao', String, index=True)
+)
+
+# Define uma tabela simples de chave e valor para marcas do proprio sistema
+# Por exemplo o checksum do ultimo csv carregado, para a inicializacao saber que nao precisa ler ele de novo
+tabela_metadados = Table(
+    "Metadados", metadata,
+    Column('chave', String, primary_key=True),
+    Column('valor', String, nullable=False)
+)
+
+# Quando os nutrientes de um alimento mudam a classificacao guardada deixa de valer e e apagada
+# Assim o alimento volta para a lista de pendentes da reclassificacao incremental
+# Um UPDATE que grava os mesmos valores nao apaga nada
+GATILHO_CLASSIFICACOES = f"""CREATE TRIGGER IF NOT EXISTS classificacao_apos_alterar
+    AFTER UPDATE OF {', '.join(COLUNAS_NUTRIENTES)} ON Alimentos
+    WHEN {' OR '.join(f'OLD.{coluna} IS NOT NEW.{coluna}' for coluna in COLUNAS_NUTRIENTES)} BEGIN
+        DELETE FROM classificacoes WHERE id_alimento = NEW.id;
+    END"""
+
+
+def calcular_hash_nutrientes(valores) -> str:
+    # Resume os 5 nutrientes num texto curto para saber se eles mudaram desde a ultima classificacao
+    return hashlib.sha1(struct.pack("5d", *(float(valor) for valor in valores))).hexdigest()[:16]
+
+
+def _valor_da_coluna(prefixo):
+    # Monta o CASE que pega o valor do nutriente certo para cada linha da tabela de estatisticas
+    casos = " ".join(f"WHEN '{coluna}' THEN {prefixo}.{coluna}" for coluna in COLUNAS_NUTRIENTES)
+    return f"(CASE coluna {casos} END)"
+
+
+# Gatilhos que atualizam os totais a cada insercao remocao ou alteracao de alimento
+# Assim a carga em lote o upsert e qualquer outra escrita ficam cobertos na mesma transacao
+GATILHOS_ESTATISTICAS = (
+    f"""CREATE TRIGGER IF NOT EXISTS estatisticas_apos_inserir AFTER INSERT ON Alimentos BEGIN
+        UPDATE EstatisticasNutrientes SET quantidade = quantidade + 1,
+            soma = soma + {_valor_da_coluna('NEW')},
+            soma_quadrados = soma_quadrados + {_valor_da_coluna('NEW')} * {_valor_da_coluna('NEW')};
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS estatisticas_apos_remover AFTER DELETE ON Alimentos BEGIN
+        UPDATE EstatisticasNutrientes SET quantidade = quantidade - 1,
+            soma = soma - {_valor_da_coluna('OLD')},
+            soma_quadrados = soma_quadrados - {_valor_da_coluna('OLD')} * {_valor_da_coluna('OLD')};
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS estatisticas_apos_alterar
+    AFTER UPDATE OF {', '.join(COLUNAS_NUTRIENTES)} ON Alimentos BEGIN
+        UPDATE EstatisticasNutrientes SET
+            soma = soma - {_valor_da_coluna('OLD')} + {_valor_da_coluna('NEW')},
+            soma_quadrados = soma_quadrados - {_valor_da_coluna('OLD')} * {_valor_da_coluna('OLD')}
+                + {_valor_da_coluna('NEW')} * {_valor_da_coluna('NEW')};
+    END""",
+)
+
+# Indice de texto por trigramas do sqlite (FTS5) para achar nomes parecidos mesmo com erro de digitacao
+# Le o nome_normalizado direto da tabela Alimentos e e mantido em dia pelos gatilhos abaixo
+CRIAR_BUSCA_TEXTUAL = """CREATE VIRTUAL TABLE IF NOT EXISTS AlimentosBusca USING fts5(
+    nome_normalizado, content='Alimentos', content_rowid='id', tokenize='trigram')"""
+
+GATILHOS_BUSCA_TEXTUAL = (
+    """CREATE TRIGGER IF NOT EXISTS busca_apos_inserir AFTER INSERT ON Alimentos BEGIN
+        INSERT INTO AlimentosBusca(rowid, nome_normalizado) VALUES (NEW.id, NEW.nome_normalizado);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS busca_apos_remover AFTER DELETE ON Alimentos BEGIN
+        INSERT INTO AlimentosBusca(AlimentosBusca, rowid, nome_normalizado)
+            VALUES ('delete', OLD.id, OLD.nome_normalizado);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS busca_apos_alterar AFTER UPDATE OF nome_normalizado ON Alimentos BEGIN
+        INSERT INTO AlimentosBusca(AlimentosBusca, rowid, nome_normalizado)
+            VALUES ('delete', OLD.id, OLD.nome_normalizado);
+        INSERT INTO AlimentosBusca(rowid, nome_normalizado) VALUES (NEW.id, NEW.nome_normalizado);
+    END""",
+)
+
+
+def normalizar_nome(nome: str) -> str:
+    # Tira os acentos, deixa tudo minusculo e junta os espacos repetidos
+    # Assim "Pão Francês", "pao frances" e "PAO  FRANCES" viram o mesmo texto
+    sem_acentos = "".join(
+        caractere for caractere in unicodedata.normalize("NFKD", nome) if not unicodedata.combining(caractere)
+    )
+    return " ".join(sem_acentos.casefold().split())
+
+
+def converter_linha_csv(linha):
+    # Transforma uma linha do csv no dicionario usado no insert
+    # Devolve None se a linha estiver incompleta ou com numero invalido
+    if len(linha) != 6:
+        return None
+    try:
+        valores = [float(valor) for valor in linha[1:]]
+    except ValueError:
+        return None
+    return {"nome_alimento": linha[0], "nome_normalizado": normalizar_nome(linha[0]),
+            **dict(zip(COLUNAS_NUTRIENTES, valores))}
+
+
+def memoria_pelo_ambiente() -> bool:
+    return os.environ.get(VARIAVEL_MEMORIA, "").lower() in ("1", "true", "sim")
+
+
+def _configurar_conexao_sqlite(conexao_dbapi, _registro_pool):
+    # Roda os PRAGMAS sempre que o pool abre uma conexao nova com o sqlite
+    cursor = conexao_dbapi.cursor()
+    for pragma in (PRAGMA_WAL,) + PRAGMAS_SQLITE:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def _configurar_conexao_sqlite_leitura(conexao_dbapi, _registro_pool):
+    # Mesmo que o de cima para conexoes somente leitura, sem mudar o modo do arquivo
+    cursor = conexao_dbapi.cursor()
+    for pragma in PRAGMAS_SQLITE:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def _trigramas(texto: str) -> set:
+    # Quebra o texto em pedacos de 3 letras usados para comparar nomes parecidos
+    return {texto[i:i + 3] for i in range(len(texto) - 2)} or {texto}
+
 
 class AlimentoRepository:
     # Classe que controla tudo que entra e sai do banco de dados
+    # Cada operacao pega uma conexao do pool e devolve no final, entao o repositorio pode ser usado por varias threads
+
+    def __init__(self, nome_bd="agente_nutricional.db", url=None, tamanho_pool=5, conexoes_extras=10,
+                 somente_leitura=False, em_memoria=False):
+        # Monta o engine com pool de conexoes, por padrao no arquivo sqlite mas aceita a url de outro banco
+        # Com somente_leitura=True o arquivo sqlite e aberto sem permissao de escrita
+        # Com em_memoria=True os alimentos e as regras sao lidos uma vez para a memoria e as leituras nao vao ao banco
+        # As gravacoes continuam indo para o banco e atualizam a memoria, por isso so este repositorio deve escrever
+        if url is None:
+            url = f"sqlite:///file:{nome_bd}?mode=ro&uri=true" if somente_leitura else f"sqlite:///{nome_bd}"
+        self.url = url
+        self.tamanho_pool = tamanho_pool
+        opcoes = {}
+        url_banco = make_url(self.url)
+        # Tamanho do pool so existe no QueuePool, o sqlite em memoria usa um pool de uma conexao por thread
+        if issubclass(url_banco.get_dialect().get_pool_class(url_banco), QueuePool):
+            opcoes.update(pool_size=tamanho_pool, max_overflow=conexoes_extras)
+        if url_banco.get_backend_name() == "sqlite":
+            # As conexoes do pool passam de uma thread para outra, o sqlite precisa ser avisado disso
+            # Um arquivo local nao cai como um servidor, testar a conexao antes de cada uso seria um SELECT 1 a mais
+            opcoes["connect_args"] = {"check_same_thread": False}
+        else:
+            opcoes["pool_pre_ping"] = True
+        self.engine = create_engine(self.url, **opcoes)
+        self.eh_sqlite = self.engine.dialect.name == "sqlite"
+        if self.eh_sqlite:
+            configurar = _configurar_conexao_sqlite_leitura if somente_leitura else _configurar_conexao_sqlite
+            event.listen(self.engine, "connect", configurar)
+
+        # Contador que muda toda vez que a tabela de regras e alterada
+        # Quem guarda as regras em memoria compara esse numero para saber se precisa recarregar
+        self.versao_regras = 0
+        # Funcoes chamadas com a lista de nomes sempre que alimentos sao gravados ou apagados
+        self._ouvintes_alteracao = []
+
+        self.em_memoria = em_memoria
+        # Indice dos alimentos e lista de regras do modo em_memoria, lidos do banco no primeiro uso
+        self._indice = None
+        self._regras_memoria = None
+        self._trava_memoria = threading.Lock()
+
+    def carregar_memoria(self):
+        # Le (ou le de novo) a tabela de alimentos inteira para o indice em memoria
+        selecao = select(
+            tabela_alimentos.c.id, tabela_alimentos.c.nome_alimento, tabela_alimentos.c.nome_normalizado,
+            *(tabela_alimentos.c[coluna] for coluna in COLUNAS_NUTRIENTES)
+        ).order_by(tabela_alimentos.c.id)
+        with self._trava_memoria:
+            self._indice = IndiceAlimentos.de_lotes(self._iterar_lotes(selecao, TAMANHO_BLOCO_CSV))
+            self._regras_memoria = None
+        return self._indice
+
+    def _descartar_memoria(self):
+        # Depois de uma carga em lote o indice e montado de novo na proxima leitura, antes dos ouvintes serem avisados
+        self._indice = None
+
+    def _indice_memoria(self) -> IndiceAlimentos:
+        # Indice em memoria, carregado na primeira leitura
+        indice = self._indice
+        return indice if indice is not None else self.carregar_memoria()
+
+    def registrar_ouvinte_alteracao(self, funcao):
+        # Quem guarda resultados de alimentos em memoria se registra aqui para saber quando eles mudaram
+        # Metodos ficam guardados por referencia fraca, o repositorio nao segura vivo o objeto que se registrou
+        # e o ouvinte sai da lista sozinho quando o objeto deixa de existir
+        referencia = weakref.WeakMethod(funcao) if isinstance(funcao, types.MethodType) else (lambda: funcao)
+        self._ouvintes_alteracao.append(referencia)
 
-    def __init__(self, nome_bd="agente_nutricional.db"):
-        # Cria a conexao com o arquivo do banco sqlite
-        self.engine = create_engine(f"sqlite:///{nome_bd}")
-        self.connection = self.engine.connect()
+    def remover_ouvinte_alteracao(self, funcao):
+        # A lista e trocada por uma nova, quem estiver avisando os ouvintes continua na lista antiga
+        self._ouvintes_alteracao = [referencia for referencia in self._ouvintes_alteracao
+                                    if referencia() is not None and referencia() != funcao]
+
+    def _avisar_alteracao(self, nomes):
+        # Avisa os ouvintes depois do commit, com os nomes dos alimentos que mudaram
+        if nomes:
+            encerrados = False
+            for referencia in self._ouvintes_alteracao:
+                funcao = referencia()
+                if funcao is None:
+                    encerrados = True
+                else:
+                    funcao(nomes)
+            if encerrados:
+                self._ouvintes_alteracao = [referencia for referencia in self._ouvintes_alteracao
+                                            if referencia() is not None]
 
     def criar_esquema(self):
         # Cria as tabelas no banco se elas nao existirem
         metadata.create_all(self.engine)
         print("Tabelas sendo criadas...")
 
+        # Bancos criados antes do nome normalizado ou dos hashes ganham as colunas e os indices aqui
+        self._migrar_nome_normalizado()
+        self._adicionar_colunas_faltantes(tabela_classificacoes)
+
+        # Gatilhos e busca por trigramas so existem no sqlite
+        # Nos outros bancos as estatisticas sao calculadas na hora e a busca aproximada usa o difflib
+        if self.eh_sqlite:
+            self._criar_busca_textual()
+            with self.engine.begin() as conexao:
+                # Bancos de versoes antigas tem este gatilho sem a condicao WHEN, ele e criado de novo
+                conexao.execute(text("DROP TRIGGER IF EXISTS classificacao_apos_alterar"))
+                for gatilho in GATILHOS_ESTATISTICAS + (GATILHO_CLASSIFICACOES,):
+                    conexao.execute(text(gatilho))
+                vazia = not conexao.execute(select(tabela_estatisticas)).fetchone()
+            # Calcula os totais se a tabela de estatisticas ainda estiver vazia
+            if vazia:
+                self.recalcular_estatisticas_agregadas()
+
+    def esquema_atualizado(self) -> bool:
+        # Diz se o banco ja foi preparado com a versao atual do esquema, com uma unica consulta
+        try:
+            return self.obter_metadado(CHAVE_VERSAO_ESQUEMA) == str(VERSAO_ESQUEMA)
+        except DatabaseError:
+            # Banco de antes da tabela de metadados ou ainda vazio
+            return False
+
+    def preparar_banco(self) -> bool:
+        # Cria o esquema e as regras iniciais so quando o marcador de versao do banco nao confere
+        # Devolve True se precisou preparar o banco
+        if self.esquema_atualizado():
+            return False
+        self.criar_esquema()
+        self.inserir_regras()
+        self.gravar_metadado(CHAVE_VERSAO_ESQUEMA, VERSAO_ESQUEMA)
+        return True
+
+    def _adicionar_colunas_faltantes(self, tabela):
+        # Cria no banco as colunas e indices da tabela que ainda nao existem, para bancos de versoes antigas
+        with self.engine.begin() as conexao:
+            existentes = {coluna["name"] for coluna in inspect(conexao).get_columns(tabela.name)}
+            for coluna in tabela.columns:
+                if coluna.name not in existentes:
+                    tipo = coluna.type.compile(dialect=self.engine.dialect)
+                    conexao.execute(text(f"ALTER TABLE {tabela.name} ADD COLUMN {coluna.name} {tipo}"))
+            for indice in tabela.indexes:
+                indice.create(conexao, checkfirst=True)
+
+    def _migrar_nome_normalizado(self):
+        # Adiciona a coluna nome_normalizado em bancos antigos e preenche as linhas que estao sem ela
+        self._adicionar_colunas_faltantes(tabela_alimentos)
+        with self.engine.begin() as conexao:
+            pendentes = conexao.execute(
+                select(tabela_alimentos.c.id, tabela_alimentos.c.nome_alimento)
+                .where(tabela_alimentos.c.nome_normalizado.is_(None))
+            ).fetchall()
+            if pendentes:
+                conexao.execute(
+                    update(tabela_alimentos).where(tabela_alimentos.c.id == bindparam("id_alimento"))
+                    .values(nome_normalizado=bindparam("normalizado")),
+                    [{"id_alimento": id_alimento, "normalizado": normalizar_nome(nome)} for id_alimento, nome in pendentes]
+                )
+
+    def _criar_busca_textual(self):
+        # Cria o indice de trigramas e os gatilhos que mantem ele sincronizado com Alimentos
+        # Se o sqlite nao tiver FTS5 a busca aproximada usa a comparacao em python como alternativa
+        try:
+            existia = self._busca_textual_disponivel()
+            with self.engine.begin() as conexao:
+                conexao.execute(text(CRIAR_BUSCA_TEXTUAL))
+                for gatilho in GATILHOS_BUSCA_TEXTUAL:
+                    conexao.execute(text(gatilho))
+                if not existia:
+                    conexao.execute(text("INSERT INTO AlimentosBusca(AlimentosBusca) VALUES ('rebuild')"))
+        except OperationalError:
+            print("Aviso: sqlite sem suporte a FTS5 com trigramas, busca aproximada sera mais lenta.")
+
+    def _busca_textual_disponivel(self) -> bool:
+        if not self.eh_sqlite:
+            return False
+        with self.engine.connect() as conexao:
+            return inspect(conexao).has_table("AlimentosBusca")
+
+    def _calcular_somas_nutrientes(self) -> dict:
+        # Calcula do zero a quantidade a soma e a soma dos quadrados de cada nutriente
+        colunas = []
+        for coluna in COLUNAS_NUTRIENTES:
+            valor = tabela_alimentos.c[coluna]
+            colunas += [func.sum(valor), func.sum(valor * valor)]
+        with self.engine.connect() as conexao:
+            linha = conexao.execute(select(func.count(), *colunas).select_from(tabela_alimentos)).fetchone()
+
+        return {
+            coluna: (linha[0], linha[1 + 2 * i] or 0.0, linha[2 + 2 * i] or 0.0)
+            for i, coluna in enumerate(COLUNAS_NUTRIENTES)
+        }
+
+    def recalcular_estatisticas_agregadas(self):
+        # Refaz a tabela de estatisticas a partir dos alimentos para corrigir qualquer diferenca
+        somas = self._calcular_somas_nutrientes()
+        with self.engine.begin() as conexao:
+            conexao.execute(delete(tabela_estatisticas))
+            conexao.execute(insert(tabela_estatisticas), [
+                {"coluna": coluna, "quantidade": quantidade, "soma": soma, "soma_quadrados": soma_quadrados}
+                for coluna, (quantidade, soma, soma_quadrados) in somas.items()
+            ])
+
+    def obter_estatisticas_agregadas(self) -> dict:
+        # Le os totais mantidos pelos gatilhos, sao so 5 linhas independente do tamanho da tabela
+        # Sem gatilhos (bancos que nao sao sqlite) os totais sao calculados na hora com uma consulta so
+        if self.em_memoria:
+            return self._indice_memoria().estatisticas_agregadas()
+        if not self.eh_sqlite:
+            return self._calcular_somas_nutrientes()
+        selecao = select(
+            tabela_estatisticas.c.coluna, tabela_estatisticas.c.quantidade,
+            tabela_estatisticas.c.soma, tabela_estatisticas.c.soma_quadrados
+        )
+        with self.engine.connect() as conexao:
+            return {linha[0]: tuple(linha[1:]) for linha in conexao.execute(selecao)}
+
+    def verificar_estatisticas_agregadas(self, tolerancia=1e-9) -> dict:
+        # Compara os totais guardados com os calculados do zero
+        # Devolve so as colunas onde a diferenca passou da tolerancia relativa
+        guardadas = self.obter_estatisticas_agregadas()
+        diferencas = {}
+        for coluna, calculadas in self._calcular_somas_nutrientes().items():
+            atuais = guardadas.get(coluna)
+            if atuais is None or any(
+                    abs(atual - correto) > tolerancia * max(1.0, abs(correto))
+                    for atual, correto in zip(atuais, calculadas)):
+                diferencas[coluna] = {"guardado": atuais, "recalculado": calculadas}
+        return diferencas
+
     def inserir_regras(self):
         # Coloca as regras de risco no banco se ele estiver vazio
         s = select(tabela_regras)
 
-        if not self.connection.execute(s).fetchone():
+        with self.engine.connect() as conexao:
+            vazia = not conexao.execute(s).fetchone()
+
+        if vazia:
             print("Inserindo regras iniciais...")
             regras = [
                 # Regras de risco alto vermelho
@@ -67,54 +485,363 @@ class AlimentoRepository:
                 {"nivel_risco": "VERDE",
                  "descricao_regra": "BAIXO RISCO: Níveis de risco controlados E Fibra OU Proteína alta (Perfil Ideal)"},
             ]
-            self.connection.execute(insert(tabela_regras), regras)
-            self.connection.commit()
+            with self.engine.begin() as conexao:
+                conexao.execute(insert(tabela_regras), regras)
+            self.registrar_alteracao_regras()
             print("Regras inseridas.")
 
+    def registrar_alteracao_regras(self):
+        # Avisa que a tabela de regras mudou para quem tem as regras guardadas em memoria
+        # Qualquer codigo que escrever na tabela Regras deve chamar esse metodo depois do commit
+        self.versao_regras += 1
+        self._regras_memoria = None
+
+    def obter_regras(self):
+        # Pega todas as regras cadastradas com o nivel de risco e a descricao
+        if self.em_memoria and self._regras_memoria is not None:
+            return list(self._regras_memoria)
+        selecao = select(tabela_regras.c.nivel_risco, tabela_regras.c.descricao_regra).order_by(tabela_regras.c.id)
+        with self.engine.connect() as conexao:
+            regras = [tuple(linha) for linha in conexao.execute(selecao)]
+        if self.em_memoria:
+            self._regras_memoria = regras
+        return regras
+
+    def obter_metadado(self, chave, padrao=None):
+        # Le um valor da tabela de metadados, devolve o padrao se a chave nao existir
+        with self.engine.connect() as conexao:
+            valor = conexao.execute(
+                select(tabela_metadados.c.valor).where(tabela_metadados.c.chave == chave)
+            ).scalar()
+        return padrao if valor is None else valor
+
+    def gravar_metadado(self, chave, valor):
+        # Grava ou substitui um valor da tabela de metadados
+        with self.engine.begin() as conexao:
+            if conexao.execute(update(tabela_metadados).where(tabela_metadados.c.chave == chave)
+                               .values(valor=str(valor))).rowcount == 0:
+                conexao.execute(insert(tabela_metadados).values(chave=chave, valor=str(valor)))
+
     def inserir_alimento(self, nome, sodio, gordura, fibra, proteina, carboidrato):
         # Tenta gravar um alimento novo no banco
+        # Devolve False quando ja existe um alimento com esse nome
         try:
             inserindo = insert(tabela_alimentos).values(
-                nome_alimento=nome, sodio=sodio, gordura_saturada=gordura,
+                nome_alimento=nome, nome_normalizado=normalizar_nome(nome), sodio=sodio, gordura_saturada=gordura,
                 fibra=fibra, proteina=proteina, carboidrato=carboidrato
             )
-            self.connection.execute(inserindo)
-            self.connection.commit()
-        except Exception:
-            pass
+            with self.engine.begin() as conexao:
+                id_alimento = conexao.execute(inserindo).inserted_primary_key[0]
+        except IntegrityError:
+            return False
+        if self._indice is not None:
+            self._indice.adicionar(id_alimento, nome, normalizar_nome(nome),
+                                   (sodio, gordura, fibra, proteina, carboidrato))
+        self._avisar_alteracao([nome])
+        return True
+
+    def remover_alimento(self, nome):
+        # Apaga um alimento do banco e devolve se ele existia
+        with self.engine.begin() as conexao:
+            resultado = conexao.execute(delete(tabela_alimentos).where(tabela_alimentos.c.nome_alimento == nome))
+        if resultado.rowcount > 0:
+            if self._indice is not None:
+                self._indice.remover(nome, normalizar_nome(nome))
+            self._avisar_alteracao([nome])
+        return resultado.rowcount > 0
 
     def inserir_dados_csv(self, caminho_arquivo):
         # Le o arquivo csv e grava todos os alimentos no banco
+        # Alimentos que ja existem no banco sao mantidos como estao
         try:
-            with open(caminho_arquivo, mode='r', encoding='utf-8') as file:
-                reader = csv.reader(file)
-                next(reader)
-                print(f"Lendo dados do arquivo '{caminho_arquivo}'...")
-                for linha in reader:
-                    if len(linha) == 6:
-                        try:
-                            self.inserir_alimento(linha[0], float(linha[1]), float(linha[2]), float(linha[3]),
-                                                  float(linha[4]), float(linha[5]))
-                        except ValueError as e:
-                            print(f"Erro de conversão na linha: {linha}. Erro: {e}")
-            print("Dados do CSV inseridos.")
+            print(f"Lendo dados do arquivo '{caminho_arquivo}'...")
+            contagem = self.carregar_csv_em_lote(caminho_arquivo)
+            print(f"Dados do CSV inseridos. Novos: {contagem['inseridos']}, "
+                  f"já existentes ou inválidos: {contagem['rejeitados']}.")
         except FileNotFoundError:
             print(f"Erro: Arquivo {caminho_arquivo} não encontrado.")
         except Exception as e:
             print(f"Erro durante a leitura do CSV: {e}")
 
+    def carregar_csv_em_lote(self, caminho_arquivo, atualizar=False, tamanho_bloco=TAMANHO_BLOCO_CSV,
+                             commit_por_bloco=True) -> dict:
+        # Le o csv em blocos e grava cada bloco com um unico executemany
+        # Com atualizar=True os alimentos que ja existem tem os nutrientes substituidos (upsert)
+        # Com commit_por_bloco=False o arquivo inteiro e gravado numa transacao so
+        # Devolve quantas linhas foram inseridas atualizadas inalteradas e rejeitadas
+        with open(caminho_arquivo, mode='r', encoding='utf-8') as file:
+            reader = csv.reader(file)
+            next(reader, None)
+            blocos = iter(lambda: [converter_linha_csv(linha) for linha in islice(reader, tamanho_bloco)], [])
+            return self.carregar_registros_em_lote(blocos, atualizar, commit_por_bloco)
+
+    def carregar_registros_em_lote(self, blocos, atualizar=False, commit_por_bloco=True) -> dict:
+        # Grava blocos de registros ja convertidos (dicionarios no formato do insert) com um executemany por bloco
+        # Um registro None conta como linha rejeitada, usado pelo csv para linhas invalidas
+        # Com atualizar=True os alimentos que ja existem com os mesmos nutrientes nao sao gravados (inalterados)
+        contagem = {"inseridos": 0, "atualizados": 0, "inalterados": 0, "rejeitados": 0}
+        # Nomes gravados que ainda nao foram confirmados, os ouvintes so sao avisados depois do commit
+        alterados = []
+
+        with self.engine.connect() as conexao:
+            try:
+                for bloco in blocos:
+                    # Trata nome repetido no bloco como atualizacao ou rejeicao
+                    registros = {}
+                    for registro in bloco:
+                        if registro is None:
+                            contagem["rejeitados"] += 1
+                        elif registro["nome_alimento"] not in registros:
+                            registros[registro["nome_alimento"]] = registro
+                        elif atualizar:
+                            contagem["atualizados"] += 1
+                            registros[registro["nome_alimento"]] = registro
+                        else:
+                            contagem["rejeitados"] += 1
+
+                    if not registros:
+                        continue
+
+                    # Descobre quais nomes ja existem para separar insercoes de atualizacoes
+                    # So os que existem com nutrientes diferentes sao atualizados
+                    existentes = {linha[0]: tuple(linha[1:])
+                                  for linha in self._buscar_nutrientes_lote(conexao, list(registros))}
+                    mudaram = {nome for nome, valores in existentes.items()
+                               if tuple(registros[nome][coluna] for coluna in COLUNAS_NUTRIENTES) != valores
+                               } if atualizar else set()
+                    contagem["inseridos"] += len(registros) - len(existentes)
+                    if atualizar:
+                        contagem["atualizados"] += len(mudaram)
+                        contagem["inalterados"] += len(existentes) - len(mudaram)
+                    else:
+                        contagem["rejeitados"] += len(existentes)
+
+                    gravados = {nome: registro for nome, registro in registros.items()
+                                if nome not in existentes or nome in mudaram}
+                    if gravados:
+                        self._gravar_bloco(conexao, gravados, existentes, atualizar)
+                    alterados.extend(gravados)
+                    if commit_por_bloco:
+                        conexao.commit()
+                        self._descartar_memoria()
+                        self._avisar_alteracao(alterados)
+                        alterados = []
+
+                conexao.commit()
+                self._descartar_memoria()
+                self._avisar_alteracao(alterados)
+            except Exception:
+                # Desfaz o que ainda nao foi confirmado para nao deixar a transacao aberta
+                conexao.rollback()
+                raise
+
+        return contagem
+
+    def _gravar_bloco(self, conexao, registros, existentes, atualizar):
+        # Grava um bloco do csv com um executemany
+        if self.eh_sqlite:
+            # No sqlite o proprio insert resolve o conflito de nome (upsert)
+            comando = insert_sqlite(tabela_alimentos)
+            if atualizar:
+                # O where deixa de fora a linha que ja tem os mesmos nutrientes (gravada por outro depois da leitura)
+                comando = comando.on_conflict_do_update(
+                    index_elements=[tabela_alimentos.c.nome_alimento],
+                    set_={coluna: comando.excluded[coluna] for coluna in COLUNAS_NUTRIENTES},
+                    where=or_(*(tabela_alimentos.c[coluna].is_distinct_from(comando.excluded[coluna])
+                                for coluna in COLUNAS_NUTRIENTES))
+                )
+            else:
+                comando = comando.on_conflict_do_nothing(index_elements=[tabela_alimentos.c.nome_alimento])
+            conexao.execute(comando, list(registros.values()))
+            return
+
+        # Nos outros bancos separa os nomes novos dos que ja existem e usa insert e update comuns
+        novos = [registro for nome, registro in registros.items() if nome not in existentes]
+        if novos:
+            conexao.execute(insert(tabela_alimentos), novos)
+        # Chegam aqui so os existentes que mudaram, o carregar_registros_em_lote ja tirou os inalterados
+        atualizados = [nome for nome in registros if nome in existentes]
+        if atualizar and atualizados:
+            comando = update(tabela_alimentos).where(tabela_alimentos.c.nome_alimento == bindparam("nome_existente"))
+            comando = comando.values({coluna: bindparam(f"novo_{coluna}") for coluna in COLUNAS_NUTRIENTES})
+            conexao.execute(comando, [
+                {"nome_existente": nome, **{f"novo_{coluna}": registros[nome][coluna] for coluna in COLUNAS_NUTRIENTES}}
+                for nome in atualizados
+            ])
+
     def obter_dados_nutricionais(self, nome_alimento):
         # Busca os nutrientes de um alimento especifico
+        if self.em_memoria:
+            return self._indice_memoria().nutrientes(nome_alimento)
         stmt = select(
             tabela_alimentos.c.sodio, tabela_alimentos.c.gordura_saturada,
             tabela_alimentos.c.fibra, tabela_alimentos.c.proteina, tabela_alimentos.c.carboidrato
         ).where(tabela_alimentos.c.nome_alimento == nome_alimento)
-        return self.connection.execute(stmt).fetchone()
+        with self.engine.connect() as conexao:
+            linha = conexao.execute(stmt).fetchone()
+        return None if linha is None else NutrientesAlimento(*linha)
+
+    def buscar_nome_alimento(self, nome_digitado):
+        # Acha o nome como esta cadastrado no banco a partir do que o usuario digitou
+        # Tenta primeiro o nome exato e depois o nome normalizado, as duas buscas usam indice
+        if self.em_memoria:
+            return self._indice_memoria().nome_cadastrado(nome_digitado, normalizar_nome(nome_digitado))
+        with self.engine.connect() as conexao:
+            exato = conexao.execute(
+                select(tabela_alimentos.c.nome_alimento).where(tabela_alimentos.c.nome_alimento == nome_digitado)
+            ).fetchone()
+            if exato:
+                return exato[0]
+
+            normalizado = conexao.execute(
+                select(tabela_alimentos.c.nome_alimento)
+                .where(tabela_alimentos.c.nome_normalizado == normalizar_nome(nome_digitado))
+                .order_by(tabela_alimentos.c.id).limit(1)
+            ).fetchone()
+        return normalizado[0] if normalizado else None
+
+    def buscar_nomes_alimentos(self, nomes_digitados) -> dict:
+        # Mesmo criterio do buscar_nome_alimento para varios nomes, em poucas consultas IN por bloco
+        # Devolve um dicionario do nome digitado para o nome cadastrado, ou None se nao existir
+        digitados = list(dict.fromkeys(nomes_digitados))
+        if self.em_memoria:
+            indice = self._indice_memoria()
+            return {nome: indice.nome_cadastrado(nome, normalizar_nome(nome)) for nome in digitados}
+
+        nome, normalizado = tabela_alimentos.c.nome_alimento, tabela_alimentos.c.nome_normalizado
+        encontrados = {}
+        with self.engine.connect() as conexao:
+            for inicio in range(0, len(digitados), TAMANHO_BLOCO_CONSULTA):
+                bloco = digitados[inicio:inicio + TAMANHO_BLOCO_CONSULTA]
+                linhas = conexao.execute(select(nome).where(nome.in_(bloco)))
+                encontrados.update((cadastrado, cadastrado) for (cadastrado,) in linhas)
+
+            # Os que nao existem com o nome exato ficam com o de menor id entre os que tem o mesmo nome normalizado
+            por_normalizado = {}
+            for digitado in digitados:
+                if digitado not in encontrados:
+                    por_normalizado.setdefault(normalizar_nome(digitado), []).append(digitado)
+            normalizados = list(por_normalizado)
+            for inicio in range(0, len(normalizados), TAMANHO_BLOCO_CONSULTA):
+                selecao = (select(normalizado, nome)
+                           .where(normalizado.in_(normalizados[inicio:inicio + TAMANHO_BLOCO_CONSULTA]))
+                           .order_by(tabela_alimentos.c.id))
+                for nome_normalizado, cadastrado in conexao.execute(selecao):
+                    for digitado in por_normalizado[nome_normalizado]:
+                        encontrados.setdefault(digitado, cadastrado)
+        return {digitado: encontrados.get(digitado) for digitado in digitados}
+
+    def buscar_alimentos_parecidos(self, nome_digitado, limite=5, candidatos=50, semelhanca_minima=0.2):
+        # Lista os nomes mais parecidos com o digitado, do mais parecido para o menos parecido
+        # O indice de trigramas traz alguns candidatos e a ordem final usa quanto do digitado aparece em cada nome,
+        # assim "Arroz" acha "Arroz Branco Cozido"; entre notas iguais vem primeiro o nome de tamanho mais proximo
+        alvo = normalizar_nome(nome_digitado)
+        if not alvo:
+            return []
+        trigramas_alvo = _trigramas(alvo)
+
+        if self._busca_textual_disponivel() and len(alvo) >= 3:
+            termos = " OR ".join('"' + trigrama.replace('"', '""') + '"' for trigrama in trigramas_alvo)
+            consulta = text(
+                "SELECT a.nome_alimento, a.nome_normalizado FROM AlimentosBusca "
+                "JOIN Alimentos a ON a.id = AlimentosBusca.rowid "
+                "WHERE AlimentosBusca MATCH :termos ORDER BY rank LIMIT :candidatos"
+            )
+            with self.engine.connect() as conexao:
+                encontrados = conexao.execute(consulta, {"termos": termos, "candidatos": candidatos}).fetchall()
+        else:
+            # Sem o indice de trigramas compara com todos os nomes da tabela
+            with self.engine.connect() as conexao:
+                todos = conexao.execute(
+                    select(tabela_alimentos.c.nome_alimento, tabela_alimentos.c.nome_normalizado)
+                ).fetchall()
+            por_normalizado = {normalizado: nome for nome, normalizado in todos}
+            parecidos = difflib.get_close_matches(alvo, list(por_normalizado), n=candidatos, cutoff=0.3)
+            # O difflib compara o nome inteiro, entao os que comecam com o digitado entram a parte
+            parecidos += [normalizado for normalizado in por_normalizado
+                          if normalizado.startswith(alvo) and normalizado not in parecidos][:candidatos]
+            encontrados = [(por_normalizado[normalizado], normalizado) for normalizado in parecidos]
+
+        def semelhanca(item):
+            trigramas = _trigramas(item[1] or "")
+            comuns = len(trigramas & trigramas_alvo)
+            return comuns / len(trigramas_alvo), comuns / len(trigramas | trigramas_alvo)
+
+        ordenados = sorted(((semelhanca(item), item[0]) for item in encontrados), key=lambda par: par[0], reverse=True)
+        return [nome for (contido, _), nome in ordenados[:limite] if contido >= semelhanca_minima]
+
+    def obter_dados_nutricionais_lote(self, nomes_alimentos=None):
+        # Busca o nome e os nutrientes de varios alimentos de uma vez so
+        # Se nenhum nome for passado traz a tabela de alimentos inteira
+        if self.em_memoria:
+            return self._indice_memoria().linhas(None if nomes_alimentos is None else list(nomes_alimentos))
+        with self.engine.connect() as conexao:
+            return self._buscar_nutrientes_lote(conexao, nomes_alimentos)
+
+    def _buscar_nutrientes_lote(self, conexao, nomes_alimentos):
+        # Faz a busca do obter_dados_nutricionais_lote na conexao recebida, para poder ser usada dentro de uma transacao
+        colunas = (
+            tabela_alimentos.c.nome_alimento, tabela_alimentos.c.sodio, tabela_alimentos.c.gordura_saturada,
+            tabela_alimentos.c.fibra, tabela_alimentos.c.proteina, tabela_alimentos.c.carboidrato
+        )
+
+        if nomes_alimentos is None:
+            return conexao.execute(select(*colunas)).fetchall()
+
+        # Tira os nomes repetidos e consulta em blocos para respeitar o limite do sqlite
+        nomes = list(dict.fromkeys(nomes_alimentos))
+        linhas = []
+        for inicio in range(0, len(nomes), TAMANHO_BLOCO_CONSULTA):
+            bloco = nomes[inicio:inicio + TAMANHO_BLOCO_CONSULTA]
+            stmt = select(*colunas).where(tabela_alimentos.c.nome_alimento.in_(bloco))
+            linhas.extend(conexao.execute(stmt).fetchall())
+        return linhas
 
     def obter_todos_alimentos(self):
         # Pega a lista com o nome de todos os alimentos
+        # No modo em_memoria a lista ordenada ja esta pronta e e mantida a cada gravacao
+        if self.em_memoria:
+            return self._indice_memoria().nomes_em_ordem()
         selecao = select(tabela_alimentos.c.nome_alimento).order_by(tabela_alimentos.c.nome_alimento)
-        return [row[0] for row in self.connection.execute(selecao)]
+        with self.engine.connect() as conexao:
+            return [row[0] for row in conexao.execute(selecao)]
+
+    def listar_alimentos_pagina(self, apos=None, limite=TAMANHO_PAGINA_ALIMENTOS, prefixo=None) -> list[str]:
+        # Uma pagina de nomes em ordem alfabetica sem acentos, comecando depois do nome `apos` (paginacao por chave)
+        # Para a proxima pagina passe o ultimo nome recebido em `apos`. Cada pagina le so `limite` linhas do indice,
+        # qualquer que seja o tamanho da tabela. Com prefixo so entram os nomes que comecam com ele, sem acentos
+        # e sem diferenciar maiusculas
+        prefixo = normalizar_nome(prefixo) if prefixo else ""
+        if limite <= 0:
+            return []
+        if self.em_memoria:
+            chave = (normalizar_nome(apos), apos) if apos is not None else None
+            return self._indice_memoria().pagina_nomes(chave, limite, prefixo)
+
+        # O comeco da pagina vai numa comparacao so de (nome normalizado, nome), o maior entre o prefixo e o ultimo
+        # nome recebido. Com duas condicoes de inicio o sqlite busca pela do prefixo e percorre tudo ate o cursor
+        inicio = (prefixo, "") if prefixo else None
+        if apos is not None:
+            inicio = max(inicio or (), (normalizar_nome(apos), apos))
+        normalizado, nome = tabela_alimentos.c.nome_normalizado, tabela_alimentos.c.nome_alimento
+        selecao = select(nome).order_by(normalizado, nome).limit(limite)
+        if inicio is not None:
+            selecao = selecao.where(tuple_(normalizado, nome) > tuple_(*inicio))
+        if prefixo:
+            selecao = selecao.where(normalizado < prefixo + MAIOR_CARACTERE)
+        with self.engine.connect() as conexao:
+            return [row[0] for row in conexao.execute(selecao)]
+
+    def iterar_nomes_alimentos(self, prefixo=None, tamanho_pagina=TAMANHO_BLOCO_CSV):
+        # Entrega os nomes na ordem do listar_alimentos_pagina, buscando uma pagina de cada vez
+        # Nenhuma consulta fica aberta entre as paginas, entao o gerador pode ser consumido devagar
+        apos = None
+        while True:
+            pagina = self.listar_alimentos_pagina(apos, tamanho_pagina, prefixo)
+            yield from pagina
+            if len(pagina) < tamanho_pagina:
+                return
+            apos = pagina[-1]
 
     def obter_valores_coluna(self, nome_coluna: str) -> list[float]:
         # Pega todos os numeros de uma coluna especifica tipo so o sodio de todos
@@ -123,20 +850,164 @@ class AlimentoRepository:
         if coluna is None:
             print(f"A coluna {nome_coluna} não foi encontrada na tabela Alimentos.")
             return []
+        if self.em_memoria and nome_coluna in COLUNAS_NUTRIENTES:
+            return self._indice_memoria().valores_coluna(nome_coluna)
 
         selecao = select(coluna)
 
-        return [float(row[0]) for row in self.connection.execute(selecao).fetchall()]
+        with self.engine.connect() as conexao:
+            return [float(row[0]) for row in conexao.execute(selecao).fetchall()]
+
+    def iterar_lotes_nutrientes(self, tamanho_lote=TAMANHO_BLOCO_CSV):
+        # Le as 5 colunas de nutrientes numa consulta so e entrega as linhas aos poucos em lotes
+        if self.em_memoria:
+            yield from self._indice_memoria().iterar_lotes(tamanho_lote, com_nome=False)
+            return
+        selecao = select(*(tabela_alimentos.c[coluna] for coluna in COLUNAS_NUTRIENTES))
+        yield from self._iterar_lotes(selecao, tamanho_lote)
+
+    def contar_alimentos(self) -> int:
+        # Quantidade de alimentos cadastrados
+        if self.em_memoria:
+            return len(self._indice_memoria().nomes)
+        with self.engine.connect() as conexao:
+            return conexao.execute(select(func.count()).select_from(tabela_alimentos)).scalar()
+
+    def iterar_lotes_alimentos(self, tamanho_lote=TAMANHO_BLOCO_CSV):
+        # Le id, nome e os 5 nutrientes de todos os alimentos em ordem de id, entregues em lotes
+        selecao = select(
+            tabela_alimentos.c.id, tabela_alimentos.c.nome_alimento,
+            *(tabela_alimentos.c[coluna] for coluna in COLUNAS_NUTRIENTES)
+        ).order_by(tabela_alimentos.c.id)
+        yield from self._iterar_lotes(selecao, tamanho_lote)
+
+    def obter_intervalo_ids(self) -> tuple:
+        # Menor e maior id da tabela de alimentos, usados para dividir a tabela em fatias
+        if self.em_memoria:
+            return self._indice_memoria().intervalo_ids()
+        with self.engine.connect() as conexao:
+            return tuple(conexao.execute(
+                select(func.min(tabela_alimentos.c.id), func.max(tabela_alimentos.c.id))
+            ).fetchone())
+
+    def obter_nutrientes_por_intervalo(self, id_inicial, id_final):
+        # Traz o id e os nutrientes dos alimentos com id entre id_inicial e id_final (os dois inclusos)
+        if self.em_memoria:
+            return self._indice_memoria().nutrientes_por_intervalo(id_inicial, id_final)
+        selecao = select(
+            tabela_alimentos.c.id, *(tabela_alimentos.c[coluna] for coluna in COLUNAS_NUTRIENTES)
+        ).where(tabela_alimentos.c.id.between(id_inicial, id_final))
+        with self.engine.connect() as conexao:
+            return conexao.execute(selecao).fetchall()
+
+    def gravar_classificacoes(self, classificacoes):
+        # Grava varias classificacoes de uma vez, substituindo a anterior de cada alimento
+        # Cada item tem id_alimento, risco, classificacao, id_regra, hash_nutrientes e hash_configuracao
+        if not classificacoes:
+            return
+        agora = datetime.now(timezone.utc)
+        registros = [{**item, "classificado_em": agora} for item in classificacoes]
+        with self.engine.begin() as conexao:
+            if self.eh_sqlite:
+                comando = insert_sqlite(tabela_classificacoes)
+                comando = comando.on_conflict_do_update(
+                    index_elements=[tabela_classificacoes.c.id_alimento],
+                    set_={coluna: comando.excluded[coluna]
+                          for coluna in ("risco", "classificacao", "id_regra", "classificado_em", "hash_nutrientes",
+                                         "hash_configuracao")}
+                )
+                conexao.execute(comando, registros)
+            else:
+                ids = [registro["id_alimento"] for registro in registros]
+                for inicio in range(0, len(ids), TAMANHO_BLOCO_CONSULTA):
+                    conexao.execute(delete(tabela_classificacoes).where(
+                        tabela_classificacoes.c.id_alimento.in_(ids[inicio:inicio + TAMANHO_BLOCO_CONSULTA])))
+                conexao.execute(insert(tabela_classificacoes), registros)
+
+    def obter_alimentos_pendentes_classificacao(self, hash_configuracao, limite=TAMANHO_BLOCO_CSV):
+        # Alimentos sem classificacao guardada ou classificados com outra configuracao de limites e regras
+        # Devolve no maximo "limite" linhas no formato (id, sodio, gordura, fibra, proteina, carboidrato)
+        selecao = select(
+            tabela_alimentos.c.id, *(tabela_alimentos.c[coluna] for coluna in COLUNAS_NUTRIENTES)
+        ).select_from(
+            tabela_alimentos.outerjoin(tabela_classificacoes,
+                                       tabela_classificacoes.c.id_alimento == tabela_alimentos.c.id)
+        ).where(
+            tabela_classificacoes.c.id_alimento.is_(None)
+            | tabela_classificacoes.c.hash_configuracao.is_(None)
+            | (tabela_classificacoes.c.hash_configuracao != hash_configuracao)
+        ).order_by(tabela_alimentos.c.id).limit(limite)
+        with self.engine.connect() as conexao:
+            return conexao.execute(selecao).fetchall()
+
+    def iterar_lotes_nutrientes_classificados(self, tamanho_lote=TAMANHO_BLOCO_CSV):
+        # Traz o id, os nutrientes e o hash de nutrientes guardado de todos os alimentos ja classificados
+        # Usado para conferir se algum alimento mudou sem passar pelos gatilhos (bancos que nao sao sqlite)
+        selecao = select(
+            tabela_alimentos.c.id, *(tabela_alimentos.c[coluna] for coluna in COLUNAS_NUTRIENTES),
+            tabela_classificacoes.c.hash_nutrientes
+        ).select_from(
+            tabela_alimentos.join(tabela_classificacoes, tabela_classificacoes.c.id_alimento == tabela_alimentos.c.id)
+        )
+        yield from self._iterar_lotes(selecao, tamanho_lote)
+
+    def remover_classificacoes(self, ids_alimentos):
+        # Apaga as classificacoes guardadas desses alimentos para eles voltarem a ficar pendentes
+        ids = list(ids_alimentos)
+        with self.engine.begin() as conexao:
+            for inicio in range(0, len(ids), TAMANHO_BLOCO_CONSULTA):
+                conexao.execute(delete(tabela_classificacoes).where(
+                    tabela_classificacoes.c.id_alimento.in_(ids[inicio:inicio + TAMANHO_BLOCO_CONSULTA])))
+
+    def obter_alimentos_por_risco(self, risco):
+        # Lista os nomes dos alimentos com o risco guardado informado, usando o indice da coluna risco
+        selecao = select(tabela_alimentos.c.nome_alimento).select_from(
+            tabela_classificacoes.join(tabela_alimentos, tabela_alimentos.c.id == tabela_classificacoes.c.id_alimento)
+        ).where(tabela_classificacoes.c.risco == risco).order_by(tabela_alimentos.c.nome_alimento)
+        with self.engine.connect() as conexao:
+            return [linha[0] for linha in conexao.execute(selecao)]
+
+    def contar_classificacoes_por_risco(self) -> dict:
+        # Quantidade de alimentos de cada risco segundo as classificacoes guardadas
+        selecao = select(tabela_classificacoes.c.risco, func.count()).group_by(tabela_classificacoes.c.risco)
+        with self.engine.connect() as conexao:
+            return {risco: quantidade for risco, quantidade in conexao.execute(selecao)}
 
     def obter_dados_relatorio(self):
         # Pega tudo do banco para gerar o relatorio
+        if self.em_memoria:
+            return self._indice_memoria().linhas()
         selecao = select(
             tabela_alimentos.c.nome_alimento, tabela_alimentos.c.sodio,
             tabela_alimentos.c.gordura_saturada, tabela_alimentos.c.fibra,
             tabela_alimentos.c.proteina, tabela_alimentos.c.carboidrato
         )
-        return self.connection.execute(selecao).fetchall()
+        with self.engine.connect() as conexao:
+            return conexao.execute(selecao).fetchall()
+
+    def iterar_lotes_relatorio(self, tamanho_lote=TAMANHO_BLOCO_CSV):
+        # Mesmo conteudo do obter_dados_relatorio mas entregue aos poucos em lotes
+        # O banco devolve as linhas conforme elas sao lidas, sem guardar a tabela toda na memoria
+        if self.em_memoria:
+            yield from self._indice_memoria().iterar_lotes(tamanho_lote)
+            return
+        selecao = select(
+            tabela_alimentos.c.nome_alimento, tabela_alimentos.c.sodio,
+            tabela_alimentos.c.gordura_saturada, tabela_alimentos.c.fibra,
+            tabela_alimentos.c.proteina, tabela_alimentos.c.carboidrato
+        )
+        yield from self._iterar_lotes(selecao, tamanho_lote)
+
+    def _iterar_lotes(self, selecao, tamanho_lote):
+        # Entrega o resultado da consulta em lotes, a conexao fica presa ao gerador ate ele terminar
+        with self.engine.connect() as conexao:
+            resultado = conexao.execution_options(yield_per=tamanho_lote).execute(selecao)
+            try:
+                for lote in resultado.partitions():
+                    yield lote
+            finally:
+                resultado.close()
 
     def fechar_conexao(self):
-        # Encerra a comunicacao com o banco
-        self.connection.close()
\ No newline at end of file
+        # Encerra a comunicacao com o banco fechando todas as conexoes do pool
+        self.engine.dispose()
\ No newline at end of file
@@ -1,6 +1,192 @@
 import math
+import random
 from collections import Counter
 
+# Colunas de nutrientes usadas na analise estatistica
+COLUNAS_ESTATISTICA = ("sodio", "gordura_saturada", "fibra", "proteina", "carboidrato")
+
+
+class AcumuladorEstatistico:
+    # Guarda a quantidade a media e a soma dos quadrados dos desvios (M2) de uma coluna
+    # Os valores sao processados uma vez so conforme chegam, sem precisar guardar a lista inteira
+    # Usa o metodo de Welford que nao perde precisao como a formula da soma dos quadrados
+
+    def __init__(self, quantidade=0, media=0.0, m2=0.0):
+        self.quantidade = quantidade
+        self.media = media
+        self.m2 = m2
+
+    @classmethod
+    def de_somas(cls, quantidade, soma, soma_quadrados) -> "AcumuladorEstatistico":
+        # Monta o acumulador a partir da quantidade da soma e da soma dos quadrados guardadas no banco
+        if quantidade == 0:
+            return cls()
+        media = soma / quantidade
+        # O max evita M2 negativo por arredondamento quando todos os valores sao iguais
+        return cls(quantidade, media, max(soma_quadrados - soma * media, 0.0))
+
+    def adicionar(self, valor: float):
+        # Atualiza a media e o M2 com um valor novo
+        self.quantidade += 1
+        delta = valor - self.media
+        self.media += delta / self.quantidade
+        self.m2 += delta * (valor - self.media)
+
+    def adicionar_lote(self, valores):
+        # Calcula a media e o M2 do lote e junta com o que ja estava acumulado
+        valores = list(valores)
+        if not valores:
+            return
+        media_lote = sum(valores) / len(valores)
+        m2_lote = sum((x - media_lote) ** 2 for x in valores)
+        self.juntar(AcumuladorEstatistico(len(valores), media_lote, m2_lote))
+
+    def juntar(self, outro: "AcumuladorEstatistico"):
+        # Junta dois acumuladores como se todos os valores tivessem passado por um so
+        if outro.quantidade == 0:
+            return
+        total = self.quantidade + outro.quantidade
+        delta = outro.media - self.media
+        self.media += delta * outro.quantidade / total
+        self.m2 += outro.m2 + delta * delta * self.quantidade * outro.quantidade / total
+        self.quantidade = total
+
+    def variancia(self) -> float:
+        # Variancia amostral dividindo pelo total menos um
+        if self.quantidade < 2:
+            return 0.0
+        return self.m2 / (self.quantidade - 1)
+
+    def desvio_padrao(self) -> float:
+        return math.sqrt(self.variancia())
+
+
+class SketchQuantis:
+    # Resumo de tamanho limitado para estimar mediana e percentis sem guardar a coluna inteira (sketch KLL)
+    # Os valores ficam em niveis, cada valor do nivel h representa 2**h valores originais
+    # Quando um nivel enche ele e ordenado e metade dos valores sobe para o nivel de cima
+    # O erro do percentil fica na ordem de 1/k e a memoria cresce so com o logaritmo da quantidade
+
+    def __init__(self, k=200, semente=None):
+        self.k = k
+        self.quantidade = 0
+        self.niveis = [[]]
+        self._sorteio = random.Random(semente)
+
+    def _capacidade(self, nivel: int) -> int:
+        # Os niveis de cima guardam mais valores porque cada um pesa mais
+        altura = len(self.niveis) - nivel - 1
+        return max(2, int(math.ceil(self.k * (2 / 3) ** altura)))
+
+    def _tamanho_maximo(self) -> int:
+        return sum(self._capacidade(nivel) for nivel in range(len(self.niveis)))
+
+    def _compactar(self):
+        # Compacta niveis cheios ate o total de valores guardados voltar para baixo do limite
+        while sum(len(valores) for valores in self.niveis) >= self._tamanho_maximo():
+            for nivel, valores in enumerate(self.niveis):
+                if len(valores) >= self._capacidade(nivel):
+                    if nivel + 1 == len(self.niveis):
+                        self.niveis.append([])
+                    valores.sort()
+                    # Sobra um valor quando a quantidade e impar, ele continua no mesmo nivel
+                    sobra = [valores.pop()] if len(valores) % 2 else []
+                    inicio = self._sorteio.randint(0, 1)
+                    self.niveis[nivel + 1].extend(valores[inicio::2])
+                    self.niveis[nivel] = sobra
+                    break
+
+    def adicionar(self, valor: float):
+        self.niveis[0].append(valor)
+        self.quantidade += 1
+        if len(self.niveis[0]) >= self._capacidade(0):
+            self._compactar()
+
+    def adicionar_lote(self, valores):
+        valores = list(valores)
+        self.niveis[0].extend(valores)
+        self.quantidade += len(valores)
+        self._compactar()
+
+    def juntar(self, outro: "SketchQuantis"):
+        # Junta o resumo de outra parte dos dados, o resultado vale para as duas partes juntas
+        while len(self.niveis) < len(outro.niveis):
+            self.niveis.append([])
+        for nivel, valores in enumerate(outro.niveis):
+            self.niveis[nivel].extend(valores)
+        self.quantidade += outro.quantidade
+        self._compactar()
+
+    def percentis(self, fracoes) -> list:
+        # Estima varios percentis de uma vez, as fracoes vao de 0 a 1 (0.5 e a mediana)
+        pesados = sorted((valor, 2 ** nivel) for nivel, valores in enumerate(self.niveis) for valor in valores)
+        if not pesados:
+            return [None for _ in fracoes]
+
+        total = sum(peso for _, peso in pesados)
+        resultados = []
+        for fracao in fracoes:
+            alvo = fracao * total
+            acumulado = 0
+            escolhido = pesados[-1][0]
+            for valor, peso in pesados:
+                acumulado += peso
+                if acumulado >= alvo:
+                    escolhido = valor
+                    break
+            resultados.append(escolhido)
+        return resultados
+
+    def percentil(self, fracao: float):
+        return self.percentis([fracao])[0]
+
+
+class ContadorFrequentes:
+    # Acha os valores que mais se repetem guardando no maximo k - 1 contadores (algoritmo Misra-Gries)
+    # Todo valor que aparece mais de quantidade / k vezes com certeza fica entre os contadores
+    # A contagem guardada pode ficar abaixo da real em no maximo quantidade / k
+
+    def __init__(self, k=100):
+        self.k = k
+        self.quantidade = 0
+        self.contadores = {}
+
+    def adicionar(self, valor):
+        self.quantidade += 1
+        if valor in self.contadores:
+            self.contadores[valor] += 1
+        elif len(self.contadores) < self.k - 1:
+            self.contadores[valor] = 1
+        else:
+            # Nao tem espaco para o valor novo, entao desconta um de todos e tira os que zeraram
+            for chave in list(self.contadores):
+                self.contadores[chave] -= 1
+                if self.contadores[chave] == 0:
+                    del self.contadores[chave]
+
+    def adicionar_lote(self, valores):
+        for valor in valores:
+            self.adicionar(valor)
+
+    def juntar(self, outro: "ContadorFrequentes"):
+        # Soma os contadores e desconta o k-esimo maior para voltar a no maximo k - 1 contadores
+        somados = Counter(self.contadores)
+        somados.update(outro.contadores)
+        if len(somados) >= self.k:
+            desconto = sorted(somados.values(), reverse=True)[self.k - 1]
+            somados = {chave: valor - desconto for chave, valor in somados.items() if valor > desconto}
+        self.contadores = dict(somados)
+        self.quantidade += outro.quantidade
+
+    def moda(self):
+        # Mesmo formato do calcular_moda: lista com os valores mais frequentes ou None se nada se repete
+        if not self.contadores:
+            return None
+        maior = max(self.contadores.values())
+        if maior < 2:
+            return None
+        return [chave for chave, valor in self.contadores.items() if valor == maior]
+
 
 def calcular_media(dados: list[float]) -> float:
     # Faz a conta da media somando tudo e dividindo pela quantidade
@@ -14,18 +200,98 @@ def calcular_variancia_e_desvio(dados: list[float]) -> tuple[float, float]:
     if len(dados) < 2:
         return 0.0, 0.0
 
-    media = calcular_media(dados)
+    # Passa pelos numeros uma vez so atualizando a media e a soma das diferencas ao quadrado
+    acumulador = AcumuladorEstatistico()
+    for x in dados:
+        acumulador.adicionar(x)
+
+    # Divide pelo total menos um e tira a raiz quadrada pra achar o desvio
+    return acumulador.variancia(), acumulador.desvio_padrao()
+
+
+def calcular_estatisticas_colunas(lotes, colunas=COLUNAS_ESTATISTICA) -> dict:
+    # Recebe os lotes de linhas vindos do banco com uma coluna por nutriente
+    # Percorre tudo uma vez so e devolve um acumulador para cada coluna
+    acumuladores = {coluna: AcumuladorEstatistico() for coluna in colunas}
+    for lote in lotes:
+        # Transpoe o lote para ter os valores de cada coluna juntos
+        for coluna, valores in zip(colunas, zip(*lote)):
+            acumuladores[coluna].adicionar_lote(float(valor) for valor in valores)
+    return acumuladores
+
+
+def calcular_estatisticas_numpy(matriz, colunas=COLUNAS_ESTATISTICA) -> dict:
+    # Versao para quando os dados ja estao na memoria numa matriz do numpy com uma coluna por nutriente
+    # Devolve os mesmos acumuladores do calcular_estatisticas_colunas
+    import numpy as np
+
+    matriz = np.asarray(matriz, dtype=float).reshape(-1, len(colunas))
+    quantidade = matriz.shape[0]
+    if quantidade == 0:
+        return {coluna: AcumuladorEstatistico() for coluna in colunas}
 
-    # Soma as diferencas ao quadrado
-    soma_diferencas_quadrado = sum([(x - media) ** 2 for x in dados])
+    medias = matriz.mean(axis=0)
+    m2s = ((matriz - medias) ** 2).sum(axis=0)
+    return {coluna: AcumuladorEstatistico(quantidade, float(media), float(m2))
+            for coluna, media, m2 in zip(colunas, medias.tolist(), m2s.tolist())}
 
-    # Divide pelo total menos um
-    variancia = soma_diferencas_quadrado / (len(dados) - 1)
 
-    # Tira a raiz quadrada pra achar o desvio
-    desvio_padrao = math.sqrt(variancia)
+def calcular_sketches_colunas(lotes, colunas=COLUNAS_ESTATISTICA, k=200) -> dict:
+    # Percorre os lotes vindos do banco uma vez so e monta os resumos de percentis e de moda de cada coluna
+    # A memoria usada depende so do k e nao da quantidade de alimentos
+    sketches = {coluna: (SketchQuantis(k), ContadorFrequentes(k)) for coluna in colunas}
+    for lote in lotes:
+        for coluna, valores in zip(colunas, zip(*lote)):
+            valores = [float(valor) for valor in valores]
+            quantis, frequentes = sketches[coluna]
+            quantis.adicionar_lote(valores)
+            frequentes.adicionar_lote(valores)
+    return sketches
 
-    return variancia, desvio_padrao
+
+def calcular_estatisticas_catalogos(catalogos, colunas=COLUNAS_ESTATISTICA) -> dict:
+    # Junta os acumuladores de varios catalogos (por exemplo um por lote lido do banco)
+    # Cada catalogo e calculado com o numpy direto nas colunas dele
+    acumuladores = {coluna: AcumuladorEstatistico() for coluna in colunas}
+    for catalogo in catalogos:
+        for coluna, acumulador in catalogo.estatisticas().items():
+            if coluna in acumuladores:
+                acumuladores[coluna].juntar(acumulador)
+    return acumuladores
+
+
+def calcular_sketches_catalogos(catalogos, k=200, tamanho_bloco=10000, colunas=COLUNAS_ESTATISTICA) -> dict:
+    # Mesmo resultado do calcular_sketches_colunas, lendo as colunas dos catalogos em vez de linhas
+    sketches = {coluna: (SketchQuantis(k), ContadorFrequentes(k)) for coluna in colunas}
+    for catalogo in catalogos:
+        for _, blocos in catalogo.iterar_blocos(tamanho_bloco):
+            for coluna, valores in zip(colunas, blocos):
+                valores = valores.tolist()
+                quantis, frequentes = sketches[coluna]
+                quantis.adicionar_lote(valores)
+                frequentes.adicionar_lote(valores)
+    return sketches
+
+
+def calcular_estatisticas_agregadas(agregadas: dict) -> dict:
+    # Transforma os totais guardados na tabela de estatisticas em acumuladores, sem ler nenhum alimento
+    return {coluna: AcumuladorEstatistico.de_somas(*agregadas.get(coluna, (0, 0.0, 0.0)))
+            for coluna in COLUNAS_ESTATISTICA}
+
+
+def verificar_estatisticas(repo, corrigir=False) -> bool:
+    # Recalcula as estatisticas do zero e mostra as colunas em que os totais guardados se desviaram
+    diferencas = repo.verificar_estatisticas_agregadas()
+    if not diferencas:
+        print("Estatísticas agregadas conferem com a tabela de alimentos.")
+        return True
+
+    for coluna, valores in diferencas.items():
+        print(f"Diferença em {coluna}: guardado {valores['guardado']}, recalculado {valores['recalculado']}")
+    if corrigir:
+        repo.recalcular_estatisticas_agregadas()
+        print("Estatísticas agregadas recalculadas.")
+    return False
 
 
 def calcular_moda(dados: list[float]):
@@ -39,4 +305,18 @@ def calcular_moda(dados: list[float]):
 
     if len(modas) == len(dados):
         return None
-    return modas
\ No newline at end of file
+    return modas
+
+
+if __name__ == '__main__':
+    # Comando de verificacao: python estatistica.py [--corrigir]
+    import sys
+    from database import AlimentoRepository
+
+    repositorio = AlimentoRepository()
+    try:
+        repositorio.criar_esquema()
+        conferem = verificar_estatisticas(repositorio, corrigir="--corrigir" in sys.argv[1:])
+    finally:
+        repositorio.fechar_conexao()
+    sys.exit(0 if conferem else 1)
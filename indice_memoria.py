@@ -0,0 +1,174 @@
+import bisect
+import threading
+from array import array
+
+from catalogo import COLUNAS_CATALOGO, CatalogoNutrientes, NutrientesAlimento
+
+
+class IndiceAlimentos:
+    # Copia da tabela Alimentos na memoria usada pelo modo em_memoria do AlimentoRepository
+    # Os nutrientes ficam em colunas (array('d')), com um dicionario de nome para posicao
+    # A lista de nomes ordenados e mantida a cada insercao e remocao, sem ordenar de novo a cada leitura
+    # O mesmo vale para as chaves (nome normalizado, nome) usadas na listagem paginada
+    # Os totais de cada nutriente tambem sao mantidos, como os gatilhos fazem no banco
+
+    def __init__(self):
+        self._trava = threading.RLock()
+        self.colunas = {coluna: array("d") for coluna in COLUNAS_CATALOGO}
+        self.ids = array("q")
+        self.nomes = []
+        self.posicoes = {}
+        # Nome normalizado para a lista de (id, nome) que tem esse nome normalizado, em ordem de id
+        self.por_normalizado = {}
+        self.nomes_ordenados = []
+        self.chaves_ordenadas = []
+        self.somas = {coluna: [0.0, 0.0] for coluna in COLUNAS_CATALOGO}
+
+    @classmethod
+    def de_lotes(cls, lotes):
+        # Monta o indice a partir de lotes de linhas (id, nome, nome_normalizado, 5 nutrientes) em ordem de id
+        indice = cls()
+        for lote in lotes:
+            for linha in lote:
+                indice._acrescentar(linha[0], linha[1], linha[2], linha[3:8])
+        indice.nomes_ordenados.sort()
+        indice.chaves_ordenadas.sort()
+        return indice
+
+    def _acrescentar(self, id_alimento, nome, nome_normalizado, valores):
+        self.posicoes[nome] = len(self.nomes)
+        self.nomes.append(nome)
+        self.ids.append(id_alimento)
+        for coluna, valor in zip(COLUNAS_CATALOGO, valores):
+            self.colunas[coluna].append(valor)
+            self.somas[coluna][0] += valor
+            self.somas[coluna][1] += valor * valor
+        bisect.insort(self.por_normalizado.setdefault(nome_normalizado, []), (id_alimento, nome))
+        self.nomes_ordenados.append(nome)
+        self.chaves_ordenadas.append((nome_normalizado, nome))
+
+    def adicionar(self, id_alimento, nome, nome_normalizado, valores):
+        # Inclui um alimento novo ja gravado no banco
+        with self._trava:
+            self._acrescentar(id_alimento, nome, nome_normalizado, valores)
+            self.nomes_ordenados.pop()
+            bisect.insort(self.nomes_ordenados, nome)
+            self.chaves_ordenadas.pop()
+            bisect.insort(self.chaves_ordenadas, (nome_normalizado, nome))
+
+    def remover(self, nome, nome_normalizado):
+        # Tira um alimento do indice trazendo o ultimo para o lugar dele, sem deslocar as colunas
+        with self._trava:
+            posicao = self.posicoes.pop(nome, None)
+            if posicao is None:
+                return
+            id_alimento = self.ids[posicao]
+            ultima = len(self.nomes) - 1
+            for coluna, valores in self.colunas.items():
+                valor = valores[posicao]
+                self.somas[coluna][0] -= valor
+                self.somas[coluna][1] -= valor * valor
+                valores[posicao] = valores[ultima]
+                valores.pop()
+            self.ids[posicao] = self.ids[ultima]
+            self.ids.pop()
+            self.nomes[posicao] = self.nomes[ultima]
+            self.nomes.pop()
+            if posicao != ultima:
+                self.posicoes[self.nomes[posicao]] = posicao
+
+            mesmos = self.por_normalizado.get(nome_normalizado, [])
+            if (id_alimento, nome) in mesmos:
+                mesmos.remove((id_alimento, nome))
+            if not mesmos:
+                self.por_normalizado.pop(nome_normalizado, None)
+            del self.nomes_ordenados[bisect.bisect_left(self.nomes_ordenados, nome)]
+            del self.chaves_ordenadas[bisect.bisect_left(self.chaves_ordenadas, (nome_normalizado, nome))]
+
+    def nutrientes(self, nome):
+        # Nutrientes de um alimento ou None se ele nao existir
+        with self._trava:
+            posicao = self.posicoes.get(nome)
+            if posicao is None:
+                return None
+            return NutrientesAlimento(*(self.colunas[coluna][posicao] for coluna in COLUNAS_CATALOGO))
+
+    def nome_cadastrado(self, nome_digitado, nome_normalizado):
+        # Mesmo criterio do buscar_nome_alimento: nome exato e depois o normalizado de menor id
+        with self._trava:
+            if nome_digitado in self.posicoes:
+                return nome_digitado
+            mesmos = self.por_normalizado.get(nome_normalizado)
+            return mesmos[0][1] if mesmos else None
+
+    def linhas(self, nomes=None) -> list[tuple]:
+        # Linhas (nome, 5 nutrientes) dos nomes pedidos que existem, ou de todos os alimentos
+        with self._trava:
+            if nomes is None:
+                posicoes = range(len(self.nomes))
+            else:
+                posicoes = [self.posicoes[nome] for nome in dict.fromkeys(nomes) if nome in self.posicoes]
+            colunas = [self.colunas[coluna] for coluna in COLUNAS_CATALOGO]
+            return [(self.nomes[posicao], *(valores[posicao] for valores in colunas)) for posicao in posicoes]
+
+    def iterar_lotes(self, tamanho_lote, com_nome=True):
+        # Mesmo formato dos lotes lidos do banco, com ou sem o nome na frente
+        # Cada lote e montado so quando for pedido, a tabela inteira nao e copiada em linhas de uma vez
+        inicio = 0
+        while True:
+            with self._trava:
+                fim = min(inicio + tamanho_lote, len(self.nomes))
+                colunas = [self.colunas[coluna] for coluna in COLUNAS_CATALOGO]
+                if com_nome:
+                    lote = [(self.nomes[posicao], *(valores[posicao] for valores in colunas))
+                            for posicao in range(inicio, fim)]
+                else:
+                    lote = list(zip(*(valores[inicio:fim] for valores in colunas)))
+            if not lote:
+                return
+            yield lote
+            inicio = fim
+
+    def nomes_em_ordem(self) -> list[str]:
+        with self._trava:
+            return list(self.nomes_ordenados)
+
+    def pagina_nomes(self, apos, limite, prefixo="") -> list[str]:
+        # Mesma pagina do listar_alimentos_pagina: ate `limite` nomes depois da chave `apos` que comecam com o prefixo
+        with self._trava:
+            if apos is None:
+                inicio = bisect.bisect_left(self.chaves_ordenadas, (prefixo,))
+            else:
+                inicio = bisect.bisect_right(self.chaves_ordenadas, max(apos, (prefixo,)))
+            pagina = []
+            for normalizado, nome in self.chaves_ordenadas[inicio:inicio + limite]:
+                if not normalizado.startswith(prefixo):
+                    break
+                pagina.append(nome)
+            return pagina
+
+    def valores_coluna(self, coluna) -> list[float]:
+        with self._trava:
+            return self.colunas[coluna].tolist()
+
+    def estatisticas_agregadas(self) -> dict:
+        # Mesmo formato do obter_estatisticas_agregadas: (quantidade, soma, soma dos quadrados)
+        with self._trava:
+            return {coluna: (len(self.nomes), soma, soma_quadrados)
+                    for coluna, (soma, soma_quadrados) in self.somas.items()}
+
+    def intervalo_ids(self) -> tuple:
+        with self._trava:
+            return (min(self.ids), max(self.ids)) if self.ids else (None, None)
+
+    def nutrientes_por_intervalo(self, id_inicial, id_final) -> list[tuple]:
+        with self._trava:
+            colunas = [self.colunas[coluna] for coluna in COLUNAS_CATALOGO]
+            return [(id_alimento, *(valores[posicao] for valores in colunas))
+                    for posicao, id_alimento in enumerate(self.ids) if id_inicial <= id_alimento <= id_final]
+
+    def catalogo(self) -> CatalogoNutrientes:
+        # Copia das colunas num CatalogoNutrientes, quem recebe pode usar o numpy sem travar o indice
+        with self._trava:
+            return CatalogoNutrientes({coluna: array("d", valores) for coluna, valores in self.colunas.items()},
+                                      list(self.nomes), array("q", self.ids))
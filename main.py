@@ -1,10 +1,11 @@
 import os
 import csv
 import sys
+import threading
 # Importa as classes e funcoes dos modulos
-from database import AlimentoRepository
-from agente import AgenteDeRisco
+# O banco, o agente e o snapshot sao importados so quando precisam, o menu nao depende deles
 from cli import menu_principal, limpar_tela, Cor
+from metricas import configurar_pelo_ambiente
 
 
 # Funcao para criar o arquivo de dados inicial
@@ -54,31 +55,63 @@ def criar_arquivo_dados_csv():
         print(f"Arquivo '{caminho}' ja existe.")
 
 
+def importar_modulos_pesados():
+    # Importa o SQLAlchemy e os modulos do banco numa thread enquanto o menu espera a escolha
+    # Quando a pessoa escolhe uma opcao os modulos ja estao prontos
+    try:
+        import database
+        import agente
+        import snapshot
+    except ImportError:
+        # O erro aparece de novo, com a mensagem certa, quando o menu for preparar o banco
+        pass
+
+
 def inicializar_projeto():
     # Prepara o banco de dados e carrega as informacoes
-    repo = AlimentoRepository()
+    from database import AlimentoRepository, memoria_pelo_ambiente
+    from snapshot import carregar_dados_iniciais
+
+    # Com AGENTE_MEMORIA=1 as leituras de alimentos e regras passam a vir da memoria
+    repo = AlimentoRepository(em_memoria=memoria_pelo_ambiente())
 
     print("\n--- INICIALIZACAO DO SISTEMA ---")
-    repo.criar_esquema()
-    repo.inserir_regras()
+    # Tabelas e regras so sao criadas quando o marcador de versao do esquema nao confere
+    repo.preparar_banco()
     criar_arquivo_dados_csv()
-    repo.inserir_dados_csv("dados_alimentos.csv")
+    # So le o csv de novo se ele mudou desde a ultima carga
+    carregar_dados_iniciais(repo, "dados_alimentos.csv")
+    if repo.em_memoria:
+        repo.carregar_memoria()
     print("--- BANCO DE DADOS PRONTO ---\n")
     return repo
 
 
+def preparar_agente():
+    # Liga o banco e cria o agente, chamado pelo menu na primeira opcao que precisa deles
+    global repo
+    from agente import AgenteDeRisco
+
+    # 1. Inicia o banco de dados
+    repo = inicializar_projeto()
+
+    # 2. Cria a inteligencia do agente de risco
+    agente = AgenteDeRisco(repo)
+    # Reclassifica so os alimentos novos ou alterados desde a ultima execucao
+    agente.sincronizar_classificacoes()
+    return agente
+
+
 if __name__ == '__main__':
     limpar_tela()
     repo = None
     try:
-        # 1. Inicia o banco de dados
-        repo = inicializar_projeto()
-
-        # 2. Cria a inteligencia do agente de risco
-        agente = AgenteDeRisco(repo)
+        # Com AGENTE_METRICAS ou AGENTE_PERFIL definidos liga as metricas e o perfil antes de tudo
+        configurar_pelo_ambiente()
+        threading.Thread(target=importar_modulos_pesados, daemon=True).start()
 
-        # 3. Inicia o menu do programa
-        menu_principal(agente, repo)
+        # 3. Inicia o menu do programa, o banco e o agente so sao preparados quando uma opcao precisar
+        menu_principal(preparar_agente=preparar_agente)
 
     except Exception as e:
         # Mostra um erro critico se algo der muito errado
@@ -87,4 +120,4 @@ if __name__ == '__main__':
     finally:
         # 4. Garante que a conexao com o banco seja fechada no final
         if repo:
-            repo.fechar_conexao()
\ No newline at end of file
+            repo.fechar_conexao()
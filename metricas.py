@@ -0,0 +1,218 @@
+import atexit
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+# Variaveis de ambiente que ligam as metricas e a captura de perfil
+# AGENTE_METRICAS=1 liga os contadores e tempos desde o inicio do programa
+# AGENTE_PERFIL=cprofile, tracemalloc ou os dois separados por virgula grava um perfil quando o programa termina
+VARIAVEL_METRICAS = "AGENTE_METRICAS"
+VARIAVEL_PERFIL = "AGENTE_PERFIL"
+VARIAVEL_PERFIL_SAIDA = "AGENTE_PERFIL_SAIDA"
+PREFIXO_PERFIL_PADRAO = "perfil_agente"
+
+# Metodos do agente medidos alem dos metodos publicos do repositorio
+METODOS_AGENTE = ("analisar_alimento", "_analisar_no_banco", "_buscar_descricao_regra", "analisar_alimentos_lote",
+                  "analisar_refeicoes", "sugerir_alternativas")
+
+
+class RegistroMetricas:
+    # Guarda quantas vezes cada operacao rodou, o tempo total, o maior tempo e quantas falharam
+    # As operacoes instrumentadas e o gancho do SQLAlchemy gravam aqui, de qualquer thread
+
+    def __init__(self):
+        self._trava = threading.Lock()
+        self.operacoes = {}
+        self.consultas_sql = {}
+
+    @staticmethod
+    def _somar(destino, nome, duracao, erro):
+        atual = destino.get(nome)
+        if atual is None:
+            atual = destino[nome] = {"chamadas": 0, "segundos": 0.0, "maximo": 0.0, "erros": 0}
+        atual["chamadas"] += 1
+        atual["segundos"] += duracao
+        atual["maximo"] = max(atual["maximo"], duracao)
+        atual["erros"] += erro
+
+    def registrar_operacao(self, nome, duracao, erro=False):
+        with self._trava:
+            self._somar(self.operacoes, nome, duracao, erro)
+
+    def registrar_consulta(self, tipo, duracao, erro=False):
+        with self._trava:
+            self._somar(self.consultas_sql, tipo, duracao, erro)
+
+    def limpar(self):
+        with self._trava:
+            self.operacoes = {}
+            self.consultas_sql = {}
+
+    def para_dict(self) -> dict:
+        # Copia dos numeros atuais, pronta para virar JSON
+        with self._trava:
+            return {"operacoes": {nome: dict(valores) for nome, valores in self.operacoes.items()},
+                    "consultas_sql": {tipo: dict(valores) for tipo, valores in self.consultas_sql.items()}}
+
+    def para_prometheus(self) -> str:
+        # Mesmos numeros no formato texto de exposicao do Prometheus
+        dados = self.para_dict()
+        linhas = []
+        for prefixo, rotulo, grupo, ajuda in (
+                ("agente_operacao", "operacao", dados["operacoes"], "Tempo das operacoes instrumentadas"),
+                ("agente_sql", "tipo", dados["consultas_sql"], "Tempo das consultas SQL por tipo de comando")):
+            linhas += [f"# HELP {prefixo}_segundos {ajuda}", f"# TYPE {prefixo}_segundos summary"]
+            for nome, valores in sorted(grupo.items()):
+                linhas.append(f'{prefixo}_segundos_count{{{rotulo}="{nome}"}} {valores["chamadas"]}')
+                linhas.append(f'{prefixo}_segundos_sum{{{rotulo}="{nome}"}} {valores["segundos"]:.9f}')
+            linhas += [f"# HELP {prefixo}_segundos_max Maior tempo de uma chamada",
+                       f"# TYPE {prefixo}_segundos_max gauge"]
+            linhas += [f'{prefixo}_segundos_max{{{rotulo}="{nome}"}} {valores["maximo"]:.9f}'
+                       for nome, valores in sorted(grupo.items())]
+            linhas += [f"# HELP {prefixo}_erros_total Chamadas que terminaram com excecao",
+                       f"# TYPE {prefixo}_erros_total counter"]
+            linhas += [f'{prefixo}_erros_total{{{rotulo}="{nome}"}} {valores["erros"]}'
+                       for nome, valores in sorted(grupo.items())]
+        return "\n".join(linhas) + "\n"
+
+    def exportar_json(self, caminho_arquivo):
+        with open(caminho_arquivo, "w", encoding="utf-8") as arquivo:
+            json.dump(self.para_dict(), arquivo, ensure_ascii=False, indent=2)
+
+
+# Registro unico usado pelo programa inteiro
+metricas = RegistroMetricas()
+
+# Metodos originais trocados pelo ativar, para o desativar colocar de volta
+_originais = {}
+
+
+def _medir_funcao(nome, funcao):
+    # Envolve a funcao para somar o tempo de cada chamada no registro
+    # Em geradores o tempo conta ate o gerador terminar, nao so a criacao dele
+    if inspect.isgeneratorfunction(funcao):
+        @functools.wraps(funcao)
+        def medir_gerador(*args, **kwargs):
+            inicio = time.perf_counter()
+            erro = True
+            try:
+                yield from funcao(*args, **kwargs)
+                erro = False
+            finally:
+                metricas.registrar_operacao(nome, time.perf_counter() - inicio, erro)
+        return medir_gerador
+
+    @functools.wraps(funcao)
+    def medir(*args, **kwargs):
+        inicio = time.perf_counter()
+        erro = True
+        try:
+            resultado = funcao(*args, **kwargs)
+            erro = False
+            return resultado
+        finally:
+            metricas.registrar_operacao(nome, time.perf_counter() - inicio, erro)
+    return medir
+
+
+def _antes_da_consulta(conexao, cursor, comando, parametros, contexto, varios):
+    conexao.info.setdefault("inicios_consulta", []).append(time.perf_counter())
+
+
+def _depois_da_consulta(conexao, cursor, comando, parametros, contexto, varios):
+    inicio = conexao.info["inicios_consulta"].pop()
+    metricas.registrar_consulta(comando.lstrip().split(None, 1)[0].upper(), time.perf_counter() - inicio)
+
+
+def _consulta_com_erro(contexto):
+    # Consulta que falhou nao passa pelo after_cursor_execute, o tempo dela e fechado aqui
+    inicios = contexto.connection.info.get("inicios_consulta") if contexto.connection is not None else None
+    if inicios:
+        comando = contexto.statement or "?"
+        metricas.registrar_consulta(comando.lstrip().split(None, 1)[0].upper(),
+                                    time.perf_counter() - inicios.pop(), erro=True)
+
+
+def metricas_ativas() -> bool:
+    return bool(_originais)
+
+
+def ativar():
+    # Troca os metodos do repositorio e do agente por versoes medidas e liga o gancho de consultas do SQLAlchemy
+    # Enquanto as metricas estao desligadas nada disso existe, entao o custo desligado e zero
+    if _originais:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from database import AlimentoRepository
+    from agente import AgenteDeRisco
+
+    alvos = [(AlimentoRepository, nome, f"repo.{nome}") for nome, valor in vars(AlimentoRepository).items()
+             if not nome.startswith("_") and inspect.isfunction(valor)]
+    alvos += [(AgenteDeRisco, nome, f"agente.{nome}") for nome in METODOS_AGENTE]
+    for classe, nome, rotulo in alvos:
+        original = vars(classe)[nome]
+        _originais[(classe, nome)] = original
+        setattr(classe, nome, _medir_funcao(rotulo, original))
+
+    event.listen(Engine, "before_cursor_execute", _antes_da_consulta)
+    event.listen(Engine, "after_cursor_execute", _depois_da_consulta)
+    event.listen(Engine, "handle_error", _consulta_com_erro)
+
+
+def desativar():
+    # Devolve os metodos originais e desliga o gancho, os numeros ja medidos continuam no registro
+    if not _originais:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    for (classe, nome), original in _originais.items():
+        setattr(classe, nome, original)
+    _originais.clear()
+    event.remove(Engine, "before_cursor_execute", _antes_da_consulta)
+    event.remove(Engine, "after_cursor_execute", _depois_da_consulta)
+    event.remove(Engine, "handle_error", _consulta_com_erro)
+
+
+def iniciar_perfil(modos, prefixo=PREFIXO_PERFIL_PADRAO):
+    # Liga o cProfile e ou o tracemalloc e grava os resultados quando o programa terminar
+    # cProfile vai para <prefixo>.prof (abrir com pstats ou snakeviz) e o tracemalloc para <prefixo>_memoria.txt
+    perfil = None
+    if "cprofile" in modos:
+        import cProfile
+
+        perfil = cProfile.Profile()
+        perfil.enable()
+    if "tracemalloc" in modos:
+        import tracemalloc
+
+        tracemalloc.start(25)
+
+    def gravar_perfil():
+        if perfil is not None:
+            perfil.disable()
+            perfil.dump_stats(f"{prefixo}.prof")
+        if "tracemalloc" in modos:
+            import tracemalloc
+
+            foto = tracemalloc.take_snapshot()
+            atual, pico = tracemalloc.get_traced_memory()
+            with open(f"{prefixo}_memoria.txt", "w", encoding="utf-8") as arquivo:
+                arquivo.write(f"Memoria atual: {atual / 1024:.1f} KiB, pico: {pico / 1024:.1f} KiB\n\n")
+                arquivo.writelines(f"{estatistica}\n" for estatistica in foto.statistics("lineno")[:30])
+            tracemalloc.stop()
+
+    atexit.register(gravar_perfil)
+
+
+def configurar_pelo_ambiente():
+    # Liga as metricas e o perfil conforme as variaveis de ambiente, sem elas nada muda
+    if os.environ.get(VARIAVEL_METRICAS, "").lower() in ("1", "true", "sim"):
+        ativar()
+    modos = {modo.strip().lower() for modo in os.environ.get(VARIAVEL_PERFIL, "").split(",") if modo.strip()}
+    if modos:
+        iniciar_perfil(modos, os.environ.get(VARIAVEL_PERFIL_SAIDA, PREFIXO_PERFIL_PADRAO))
@@ -0,0 +1,82 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from database import AlimentoRepository
+from agente import AgenteDeRisco
+
+# Quantidade de ids em cada fatia da tabela de alimentos
+TAMANHO_FATIA = 100000
+
+# Agente de cada processo, criado uma vez so quando o processo comeca
+_agente_processo = None
+
+
+def _iniciar_processo(nome_bd, limites, regras_decisao):
+    # Cada processo abre sua propria conexao somente leitura e monta seu agente com os mesmos limites
+    global _agente_processo
+    repo = AlimentoRepository(nome_bd, tamanho_pool=1, conexoes_extras=0, somente_leitura=True)
+    _agente_processo = AgenteDeRisco(repo, regras_decisao, tamanho_cache=0)
+    _agente_processo.definir_limites(limites)
+
+
+def _pontuar_fatia(id_inicial, id_final):
+    # Le os alimentos da fatia e aplica a tabela de decisao em todos de uma vez
+    # Devolve os registros prontos, a gravacao fica com o processo principal
+    inicio = time.perf_counter()
+    linhas = _agente_processo.repo.obter_nutrientes_por_intervalo(id_inicial, id_final)
+    classificacoes = _agente_processo.montar_classificacoes(linhas)
+    return id_inicial, id_final, classificacoes, time.perf_counter() - inicio
+
+
+def dividir_em_fatias(id_minimo, id_maximo, tamanho_fatia=TAMANHO_FATIA) -> list:
+    # Quebra o intervalo de ids em fatias de tamanho fixo
+    if id_minimo is None:
+        return []
+    return [(inicio, min(inicio + tamanho_fatia - 1, id_maximo))
+            for inicio in range(id_minimo, id_maximo + 1, tamanho_fatia)]
+
+
+def pontuar_catalogo(nome_bd="agente_nutricional.db", processos=None, tamanho_fatia=TAMANHO_FATIA,
+                     agente: AgenteDeRisco = None) -> int:
+    # Reclassifica a tabela de alimentos inteira usando varios processos e grava na tabela classificacoes
+    # Os limites e as regras do agente informado (ou os padroes) sao copiados para todos os processos
+    repo = AlimentoRepository(nome_bd)
+    try:
+        repo.criar_esquema()
+        agente = agente or AgenteDeRisco(repo, tamanho_cache=0)
+        fatias = dividir_em_fatias(*repo.obter_intervalo_ids(), tamanho_fatia)
+        processos = processos or os.cpu_count()
+        total = 0
+
+        print(f"Classificando {len(fatias)} fatias com {processos} processos...")
+        with ProcessPoolExecutor(max_workers=processos, initializer=_iniciar_processo,
+                                 initargs=(nome_bd, agente.configuracao_limites(), agente.regras_decisao)) as executor:
+            futuros = [executor.submit(_pontuar_fatia, inicio, fim) for inicio, fim in fatias]
+            for concluidas, futuro in enumerate(as_completed(futuros), start=1):
+                id_inicial, id_final, classificacoes, duracao = futuro.result()
+
+                repo.gravar_classificacoes(classificacoes)
+                total += len(classificacoes)
+                print(f"Fatia {concluidas}/{len(fatias)} (ids {id_inicial}-{id_final}): "
+                      f"{len(classificacoes)} alimentos em {duracao:.2f}s")
+
+        print(f"Classificação concluída: {total} alimentos.")
+        return total
+    finally:
+        repo.fechar_conexao()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reclassifica todos os alimentos em paralelo por fatias de id")
+    parser.add_argument("--banco", default="agente_nutricional.db", help="Arquivo do banco sqlite")
+    parser.add_argument("--processos", type=int, default=None, help="Quantidade de processos (padrao: nucleos)")
+    parser.add_argument("--tamanho-fatia", type=int, default=TAMANHO_FATIA, help="Quantidade de ids por fatia")
+    argumentos = parser.parse_args()
+
+    pontuar_catalogo(argumentos.banco, argumentos.processos, argumentos.tamanho_fatia)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from database import AlimentoRepository, memoria_pelo_ambiente, normalizar_nome
+from agente import AgenteDeRisco
+from catalogo import CatalogoNutrientes
+from estatistica import calcular_estatisticas_agregadas, calcular_sketches_catalogos
+import metricas
+
+# Campos do resultado do analisar_alimento na mesma ordem da tupla
+CAMPOS_RESULTADO = ("risco", "classificacao", "descricao", "sodio", "gordura_saturada", "fibra", "proteina",
+                    "carboidrato")
+
+# Maior corpo de requisicao aceito, para um cliente nao conseguir encher a memoria do servidor
+TAMANHO_MAXIMO_CORPO = 10 * 1024 * 1024
+
+MENSAGENS_STATUS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                    413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class ErroRequisicao(Exception):
+    # Erro que vira uma resposta HTTP com o status e a mensagem informados
+
+    def __init__(self, status, mensagem):
+        super().__init__(mensagem)
+        self.status = status
+        self.mensagem = mensagem
+
+
+def resultado_para_dict(nome, resultado) -> dict:
+    # Transforma a tupla de 8 posicoes do agente num dicionario com nomes para virar JSON
+    dados = dict(zip(CAMPOS_RESULTADO, resultado))
+    nutrientes = {campo: dados.pop(campo) for campo in CAMPOS_RESULTADO[3:]}
+    return {"alimento": nome, **dados, "nutrientes_100g": nutrientes}
+
+
+def refeicao_para_dict(resultado) -> dict:
+    # Analise da refeicao inteira com os totais e a analise de cada item, no mesmo formato das outras rotas
+    analise = resultado_para_dict(None, resultado.analise)
+    del analise["alimento"]
+    return {**analise, "gramas": resultado.gramas, "totais": resultado.totais._asdict(),
+            "itens": [{**resultado_para_dict(item.nome, item.analise), "gramas": item.gramas,
+                       "nutrientes_porcao": item.porcao._asdict()} for item in resultado.itens]}
+
+
+def alternativa_para_dict(alternativa) -> dict:
+    return {"alimento": alternativa.nome, "distancia": alternativa.distancia,
+            "classificacao": alternativa.classificacao, "nutrientes_100g": alternativa.nutrientes._asdict()}
+
+
+class ServidorAgente:
+    # Servidor HTTP assincrono que expoe o AgenteDeRisco
+    # O acesso ao banco roda num pool de threads limitado para nao travar o loop de eventos
+    # Pedidos iguais feitos ao mesmo tempo para o mesmo alimento esperam uma unica consulta
+
+    def __init__(self, agente: AgenteDeRisco, max_threads=None):
+        self.agente = agente
+        self.executor = ThreadPoolExecutor(max_workers=max_threads or agente.repo.tamanho_pool)
+        self._em_andamento = {}
+        self.pedidos_agrupados = 0
+
+    async def _no_executor(self, funcao, *argumentos):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, funcao, *argumentos)
+
+    def _analisar_por_nome_digitado(self, nome_digitado):
+        # Acha o nome cadastrado mesmo sem acento e analisa, roda dentro de uma thread do pool
+        nome = self.agente.repo.buscar_nome_alimento(nome_digitado) or nome_digitado
+        return resultado_para_dict(nome, self.agente.analisar_alimento(nome))
+
+    async def analisar(self, nome_digitado) -> dict:
+        # Se ja existe uma analise em andamento para o mesmo nome reaproveita o resultado dela
+        chave = normalizar_nome(nome_digitado)
+        futuro = self._em_andamento.get(chave)
+        if futuro is not None:
+            self.pedidos_agrupados += 1
+            return await asyncio.shield(futuro)
+
+        futuro = asyncio.ensure_future(self._no_executor(self._analisar_por_nome_digitado, nome_digitado))
+        self._em_andamento[chave] = futuro
+        try:
+            return await asyncio.shield(futuro)
+        finally:
+            if self._em_andamento.get(chave) is futuro:
+                del self._em_andamento[chave]
+
+    def _nomes_cadastrados(self, nomes_digitados) -> list:
+        # Acha os nomes cadastrados como a rota de um alimento, mas com uma consulta para todos
+        # Nome que nao existe segue como foi digitado e o agente informa que nao encontrou
+        cadastrados = self.agente.repo.buscar_nomes_alimentos(nomes_digitados)
+        return [cadastrados[nome] or nome for nome in nomes_digitados]
+
+    def _analisar_lote_por_nomes_digitados(self, nomes_digitados):
+        nomes = self._nomes_cadastrados(nomes_digitados)
+        return [resultado_para_dict(nome, resultado)
+                for nome, resultado in zip(nomes, self.agente.analisar_alimentos_lote(nomes))]
+
+    def _analisar_refeicoes_por_nomes_digitados(self, refeicoes):
+        nomes = iter(self._nomes_cadastrados([nome for refeicao in refeicoes for nome, _ in refeicao]))
+        return self.agente.analisar_refeicoes([[(next(nomes), gramas) for _, gramas in refeicao]
+                                               for refeicao in refeicoes])
+
+    async def analisar_lote(self, nomes) -> list:
+        # Analisa todos os nomes com o lote vetorizado do agente numa chamada so
+        if not isinstance(nomes, list) or not all(isinstance(nome, str) for nome in nomes):
+            raise ErroRequisicao(400, "O campo 'nomes' deve ser uma lista de textos.")
+        return await self._no_executor(self._analisar_lote_por_nomes_digitados, nomes)
+
+    async def analisar_refeicoes(self, refeicoes) -> list:
+        # Cada refeicao e uma lista de {"alimento": nome, "gramas": quantidade}, todas analisadas numa chamada so
+        try:
+            itens = [[(item["alimento"], item["gramas"]) for item in refeicao] for refeicao in refeicoes]
+            if not all(isinstance(nome, str) and isinstance(gramas, (int, float)) and not isinstance(gramas, bool)
+                       for refeicao in itens for nome, gramas in refeicao):
+                raise TypeError
+        except (TypeError, KeyError):
+            raise ErroRequisicao(400, "O campo 'refeicoes' deve ser uma lista de listas de "
+                                      "{\"alimento\": texto, \"gramas\": número}.")
+        try:
+            resultados = await self._no_executor(self._analisar_refeicoes_por_nomes_digitados, itens)
+        except ValueError as e:
+            raise ErroRequisicao(400, str(e))
+        return [refeicao_para_dict(resultado) for resultado in resultados]
+
+    def _sugerir_por_nome_digitado(self, nome_digitado, k):
+        nome = self.agente.repo.buscar_nome_alimento(nome_digitado)
+        if nome is None:
+            raise ErroRequisicao(404, f"Alimento '{nome_digitado}' não encontrado.")
+        return {"alimento": nome, "alternativas": [alternativa_para_dict(alternativa) for alternativa
+                                                   in self.agente.sugerir_alternativas(nome, k)]}
+
+    def _calcular_estatisticas(self, incluir_percentis) -> dict:
+        repo = self.agente.repo
+        acumuladores = calcular_estatisticas_agregadas(repo.obter_estatisticas_agregadas())
+        sketches = {}
+        if incluir_percentis:
+            sketches = calcular_sketches_catalogos(CatalogoNutrientes.de_linhas(lote)
+                                                   for lote in repo.iterar_lotes_nutrientes())
+
+        estatisticas = {}
+        for coluna, acumulador in acumuladores.items():
+            estatisticas[coluna] = {
+                "quantidade": acumulador.quantidade,
+                "media": acumulador.media,
+                "variancia": acumulador.variancia(),
+                "desvio_padrao": acumulador.desvio_padrao(),
+            }
+            if coluna in sketches:
+                p50, p90, p99 = sketches[coluna][0].percentis([0.5, 0.9, 0.99])
+                estatisticas[coluna].update({"p50": p50, "p90": p90, "p99": p99})
+        return estatisticas
+
+    async def tratar(self, metodo, caminho, corpo) -> dict | list | str:
+        # Escolhe o que fazer com base no metodo e no caminho da requisicao
+        partes = urlsplit(caminho)
+        parametros = parse_qs(partes.query)
+        rota = partes.path.rstrip("/")
+
+        if rota == "/alimentos/lote":
+            if metodo != "POST":
+                raise ErroRequisicao(405, "Use POST com {\"nomes\": [...]} no corpo.")
+            try:
+                dados = json.loads(corpo or b"{}")
+            except ValueError:
+                raise ErroRequisicao(400, "Corpo da requisição não é um JSON válido.")
+            return await self.analisar_lote(dados.get("nomes") if isinstance(dados, dict) else None)
+
+        if rota == "/refeicoes":
+            if metodo != "POST":
+                raise ErroRequisicao(405, "Use POST com {\"refeicoes\": [[{\"alimento\": ..., \"gramas\": ...}]]} "
+                                          "no corpo.")
+            try:
+                dados = json.loads(corpo or b"{}")
+            except ValueError:
+                raise ErroRequisicao(400, "Corpo da requisição não é um JSON válido.")
+            return await self.analisar_refeicoes(dados.get("refeicoes") if isinstance(dados, dict) else None)
+
+        if rota.startswith("/alimentos/") and rota.endswith("/alternativas") and metodo == "GET":
+            # Alimentos VERDE parecidos com o informado, ?k= diz quantos (padrao 5)
+            nome = unquote(rota[len("/alimentos/"):-len("/alternativas")]).strip()
+            if not nome:
+                raise ErroRequisicao(400, "Informe o nome do alimento.")
+            try:
+                k = int(parametros.get("k", ["5"])[0])
+            except ValueError:
+                raise ErroRequisicao(400, "O parâmetro 'k' deve ser um número inteiro.")
+            if not 1 <= k <= 100:
+                raise ErroRequisicao(400, "O parâmetro 'k' deve ficar entre 1 e 100.")
+            return await self._no_executor(self._sugerir_por_nome_digitado, nome, k)
+
+        if rota.startswith("/alimentos/") and metodo == "GET":
+            nome = unquote(rota[len("/alimentos/"):]).strip()
+            if not nome:
+                raise ErroRequisicao(400, "Informe o nome do alimento.")
+            return await self.analisar(nome)
+
+        if rota == "/estatisticas" and metodo == "GET":
+            incluir_percentis = parametros.get("percentis", ["0"])[0] in ("1", "true", "sim")
+            return await self._no_executor(self._calcular_estatisticas, incluir_percentis)
+
+        if rota == "/metricas" and metodo == "GET":
+            # Texto no formato do Prometheus, ou o mesmo conteudo em JSON com ?formato=json
+            if parametros.get("formato", ["prometheus"])[0] == "json":
+                return metricas.metricas.para_dict()
+            return metricas.metricas.para_prometheus()
+
+        raise ErroRequisicao(404, f"Rota {metodo} {partes.path} não existe.")
+
+    async def atender_conexao(self, leitor: asyncio.StreamReader, escritor: asyncio.StreamWriter):
+        # Atende as requisicoes de uma conexao, mantendo ela aberta enquanto o cliente pedir keep-alive
+        try:
+            while True:
+                linha_inicial = await leitor.readline()
+                if not linha_inicial:
+                    break
+                try:
+                    metodo, caminho, versao = linha_inicial.decode("latin-1").split()
+                except ValueError:
+                    break
+
+                cabecalhos = {}
+                while True:
+                    linha = await leitor.readline()
+                    if linha in (b"\r\n", b"\n", b""):
+                        break
+                    nome, _, valor = linha.decode("latin-1").partition(":")
+                    cabecalhos[nome.strip().lower()] = valor.strip()
+
+                manter_aberta = cabecalhos.get("connection", "").lower() != "close" and versao == "HTTP/1.1"
+                try:
+                    # Tamanho invalido fecha a conexao, nao da para saber onde termina o corpo
+                    tamanho = cabecalhos.get("content-length", "0")
+                    if not (tamanho.isascii() and tamanho.isdigit()):
+                        manter_aberta = False
+                        raise ErroRequisicao(400, "Cabeçalho Content-Length inválido.")
+                    tamanho = int(tamanho)
+                    if tamanho > TAMANHO_MAXIMO_CORPO:
+                        manter_aberta = False
+                        raise ErroRequisicao(413, "Corpo da requisição muito grande.")
+                    corpo = await leitor.readexactly(tamanho) if tamanho else b""
+                    status, resposta = 200, await self.tratar(metodo, caminho, corpo)
+                except ErroRequisicao as e:
+                    status, resposta = e.status, {"erro": e.mensagem}
+                except Exception as e:
+                    status, resposta = 500, {"erro": f"Falha interna: {e}"}
+
+                # Texto puro (metricas do Prometheus) vai como esta, o resto vira JSON
+                if isinstance(resposta, str):
+                    tipo, conteudo = "text/plain; version=0.0.4; charset=utf-8", resposta.encode("utf-8")
+                else:
+                    tipo = "application/json; charset=utf-8"
+                    conteudo = json.dumps(resposta, ensure_ascii=False).encode("utf-8")
+                escritor.write(
+                    f"HTTP/1.1 {status} {MENSAGENS_STATUS.get(status, '')}\r\n"
+                    f"Content-Type: {tipo}\r\n"
+                    f"Content-Length: {len(conteudo)}\r\n"
+                    f"Connection: {'keep-alive' if manter_aberta else 'close'}\r\n\r\n".encode("latin-1") + conteudo
+                )
+                await escritor.drain()
+                if not manter_aberta:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            escritor.close()
+
+    async def executar(self, host="127.0.0.1", porta=8000):
+        servidor = await asyncio.start_server(self.atender_conexao, host, porta)
+        print(f"Agente Nutricional ouvindo em http://{host}:{porta}")
+        async with servidor:
+            await servidor.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor HTTP do Agente Nutricional")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8000)
+    parser.add_argument("--banco", default="agente_nutricional.db", help="Arquivo do banco sqlite")
+    parser.add_argument("--threads", type=int, default=None, help="Tamanho do pool de threads para o banco")
+    parser.add_argument("--memoria", action="store_true",
+                        help="Carrega alimentos e regras na memoria, as leituras nao vao ao banco")
+    argumentos = parser.parse_args()
+
+    # Com AGENTE_METRICAS=1 a rota /metricas passa a ter numeros
+    metricas.configurar_pelo_ambiente()
+    repo = AlimentoRepository(argumentos.banco, em_memoria=argumentos.memoria or memoria_pelo_ambiente())
+    try:
+        # Cria as tabelas e as regras iniciais num banco novo, como o main.py
+        repo.preparar_banco()
+        if repo.em_memoria:
+            repo.carregar_memoria()
+        servidor = ServidorAgente(AgenteDeRisco(repo), argumentos.threads)
+        asyncio.run(servidor.executar(argumentos.host, argumentos.porta))
+    except KeyboardInterrupt:
+        print("\nEncerrando o servidor.")
+    finally:
+        repo.fechar_conexao()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import time
+from datetime import datetime, timezone
+from itertools import islice
+
+from agente import AgenteDeRisco
+from database import AlimentoRepository, COLUNAS_NUTRIENTES, TAMANHO_BLOCO_CSV, converter_linha_csv
+
+# Chave da tabela de metadados com o estado do csv na ultima sincronizacao (arquivo, tamanho, mtime e sha256)
+CHAVE_ESTADO_CSV = "estado_csv"
+
+# Arquivo padrao do feed de mudancas de risco, um evento JSON por linha
+ARQUIVO_FEED_PADRAO = "mudancas_risco.jsonl"
+
+# Tamanho dos pedacos lidos do arquivo para calcular o sha256
+TAMANHO_LEITURA = 1 << 20
+
+
+def ler_estado_csv(repo: AlimentoRepository, caminho_csv):
+    # Estado gravado na ultima sincronizacao deste arquivo, None se ele nunca foi sincronizado
+    valor = repo.obter_metadado(CHAVE_ESTADO_CSV)
+    if valor is None:
+        return None
+    try:
+        estado = json.loads(valor)
+    except ValueError:
+        return None
+    if not isinstance(estado, dict) or estado.get("arquivo") != os.path.abspath(caminho_csv):
+        return None
+    return estado
+
+
+def registrar_estado_csv(repo: AlimentoRepository, caminho_csv, checksum, tamanho=None, informacoes=None) -> dict:
+    # Grava tamanho, mtime e sha256 dos primeiros `tamanho` bytes do arquivo (o arquivo inteiro por padrao)
+    # informacoes e o os.stat tirado antes da leitura, assim uma gravacao durante a leitura muda o mtime e e vista depois
+    informacoes = informacoes or os.stat(caminho_csv)
+    estado = {"arquivo": os.path.abspath(caminho_csv), "tamanho": informacoes.st_size if tamanho is None else tamanho,
+              "mtime_ns": informacoes.st_mtime_ns, "checksum": checksum}
+    repo.gravar_metadado(CHAVE_ESTADO_CSV, json.dumps(estado))
+    return estado
+
+
+def _ler_final_anexado(caminho_csv, estado):
+    # Confere se o comeco do arquivo continua igual ao da ultima sincronizacao e devolve so o que foi acrescentado
+    # O sha256 do arquivo novo e calculado na mesma leitura, so os bytes novos ficam na memoria
+    # Devolve (bytes novos, sha256 do arquivo, tamanho lido) ou None se o comeco mudou
+    # Tambem devolve None se o comeco nao terminava numa quebra de linha: o que veio depois pode ser a continuacao
+    # da ultima linha (um alimento alterado) e nao uma linha nova
+    resumo = hashlib.sha256()
+    with open(caminho_csv, "rb") as arquivo:
+        restante = estado["tamanho"]
+        pedaco = b""
+        while restante > 0:
+            pedaco = arquivo.read(min(TAMANHO_LEITURA, restante))
+            if not pedaco:
+                return None
+            resumo.update(pedaco)
+            restante -= len(pedaco)
+        if resumo.hexdigest() != estado["checksum"] or not pedaco.endswith(b"\n"):
+            return None
+        novos = arquivo.read()
+    resumo.update(novos)
+    return novos, resumo.hexdigest(), estado["tamanho"] + len(novos)
+
+
+def _ler_arquivo_inteiro(caminho_csv):
+    # sha256 e tamanho do arquivo inteiro, lido em pedacos
+    resumo = hashlib.sha256()
+    tamanho = 0
+    with open(caminho_csv, "rb") as arquivo:
+        for pedaco in iter(lambda: arquivo.read(TAMANHO_LEITURA), b""):
+            resumo.update(pedaco)
+            tamanho += len(pedaco)
+    return resumo.hexdigest(), tamanho
+
+
+def _blocos_registros(linhas, tamanho_bloco):
+    # Converte as linhas do csv em blocos de registros, linhas em branco sao ignoradas
+    linhas = (linha for linha in linhas if linha)
+    return iter(lambda: [converter_linha_csv(linha) for linha in islice(linhas, tamanho_bloco)], [])
+
+
+def _mudancas_risco(agente: AgenteDeRisco, diferencas) -> list[dict]:
+    # Um evento para cada alimento que ja existia e trocou de risco com os nutrientes novos
+    momento = datetime.now(timezone.utc).isoformat()
+    eventos = []
+    for nome, (registro, anterior) in diferencas.items():
+        if anterior is None:
+            continue
+        regra_anterior = agente.classificar(*anterior)
+        regra_nova = agente.classificar(*(registro[coluna] for coluna in COLUNAS_NUTRIENTES))
+        if regra_anterior["risco"] != regra_nova["risco"]:
+            eventos.append({
+                "momento": momento, "alimento": nome,
+                "risco_anterior": regra_anterior["risco"], "risco_novo": regra_nova["risco"],
+                "classificacao_anterior": regra_anterior["classificacao"],
+                "classificacao_nova": regra_nova["classificacao"],
+            })
+    return eventos
+
+
+def sincronizar_csv(repo: AlimentoRepository, caminho_csv, agente: AgenteDeRisco = None, caminho_feed=None,
+                    tamanho_bloco=TAMANHO_BLOCO_CSV) -> dict:
+    # Aplica no banco so as linhas do csv que sao novas ou mudaram desde a ultima sincronizacao
+    # Arquivo com o mesmo tamanho e mtime nao e lido. Se so foram acrescentadas linhas no fim, so elas sao lidas
+    # Nos outros casos o arquivo inteiro e comparado com o banco, mas so as diferencas sao gravadas
+    # As diferencas vao para o banco numa transacao so e cada alimento que trocou de risco vira um evento no feed
+    # Alimentos que sairam do csv continuam no banco, como na carga normal do csv
+    resultado = {"modo": "sem_alteracoes", "linhas": 0, "inseridos": 0, "atualizados": 0, "inalterados": 0,
+                 "rejeitados": 0, "mudancas_risco": []}
+
+    informacoes = os.stat(caminho_csv)
+    estado = ler_estado_csv(repo, caminho_csv)
+    if estado is not None and (estado["tamanho"], estado["mtime_ns"]) == (informacoes.st_size,
+                                                                          informacoes.st_mtime_ns):
+        return resultado
+
+    # Arquivo que estava vazio nem tinha o cabecalho, ele e lido inteiro
+    anexado = _ler_final_anexado(caminho_csv, estado) if estado is not None and estado["tamanho"] > 0 else None
+    if anexado is not None:
+        novos, checksum, tamanho = anexado
+        resultado["modo"] = "anexado" if novos else "sem_alteracoes"
+        blocos = _blocos_registros(csv.reader(io.StringIO(novos.decode("utf-8"))), tamanho_bloco)
+        arquivo = None
+    else:
+        checksum, tamanho = _ler_arquivo_inteiro(caminho_csv)
+        resultado["modo"] = "completo"
+        arquivo = open(caminho_csv, mode='r', encoding='utf-8', newline='')
+        reader = csv.reader(arquivo)
+        next(reader, None)
+        blocos = _blocos_registros(reader, tamanho_bloco)
+
+    # Nome do alimento para (registro novo, nutrientes que estavam no banco ou None se ele e novo)
+    diferencas = {}
+    try:
+        for bloco in blocos:
+            resultado["linhas"] += len(bloco)
+            registros = {}
+            for registro in bloco:
+                if registro is None:
+                    resultado["rejeitados"] += 1
+                else:
+                    registros[registro["nome_alimento"]] = registro
+            no_banco = {linha[0]: tuple(linha[1:]) for linha in repo.obter_dados_nutricionais_lote(list(registros))}
+            for nome, registro in registros.items():
+                anterior = diferencas[nome][1] if nome in diferencas else no_banco.get(nome)
+                if anterior is not None and tuple(registro[coluna] for coluna in COLUNAS_NUTRIENTES) == anterior:
+                    diferencas.pop(nome, None)
+                else:
+                    diferencas[nome] = (registro, anterior)
+    finally:
+        if arquivo is not None:
+            arquivo.close()
+
+    if diferencas:
+        repo.carregar_registros_em_lote([[registro for registro, _ in diferencas.values()]], atualizar=True,
+                                        commit_por_bloco=False)
+    resultado["inseridos"] = sum(anterior is None for _, anterior in diferencas.values())
+    resultado["atualizados"] = len(diferencas) - resultado["inseridos"]
+    resultado["inalterados"] = resultado["linhas"] - resultado["rejeitados"] - len(diferencas)
+
+    if agente is not None:
+        resultado["mudancas_risco"] = _mudancas_risco(agente, diferencas)
+    elif any(anterior is not None for _, anterior in diferencas.values()):
+        # Sem agente informado usa um com os limites padrao so para esta comparacao
+        with AgenteDeRisco(repo, tamanho_cache=0) as agente:
+            resultado["mudancas_risco"] = _mudancas_risco(agente, diferencas)
+
+    if caminho_feed and resultado["mudancas_risco"]:
+        with open(caminho_feed, "a", encoding="utf-8") as feed:
+            feed.writelines(json.dumps(evento, ensure_ascii=False) + "\n" for evento in resultado["mudancas_risco"])
+
+    registrar_estado_csv(repo, caminho_csv, checksum, tamanho, informacoes)
+    return resultado
+
+
+def resumir_sincronizacao(resultado) -> str:
+    if resultado["modo"] == "sem_alteracoes":
+        return "Nenhuma alteração no csv."
+    return (f"Sincronização ({resultado['modo']}): {resultado['linhas']} linhas lidas, "
+            f"{resultado['inseridos']} novos, {resultado['atualizados']} atualizados, "
+            f"{resultado['inalterados']} sem mudança, {resultado['rejeitados']} inválidos, "
+            f"{len(resultado['mudancas_risco'])} mudanças de risco.")
+
+
+def observar_csv(repo: AlimentoRepository, caminho_csv, agente: AgenteDeRisco = None, intervalo=2.0,
+                 caminho_feed=ARQUIVO_FEED_PADRAO):
+    # Confere o csv a cada intervalo e sincroniza quando ele muda, ate o Ctrl+C
+    # So sincroniza quando tamanho e mtime ficam iguais em duas conferencias seguidas, para nao ler o arquivo no meio
+    # de uma gravacao. Depois de cada sincronizacao reclassifica so os alimentos que mudaram
+    # Sem agente informado um agente so e usado em todas as conferencias e fechado no fim
+    if agente is None:
+        with AgenteDeRisco(repo, tamanho_cache=0) as agente:
+            return observar_csv(repo, caminho_csv, agente, intervalo, caminho_feed)
+    anterior = None
+    print(f"Observando '{caminho_csv}' a cada {intervalo:g}s (Ctrl+C para sair)...")
+    try:
+        while True:
+            try:
+                informacoes = os.stat(caminho_csv)
+                atual = (informacoes.st_size, informacoes.st_mtime_ns)
+            except FileNotFoundError:
+                atual = None
+            if atual is not None and atual == anterior:
+                resultado = sincronizar_csv(repo, caminho_csv, agente, caminho_feed)
+                if resultado["modo"] != "sem_alteracoes":
+                    print(resumir_sincronizacao(resultado))
+                    for evento in resultado["mudancas_risco"]:
+                        print(f"  {evento['alimento']}: {evento['risco_anterior']} -> {evento['risco_novo']}")
+                    agente.sincronizar_classificacoes()
+            anterior = atual
+            time.sleep(intervalo)
+    except KeyboardInterrupt:
+        print("\nObservação encerrada.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sincroniza o banco com o csv de alimentos aplicando só as mudanças")
+    parser.add_argument("--banco", default="agente_nutricional.db", help="Arquivo do banco sqlite")
+    parser.add_argument("--csv", default="dados_alimentos.csv", help="Arquivo csv de alimentos")
+    parser.add_argument("--feed", default=ARQUIVO_FEED_PADRAO, help="Arquivo JSON lines com as mudanças de risco")
+    parser.add_argument("--observar", action="store_true", help="Continua rodando e sincroniza quando o csv mudar")
+    parser.add_argument("--intervalo", type=float, default=2.0, help="Segundos entre as conferências do csv")
+    argumentos = parser.parse_args()
+
+    repo = AlimentoRepository(argumentos.banco)
+    try:
+        repo.preparar_banco()
+        with AgenteDeRisco(repo, tamanho_cache=0) as agente:
+            if argumentos.observar:
+                observar_csv(repo, argumentos.csv, agente, argumentos.intervalo, argumentos.feed)
+                return
+            resultado = sincronizar_csv(repo, argumentos.csv, agente, argumentos.feed)
+            print(resumir_sincronizacao(resultado))
+            for evento in resultado["mudancas_risco"]:
+                print(f"  {evento['alimento']}: {evento['risco_anterior']} -> {evento['risco_novo']}")
+            agente.sincronizar_classificacoes()
+    finally:
+        repo.fechar_conexao()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+from agente import AgenteDeRisco
+from catalogo import CatalogoNutrientes
+from database import AlimentoRepository, COLUNAS_NUTRIENTES, TAMANHO_BLOCO_CSV, normalizar_nome
+from sincronizacao_csv import (ARQUIVO_FEED_PADRAO, ler_estado_csv, registrar_estado_csv, resumir_sincronizacao,
+                               sincronizar_csv)
+
+# Pasta padrao do snapshot colunar da tabela de alimentos
+DIRETORIO_SNAPSHOT = "snapshot_alimentos"
+
+# O manifesto e gravado por ultimo, entao um snapshot sem manifesto esta incompleto e e ignorado
+ARQUIVO_MANIFESTO = "manifesto.json"
+ARQUIVO_IDS = "ids.npy"
+# Um nome por linha em JSON, assim nomes com quebra de linha ou aspas nao quebram o arquivo
+ARQUIVO_NOMES = "nomes.jsonl"
+VERSAO_SNAPSHOT = 1
+
+# Chave da tabela de metadados com o checksum do ultimo csv carregado no banco
+CHAVE_CHECKSUM_CSV = "checksum_csv"
+
+
+def calcular_checksum_arquivo(caminho_arquivo, tamanho_leitura=1 << 20) -> str:
+    # sha256 do conteudo do arquivo, lido em pedacos para nao carregar o arquivo inteiro na memoria
+    resumo = hashlib.sha256()
+    with open(caminho_arquivo, "rb") as arquivo:
+        for pedaco in iter(lambda: arquivo.read(tamanho_leitura), b""):
+            resumo.update(pedaco)
+    return resumo.hexdigest()
+
+
+def _arquivo_coluna(coluna) -> str:
+    return f"{coluna}.npy"
+
+
+def ler_manifesto(diretorio=DIRETORIO_SNAPSHOT):
+    # Devolve o manifesto do snapshot ou None se ele nao existir, estiver corrompido ou for de outra versao
+    try:
+        with open(os.path.join(diretorio, ARQUIVO_MANIFESTO), encoding="utf-8") as arquivo:
+            manifesto = json.load(arquivo)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifesto, dict) or manifesto.get("versao") != VERSAO_SNAPSHOT:
+        return None
+    return manifesto
+
+
+def exportar_snapshot(repo: AlimentoRepository, diretorio=DIRETORIO_SNAPSHOT, checksum_csv=None,
+                      tamanho_lote=TAMANHO_BLOCO_CSV) -> dict:
+    # Grava a tabela de alimentos em formato colunar: um .npy por nutriente, um com os ids e um arquivo de nomes
+    # Os arrays sao escritos direto no disco lote a lote, sem montar a tabela inteira na memoria
+    # O checksum_csv diz de qual csv os dados vieram, para a inicializacao saber se pode pular a leitura dele
+    import numpy as np
+
+    os.makedirs(diretorio, exist_ok=True)
+    caminho_manifesto = os.path.join(diretorio, ARQUIVO_MANIFESTO)
+    if os.path.exists(caminho_manifesto):
+        # Sem manifesto o snapshot antigo deixa de valer enquanto os arquivos novos sao escritos
+        os.remove(caminho_manifesto)
+
+    quantidade = repo.contar_alimentos()
+    ids = np.lib.format.open_memmap(os.path.join(diretorio, ARQUIVO_IDS), mode="w+", dtype=np.int64,
+                                    shape=(quantidade,))
+    colunas = {coluna: np.lib.format.open_memmap(os.path.join(diretorio, _arquivo_coluna(coluna)), mode="w+",
+                                                 dtype=np.float64, shape=(quantidade,))
+               for coluna in COLUNAS_NUTRIENTES}
+
+    posicao = 0
+    with open(os.path.join(diretorio, ARQUIVO_NOMES), "w", encoding="utf-8") as arquivo_nomes:
+        for lote in repo.iterar_lotes_alimentos(tamanho_lote):
+            fim = posicao + len(lote)
+            if fim > quantidade:
+                raise RuntimeError("A tabela de alimentos mudou durante a exportação do snapshot.")
+            ids[posicao:fim] = [linha[0] for linha in lote]
+            for indice, coluna in enumerate(COLUNAS_NUTRIENTES, start=2):
+                colunas[coluna][posicao:fim] = [linha[indice] for linha in lote]
+            arquivo_nomes.writelines(json.dumps(linha[1], ensure_ascii=False) + "\n" for linha in lote)
+            posicao = fim
+    if posicao != quantidade:
+        raise RuntimeError("A tabela de alimentos mudou durante a exportação do snapshot.")
+
+    for array in (ids, *colunas.values()):
+        array.flush()
+    del ids, colunas
+
+    manifesto = {
+        "versao": VERSAO_SNAPSHOT,
+        "criado_em": datetime.now(timezone.utc).isoformat(),
+        "quantidade": quantidade,
+        "colunas": list(COLUNAS_NUTRIENTES),
+        "checksum_csv": checksum_csv,
+    }
+    # Grava num arquivo temporario e troca de uma vez para nunca existir um manifesto pela metade
+    temporario = caminho_manifesto + ".tmp"
+    with open(temporario, "w", encoding="utf-8") as arquivo:
+        json.dump(manifesto, arquivo, ensure_ascii=False, indent=2)
+    os.replace(temporario, caminho_manifesto)
+    return manifesto
+
+
+class SnapshotAlimentos(CatalogoNutrientes):
+    # Snapshot colunar aberto com os arrays mapeados do disco (np.load com mmap_mode)
+    # Nada e copiado para a memoria na abertura, o sistema operacional le as paginas conforme elas sao usadas
+    # Classificacao e estatisticas vem do CatalogoNutrientes e rodam direto nos arrays mapeados
+
+    def __init__(self, diretorio=DIRETORIO_SNAPSHOT):
+        import numpy as np
+
+        manifesto = ler_manifesto(diretorio)
+        if manifesto is None:
+            raise FileNotFoundError(f"Nenhum snapshot válido em '{diretorio}'.")
+        self.diretorio = diretorio
+        self.manifesto = manifesto
+        self.quantidade = manifesto["quantidade"]
+        ids = np.load(os.path.join(diretorio, ARQUIVO_IDS), mmap_mode="r")
+        colunas = {coluna: np.load(os.path.join(diretorio, _arquivo_coluna(coluna)), mmap_mode="r")
+                   for coluna in COLUNAS_NUTRIENTES}
+        for array in (ids, *colunas.values()):
+            if array.shape != (self.quantidade,):
+                raise ValueError(f"Snapshot em '{diretorio}' está inconsistente com o manifesto.")
+        super().__init__(colunas, ids=ids)
+
+    @property
+    def nomes(self) -> list[str]:
+        # Os nomes so sao lidos do disco na primeira vez que alguem precisa deles
+        if self._nomes is None:
+            with open(os.path.join(self.diretorio, ARQUIVO_NOMES), encoding="utf-8") as arquivo:
+                self._nomes = [json.loads(linha) for linha in arquivo]
+        return self._nomes
+
+    def iterar_registros(self, tamanho_bloco=TAMANHO_BLOCO_CSV):
+        # Blocos de registros no formato do insert da tabela de alimentos, usados na importacao
+        nomes = self.nomes
+        for inicio, colunas in self.iterar_blocos(tamanho_bloco):
+            valores = zip(*(coluna.tolist() for coluna in colunas))
+            yield [{"nome_alimento": nome, "nome_normalizado": normalizar_nome(nome),
+                    **dict(zip(COLUNAS_NUTRIENTES, linha))}
+                   for nome, linha in zip(nomes[inicio:inicio + tamanho_bloco], valores)]
+
+
+def importar_snapshot(repo: AlimentoRepository, diretorio=DIRETORIO_SNAPSHOT, atualizar=False) -> dict:
+    # Grava no banco os alimentos do snapshot com a mesma carga em lote usada para o csv
+    # Devolve a contagem de inseridos, atualizados e rejeitados
+    return repo.carregar_registros_em_lote(SnapshotAlimentos(diretorio).iterar_registros(), atualizar)
+
+
+def carregar_dados_iniciais(repo: AlimentoRepository, caminho_csv, diretorio=DIRETORIO_SNAPSHOT):
+    # Carrega o csv de alimentos na inicializacao so quando for preciso
+    # Se o banco ja recebeu este csv so as linhas novas ou alteradas sao aplicadas (sincronizar_csv)
+    # Num banco novo, se o snapshot veio deste csv os dados saem do snapshot
+    # Caso contrario le o csv e grava um snapshot novo para as proximas vezes
+    try:
+        informacoes = os.stat(caminho_csv)
+        # Banco que ja recebeu um csv antes (com ou sem o estado da sincronizacao) so recebe as diferencas
+        if ler_estado_csv(repo, caminho_csv) is not None or repo.obter_metadado(CHAVE_CHECKSUM_CSV) is not None:
+            resultado = sincronizar_csv(repo, caminho_csv, caminho_feed=ARQUIVO_FEED_PADRAO)
+            if resultado["modo"] == "sem_alteracoes":
+                print(f"Arquivo '{caminho_csv}' sem alterações desde a última carga, leitura ignorada.")
+            else:
+                repo.gravar_metadado(CHAVE_CHECKSUM_CSV, ler_estado_csv(repo, caminho_csv)["checksum"])
+                print(resumir_sincronizacao(resultado))
+            return
+        checksum = calcular_checksum_arquivo(caminho_csv)
+    except FileNotFoundError:
+        print(f"Erro: Arquivo {caminho_csv} não encontrado.")
+        return
+    except Exception as e:
+        print(f"Erro durante a sincronização do csv: {e}")
+        return
+
+    try:
+        manifesto = ler_manifesto(diretorio)
+        if manifesto is not None and manifesto.get("checksum_csv") == checksum:
+            print(f"Carregando alimentos do snapshot '{diretorio}'...")
+            contagem = importar_snapshot(repo, diretorio)
+        else:
+            print(f"Lendo dados do arquivo '{caminho_csv}'...")
+            contagem = repo.carregar_csv_em_lote(caminho_csv)
+            exportar_snapshot(repo, diretorio, checksum)
+    except Exception as e:
+        print(f"Erro durante a carga dos dados: {e}")
+        return
+
+    repo.gravar_metadado(CHAVE_CHECKSUM_CSV, checksum)
+    registrar_estado_csv(repo, caminho_csv, checksum, informacoes=informacoes)
+    print(f"Dados carregados. Novos: {contagem['inseridos']}, "
+          f"já existentes ou inválidos: {contagem['rejeitados']}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta e analisa o snapshot colunar da tabela de alimentos")
+    parser.add_argument("acao", choices=("exportar", "importar", "estatisticas", "classificar"))
+    parser.add_argument("--banco", default="agente_nutricional.db", help="Arquivo do banco sqlite")
+    parser.add_argument("--diretorio", default=DIRETORIO_SNAPSHOT, help="Pasta do snapshot")
+    argumentos = parser.parse_args()
+
+    repo = AlimentoRepository(argumentos.banco)
+    try:
+        repo.criar_esquema()
+        if argumentos.acao == "exportar":
+            manifesto = exportar_snapshot(repo, argumentos.diretorio, repo.obter_metadado(CHAVE_CHECKSUM_CSV))
+            print(f"Snapshot gravado em '{argumentos.diretorio}' com {manifesto['quantidade']} alimentos.")
+        elif argumentos.acao == "importar":
+            contagem = importar_snapshot(repo, argumentos.diretorio)
+            print(f"Novos: {contagem['inseridos']}, já existentes: {contagem['rejeitados']}.")
+        elif argumentos.acao == "estatisticas":
+            for coluna, acumulador in SnapshotAlimentos(argumentos.diretorio).estatisticas().items():
+                print(f"{coluna:<18} média {acumulador.media:>12.3f}  desvio padrão {acumulador.desvio_padrao():>12.3f}")
+        else:
+            contagem = SnapshotAlimentos(argumentos.diretorio).contar_por_risco(AgenteDeRisco(repo, tamanho_cache=0))
+            for risco, quantidade in contagem.items():
+                print(f"{risco:<10} {quantidade}")
+    finally:
+        repo.fechar_conexao()
+
+
+if __name__ == '__main__':
+    main()
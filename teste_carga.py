@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import quote
+
+# Teste de carga do servidor.py: dispara requisicoes concorrentes e mostra latencia e vazao
+
+
+async def _requisitar(leitor, escritor, host, metodo, caminho, corpo=b""):
+    # Manda uma requisicao pela conexao aberta e espera a resposta inteira
+    escritor.write(
+        f"{metodo} {caminho} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(corpo)}\r\n\r\n".encode("latin-1") + corpo
+    )
+    await escritor.drain()
+
+    status = int((await leitor.readline()).split()[1])
+    tamanho = 0
+    while True:
+        linha = await leitor.readline()
+        if linha in (b"\r\n", b""):
+            break
+        nome, _, valor = linha.decode("latin-1").partition(":")
+        if nome.strip().lower() == "content-length":
+            tamanho = int(valor)
+    await leitor.readexactly(tamanho)
+    return status
+
+
+async def _trabalhador(host, porta, fila, latencias, erros, nomes, tamanho_lote):
+    # Cada trabalhador usa uma conexao keep-alive e vai tirando pedidos da fila
+    leitor, escritor = await asyncio.open_connection(host, porta)
+    try:
+        while True:
+            try:
+                fila.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+
+            if tamanho_lote:
+                corpo = json.dumps({"nomes": random.sample(nomes, min(tamanho_lote, len(nomes)))}).encode("utf-8")
+                metodo, caminho = "POST", "/alimentos/lote"
+            else:
+                corpo, metodo, caminho = b"", "GET", "/alimentos/" + quote(random.choice(nomes))
+
+            inicio = time.perf_counter()
+            status = await _requisitar(leitor, escritor, host, metodo, caminho, corpo)
+            latencias.append(time.perf_counter() - inicio)
+            if status != 200:
+                erros.append(status)
+    finally:
+        escritor.close()
+
+
+def _percentil(valores_ordenados, fracao):
+    indice = min(len(valores_ordenados) - 1, int(fracao * len(valores_ordenados)))
+    return valores_ordenados[indice]
+
+
+async def executar_carga(host, porta, total, concorrencia, nomes, tamanho_lote=0) -> dict:
+    fila = asyncio.Queue()
+    for _ in range(total):
+        fila.put_nowait(None)
+    latencias, erros = [], []
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(
+        _trabalhador(host, porta, fila, latencias, erros, nomes, tamanho_lote) for _ in range(concorrencia)
+    ))
+    duracao = time.perf_counter() - inicio
+
+    latencias.sort()
+    return {
+        "requisicoes": len(latencias),
+        "erros": len(erros),
+        "duracao_s": duracao,
+        "vazao_req_s": len(latencias) / duracao if duracao else 0.0,
+        "p50_ms": _percentil(latencias, 0.50) * 1000 if latencias else 0.0,
+        "p99_ms": _percentil(latencias, 0.99) * 1000 if latencias else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do servidor do Agente Nutricional")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8000)
+    parser.add_argument("--requisicoes", type=int, default=5000)
+    parser.add_argument("--concorrencia", type=int, default=50)
+    parser.add_argument("--lote", type=int, default=0, help="Quantidade de nomes por requisicao de lote (0 = individual)")
+    parser.add_argument("--nomes", default="Pao Frances,Arroz Branco Cozido,Feijao Cozido,Banana Prata,Bacon Frito",
+                        help="Nomes separados por virgula usados nas requisicoes")
+    argumentos = parser.parse_args()
+
+    nomes = [nome.strip() for nome in argumentos.nomes.split(",") if nome.strip()]
+    resultado = asyncio.run(executar_carga(argumentos.host, argumentos.porta, argumentos.requisicoes,
+                                           argumentos.concorrencia, nomes, argumentos.lote))
+
+    print(f"Requisições: {resultado['requisicoes']} (erros: {resultado['erros']}) em {resultado['duracao_s']:.2f}s")
+    print(f"Vazão: {resultado['vazao_req_s']:.1f} req/s")
+    print(f"Latência p50: {resultado['p50_ms']:.2f} ms | p99: {resultado['p99_ms']:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
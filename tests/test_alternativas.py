@@ -0,0 +1,81 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from agente import AgenteDeRisco
+from alternativas import ARQUIVO_ALTERACOES, IndiceAlternativas
+from database import AlimentoRepository
+
+PASTA_PROJETO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ALIMENTOS = [
+    ("Kiwi", 3, 0, 3, 1, 15), ("Lentilha Cozida", 2, 0.1, 8, 9, 20), ("Feijão Cozido", 2, 0.2, 8.5, 5, 14),
+    ("Abacate", 7, 2, 7, 2, 9), ("Tofu", 7, 0.7, 0.3, 8, 2), ("Salmão Grelhado", 60, 1, 0, 25, 0),
+    ("Amendoim Torrado", 410, 7, 8, 26, 16), ("Salgadinho Queijo", 800, 8, 1, 6, 55),
+]
+
+# Roda num processo novo e falha se o indice precisar ser montado de novo em vez de lido da pasta
+SCRIPT_SEM_RECONSTRUIR = """
+import json, sys
+from agente import AgenteDeRisco
+from alternativas import IndiceAlternativas
+from database import AlimentoRepository
+
+def falhar(*argumentos, **opcoes):
+    raise AssertionError("o indice foi montado de novo")
+
+IndiceAlternativas.construir = classmethod(falhar)
+banco, diretorio, nome = sys.argv[1:]
+repo = AlimentoRepository(banco)
+agente = AgenteDeRisco(repo, diretorio_alternativas=diretorio)
+print(json.dumps([alternativa.nome for alternativa in agente.sugerir_alternativas(nome, 10)]))
+repo.fechar_conexao()
+"""
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = AlimentoRepository(str(tmp_path / "agente.db"))
+    repo.preparar_banco()
+    for alimento in ALIMENTOS:
+        repo.inserir_alimento(*alimento)
+    yield repo
+    repo.fechar_conexao()
+
+
+def sugestoes_em_outro_processo(banco, diretorio, nome) -> list[str]:
+    processo = subprocess.run([sys.executable, "-c", SCRIPT_SEM_RECONSTRUIR, str(banco), str(diretorio), nome],
+                              cwd=PASTA_PROJETO, capture_output=True, text=True)
+    assert processo.returncode == 0, processo.stderr
+    return json.loads(processo.stdout.splitlines()[-1])
+
+
+def test_alteracao_gravada_sem_reconstruir(repo, tmp_path):
+    diretorio = tmp_path / "indice"
+    agente = AgenteDeRisco(repo, diretorio_alternativas=str(diretorio))
+    antes = [alternativa.nome for alternativa in agente.sugerir_alternativas("Amendoim Torrado", 10)]
+    assert "Tofu" in antes
+
+    # Tofu deixa de ser VERDE e um alimento VERDE novo aparece
+    repo.remover_alimento("Tofu")
+    repo.inserir_alimento("Tofu", 900, 9, 0, 8, 60)
+    repo.inserir_alimento("Grão de Bico", 5, 0.3, 7.6, 9, 27)
+    depois = [alternativa.nome for alternativa in agente.sugerir_alternativas("Amendoim Torrado", 10)]
+    assert "Tofu" not in depois and "Grão de Bico" in depois
+    assert os.path.getsize(diretorio / ARQUIVO_ALTERACOES) > 0
+
+    assert sugestoes_em_outro_processo(tmp_path / "agente.db", diretorio, "Amendoim Torrado") == depois
+    assert IndiceAlternativas.carregar(agente, str(diretorio)) is not None
+
+
+def test_indice_gravado_de_outra_tabela_e_descartado(repo, tmp_path):
+    diretorio = tmp_path / "indice"
+    agente = AgenteDeRisco(repo, diretorio_alternativas=str(diretorio))
+    agente.sugerir_alternativas("Amendoim Torrado")
+    # Gravacao feita sem avisar este agente: a assinatura do banco muda e o indice gravado nao vale mais
+    agente.fechar()
+    repo.inserir_alimento("Grão de Bico", 5, 0.3, 7.6, 9, 27)
+    assert IndiceAlternativas.carregar(agente, str(diretorio)) is None
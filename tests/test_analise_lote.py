@@ -0,0 +1,36 @@
+import pytest
+
+from agente import AgenteDeRisco
+from database import AlimentoRepository
+
+ALIMENTOS = [("Kiwi", 3, 0, 3, 1, 15), ("Salgadinho Queijo", 800, 8, 1, 6, 55), ("Pão Francês", 650, 0.5, 2.3, 8, 58)]
+
+
+@pytest.fixture
+def agente(tmp_path):
+    repo = AlimentoRepository(str(tmp_path / "agente.db"))
+    repo.preparar_banco()
+    for alimento in ALIMENTOS:
+        repo.inserir_alimento(*alimento)
+    yield AgenteDeRisco(repo, tamanho_cache=0, diretorio_alternativas=None)
+    repo.fechar_conexao()
+
+
+def test_lote_igual_ao_analisar_alimento(agente):
+    nomes = ["Pão Francês", "Nao Existe", "Kiwi", "Kiwi", "Salgadinho Queijo"]
+    assert agente.analisar_alimentos_lote(nomes) == [agente.analisar_alimento(nome) for nome in nomes]
+
+
+def test_lote_aceita_gerador(agente):
+    assert agente.analisar_alimentos_lote(nome for nome in ["Kiwi", "Nao Existe"]) == \
+        [agente.analisar_alimento("Kiwi"), agente.RESULTADO_NAO_ENCONTRADO]
+
+
+def test_lote_sem_nomes_analisa_o_banco_inteiro(agente):
+    resultados = agente.analisar_alimentos_lote()
+    assert sorted(resultados) == sorted(agente.analisar_alimento(nome) for nome, *_ in ALIMENTOS)
+
+
+def test_lote_vazio(agente):
+    assert agente.analisar_alimentos_lote([]) == []
+    assert agente.analisar_alimentos_lote(iter([])) == []
@@ -0,0 +1,48 @@
+import os
+import shutil
+
+import pytest
+
+from agente import AgenteDeRisco
+from database import AlimentoRepository
+
+PASTA_PROJETO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = AlimentoRepository(str(tmp_path / "agente.db"))
+    repo.preparar_banco()
+    yield repo
+    repo.fechar_conexao()
+
+
+def test_upsert_do_mesmo_csv_mantem_classificacoes(repo, tmp_path):
+    caminho = tmp_path / "dados_alimentos.csv"
+    shutil.copy(os.path.join(PASTA_PROJETO, "dados_alimentos.csv"), caminho)
+    repo.carregar_csv_em_lote(str(caminho))
+    AgenteDeRisco(repo, tamanho_cache=0, diretorio_alternativas=None).sincronizar_classificacoes()
+    quantidade = repo.contar_alimentos()
+    estatisticas = repo.obter_estatisticas_agregadas()
+    avisados = []
+    repo.registrar_ouvinte_alteracao(avisados.extend)
+
+    contagem = repo.carregar_csv_em_lote(str(caminho), atualizar=True)
+    assert (contagem["atualizados"], contagem["inalterados"]) == (0, quantidade)
+    assert sum(repo.contar_classificacoes_por_risco().values()) == quantidade
+    assert repo.obter_estatisticas_agregadas() == estatisticas
+    assert avisados == []
+
+
+def test_upsert_com_nutriente_diferente_apaga_so_a_classificacao_dele(repo, tmp_path):
+    caminho = tmp_path / "alimentos.csv"
+    cabecalho = "nome_alimento,sodio,gordura_saturada,fibra,proteina,carboidrato\n"
+    caminho.write_text(cabecalho + "Kiwi,3,0,3,1,15\nTofu,7,0.7,0.3,8,2\n", encoding="utf-8")
+    repo.carregar_csv_em_lote(str(caminho))
+    AgenteDeRisco(repo, tamanho_cache=0, diretorio_alternativas=None).sincronizar_classificacoes()
+
+    caminho.write_text(cabecalho + "Kiwi,3,0,3,1,40\nTofu,7,0.7,0.3,8,2\n", encoding="utf-8")
+    contagem = repo.carregar_csv_em_lote(str(caminho), atualizar=True)
+    assert (contagem["atualizados"], contagem["inalterados"]) == (1, 1)
+    assert repo.obter_dados_nutricionais("Kiwi").carboidrato == 40
+    assert sum(repo.contar_classificacoes_por_risco().values()) == 1
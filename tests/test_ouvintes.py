@@ -0,0 +1,36 @@
+import gc
+
+import pytest
+
+from agente import AgenteDeRisco
+from database import AlimentoRepository
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = AlimentoRepository(str(tmp_path / "agente.db"))
+    repo.preparar_banco()
+    yield repo
+    repo.fechar_conexao()
+
+
+def test_agente_descartado_sai_dos_ouvintes(repo):
+    for _ in range(5):
+        AgenteDeRisco(repo, tamanho_cache=0, diretorio_alternativas=None)
+    gc.collect()
+    repo.inserir_alimento("Kiwi", 3, 0, 3, 1, 15)
+    assert repo._ouvintes_alteracao == []
+
+
+def test_fechar_remove_ouvinte_e_cache_continua_avisado(repo):
+    agente = AgenteDeRisco(repo, diretorio_alternativas=None)
+    repo.inserir_alimento("Kiwi", 3, 0, 3, 1, 15)
+    assert agente.analisar_alimento("Kiwi").risco == "VERDE"
+    repo.remover_alimento("Kiwi")
+    assert agente.analisar_alimento("Kiwi").risco == "CINZA"
+
+    with AgenteDeRisco(repo, diretorio_alternativas=None):
+        assert len(repo._ouvintes_alteracao) == 2
+    assert len(repo._ouvintes_alteracao) == 1
+    agente.fechar()
+    assert repo._ouvintes_alteracao == []
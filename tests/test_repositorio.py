@@ -0,0 +1,37 @@
+import pytest
+from sqlalchemy import event
+
+from database import AlimentoRepository
+
+
+def test_sqlite_em_memoria():
+    repo = AlimentoRepository(":memory:")
+    repo.preparar_banco()
+    assert repo.inserir_alimento("Kiwi", 3, 0, 3, 1, 15)
+    assert repo.obter_dados_nutricionais("Kiwi").carboidrato == 15
+    repo.fechar_conexao()
+
+
+def test_arquivo_sqlite_sem_select_1_por_consulta(tmp_path):
+    repo = AlimentoRepository(str(tmp_path / "agente.db"), tamanho_pool=3)
+    repo.preparar_banco()
+    assert repo.engine.pool.size() == 3
+    comandos = []
+    event.listen(repo.engine, "before_cursor_execute", lambda conexao, cursor, comando, *resto: comandos.append(comando))
+    repo.obter_dados_nutricionais("Kiwi")
+    assert len(comandos) == 1
+    repo.fechar_conexao()
+
+
+@pytest.mark.parametrize("busca_textual", [True, False], ids=["trigramas", "difflib"])
+def test_parecidos_acha_nome_que_comeca_com_o_digitado(tmp_path, monkeypatch, busca_textual):
+    repo = AlimentoRepository(str(tmp_path / "agente.db"))
+    repo.preparar_banco()
+    for nome in ["Arroz Branco Cozido", "Arroz Integral Cozido com Legumes Variados", "Feijão Preto"]:
+        repo.inserir_alimento(nome, 1, 0, 0, 1, 20)
+    if not busca_textual:
+        monkeypatch.setattr(repo, "_busca_textual_disponivel", lambda: False)
+    assert repo.buscar_alimentos_parecidos("Arroz") == \
+        ["Arroz Branco Cozido", "Arroz Integral Cozido com Legumes Variados"]
+    assert repo.buscar_alimentos_parecidos("feijao preto")[0] == "Feijão Preto"
+    repo.fechar_conexao()
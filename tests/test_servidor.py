@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+from agente import AgenteDeRisco
+from database import AlimentoRepository
+from servidor import ErroRequisicao, ServidorAgente
+
+ALIMENTOS = [("Kiwi", 3, 0, 3, 1, 15), ("Pão Francês", 650, 0.5, 2.3, 8, 58)]
+
+
+@pytest.fixture(params=[False, True], ids=["sqlite", "memoria"])
+def servidor(tmp_path, request):
+    repo = AlimentoRepository(str(tmp_path / "agente.db"), em_memoria=request.param)
+    repo.preparar_banco()
+    for alimento in ALIMENTOS:
+        repo.inserir_alimento(*alimento)
+    servidor = ServidorAgente(AgenteDeRisco(repo, tamanho_cache=0, diretorio_alternativas=None), max_threads=2)
+    yield servidor
+    servidor.executor.shutdown()
+    repo.fechar_conexao()
+
+
+def test_buscar_nomes_alimentos(servidor):
+    assert servidor.agente.repo.buscar_nomes_alimentos(["pao  FRANCES", "Kiwi", "Nao Existe"]) == \
+        {"pao  FRANCES": "Pão Francês", "Kiwi": "Kiwi", "Nao Existe": None}
+
+
+def test_lote_acha_nomes_digitados_como_a_rota_de_um_alimento(servidor):
+    resultados = asyncio.run(servidor.analisar_lote(["pao frances", "Nao Existe"]))
+    assert [r["alimento"] for r in resultados] == ["Pão Francês", "Nao Existe"]
+    assert resultados[0] == asyncio.run(servidor.analisar("pao frances"))
+
+
+def test_refeicoes_acham_nomes_digitados(servidor):
+    resultados = asyncio.run(servidor.analisar_refeicoes([[{"alimento": "pao frances", "gramas": 50},
+                                                          {"alimento": "kiwi", "gramas": 100}]]))
+    assert [item["alimento"] for item in resultados[0]["itens"]] == ["Pão Francês", "Kiwi"]
+
+
+@pytest.mark.parametrize("gramas", [True, False, "50"])
+def test_refeicoes_recusam_gramas_que_nao_sao_numero(servidor, gramas):
+    with pytest.raises(ErroRequisicao) as erro:
+        asyncio.run(servidor.analisar_refeicoes([[{"alimento": "Kiwi", "gramas": gramas}]]))
+    assert erro.value.status == 400
@@ -0,0 +1,49 @@
+import pytest
+
+from database import AlimentoRepository
+from sincronizacao_csv import sincronizar_csv
+
+CABECALHO = "nome_alimento,sodio,gordura_saturada,fibra,proteina,carboidrato\n"
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = AlimentoRepository(str(tmp_path / "agente.db"))
+    repo.preparar_banco()
+    yield repo
+    repo.fechar_conexao()
+
+
+def test_ultima_linha_sem_quebra_editada_no_fim(repo, tmp_path):
+    # A ultima linha nao tinha quebra e ganhou um digito: e uma alteracao do Pao, nao uma linha nova
+    caminho = tmp_path / "alimentos.csv"
+    caminho.write_text(CABECALHO + "Kiwi,3,0,3,1,15\nPao,50,1,4,8,20", encoding="utf-8")
+    assert sincronizar_csv(repo, str(caminho))["modo"] == "completo"
+
+    with open(caminho, "a", encoding="utf-8") as arquivo:
+        arquivo.write("0")
+    resultado = sincronizar_csv(repo, str(caminho))
+    assert resultado["modo"] == "completo"
+    assert (resultado["atualizados"], resultado["rejeitados"]) == (1, 0)
+    assert repo.obter_dados_nutricionais("Pao").carboidrato == 200
+    assert [evento["alimento"] for evento in resultado["mudancas_risco"]] == ["Pao"]
+
+
+def test_linhas_acrescentadas_no_fim(repo, tmp_path):
+    caminho = tmp_path / "alimentos.csv"
+    caminho.write_text(CABECALHO + "Kiwi,3,0,3,1,15\n", encoding="utf-8")
+    sincronizar_csv(repo, str(caminho))
+
+    with open(caminho, "a", encoding="utf-8") as arquivo:
+        arquivo.write("Uva,1,0,1,1,16\n")
+    resultado = sincronizar_csv(repo, str(caminho))
+    assert (resultado["modo"], resultado["inseridos"], resultado["linhas"]) == ("anexado", 1, 1)
+
+
+def test_sincronizacao_nao_acumula_ouvintes(repo, tmp_path):
+    caminho = tmp_path / "alimentos.csv"
+    caminho.write_text(CABECALHO + "Kiwi,3,0,3,1,15\n", encoding="utf-8")
+    for carboidrato in (15, 40, 15, 40):
+        caminho.write_text(CABECALHO + f"Kiwi,3,0,3,1,{carboidrato}\n", encoding="utf-8")
+        sincronizar_csv(repo, str(caminho))
+    assert repo._ouvintes_alteracao == []
@@ -0,0 +1,85 @@
+import pytest
+
+from agente import INDICADORES, AgenteDeRisco, compilar_tabela_decisao
+from database import AlimentoRepository
+
+MASCARAS = range(2 ** len(INDICADORES))
+
+
+def cascata_original(sodio_alto, gordura_alta, fibra_baixa, proteina_alta, carboidrato_alto):
+    # Cascata if/elif do analisar_alimento antes da tabela de decisao, devolve (risco, classificacao, padrao_regra)
+    if sodio_alto and gordura_alta:
+        return "VERMELHO", "Risco Crítico (Múltiplos Fatores)", "Alto Sódio e Alta Gordura Saturada"
+    elif sodio_alto and carboidrato_alto and fibra_baixa:
+        return "VERMELHO", "Risco Crítico (Sódio e Carboidratos)", "Alto Sódio e Alto Carboidrato com Baixa Fibra"
+    elif gordura_alta and carboidrato_alto and fibra_baixa:
+        return ("VERMELHO", "Risco Crítico (Gordura e Carboidratos)",
+                "Alta Gordura Saturada e Alto Carboidrato com Baixa Fibra")
+    elif carboidrato_alto and fibra_baixa and not proteina_alta:
+        return "AMARELO", "Risco Moderado (Carboidratos Sem Benefício)", "muita energia"
+    elif carboidrato_alto and (not fibra_baixa or proteina_alta):
+        return "AMARELO", "Risco Moderado (Alto Carboidrato Compensado)", "parcialmente compensado"
+    elif (sodio_alto and not gordura_alta and not carboidrato_alto and not fibra_baixa) or \
+            (gordura_alta and not sodio_alto and not carboidrato_alto and not fibra_baixa):
+        return "AMARELO", "Risco Moderado (Fator Isolado)", "Apresenta um fator de risco isolado"
+    elif not sodio_alto and not gordura_alta and not carboidrato_alto and (fibra_baixa or proteina_alta):
+        return "VERDE", "Risco Baixo (Perfil Ideal)", "Fibra OU Proteína alta"
+    elif not sodio_alto and not gordura_alta and not carboidrato_alto:
+        return "VERDE", "Risco Baixo (Fatores Controlados)", "Todos os fatores críticos"
+    else:
+        return "VERDE", "Risco Baixo (Outros Fatores)", "Todos os fatores críticos"
+
+
+def indicadores(mascara) -> dict:
+    return {nome: bool(mascara >> bit & 1) for bit, nome in enumerate(INDICADORES)}
+
+
+def nutrientes_da_mascara(mascara) -> tuple:
+    # Valores logo acima ou logo abaixo de cada limite para ligar exatamente os bits da mascara
+    ligados = indicadores(mascara)
+    a = AgenteDeRisco
+    return (a.LIMITE_SODIO_ALTO + (1 if ligados["sodio_alto"] else -1),
+            a.LIMITE_GORDURA_ALTA + (1 if ligados["gordura_alta"] else -1),
+            a.LIMITE_FIBRA_BAIXA + (-1 if ligados["fibra_baixa"] else 1),
+            a.LIMITE_PROTEINA_ALTA + (1 if ligados["proteina_alta"] else -1),
+            a.LIMITE_CARBOIDRATO_ALTO + (1 if ligados["carboidrato_alto"] else -1))
+
+
+@pytest.fixture
+def agente(tmp_path):
+    repo = AlimentoRepository(str(tmp_path / "agente.db"))
+    repo.preparar_banco()
+    yield AgenteDeRisco(repo, tamanho_cache=0, diretorio_alternativas=None)
+    repo.fechar_conexao()
+
+
+@pytest.mark.parametrize("mascara", MASCARAS)
+def test_tabela_igual_a_cascata(mascara):
+    tabela = compilar_tabela_decisao(AgenteDeRisco.REGRAS_DECISAO)
+    regra = AgenteDeRisco.REGRAS_DECISAO[tabela[mascara]]
+    assert (regra["risco"], regra["classificacao"], regra["padrao_regra"]) == \
+        cascata_original(**indicadores(mascara))
+
+
+def test_tabela_cobre_todas_as_mascaras():
+    assert len(compilar_tabela_decisao(AgenteDeRisco.REGRAS_DECISAO)) == len(MASCARAS)
+
+
+@pytest.mark.parametrize("mascara", MASCARAS)
+def test_mascara_dos_nutrientes(agente, mascara):
+    assert agente.calcular_mascara(*nutrientes_da_mascara(mascara)) == mascara
+
+
+def test_analise_igual_a_cascata_com_descricao(agente):
+    # Passa pelo banco: cada mascara vira um alimento e a descricao (regra da tabela Regras) tem que ser a mesma
+    # que a cascata encontraria com o padrao dela
+    ids_regras = {descricao: id_regra for id_regra, (_, descricao) in enumerate(agente.repo.obter_regras())}
+    for mascara in MASCARAS:
+        assert agente.repo.inserir_alimento(f"Alimento {mascara}", *nutrientes_da_mascara(mascara))
+    for mascara in MASCARAS:
+        risco, classificacao, padrao_regra = cascata_original(**indicadores(mascara))
+        esperada = agente._buscar_descricao_regra(risco, padrao_regra)
+        resultado = agente.analisar_alimento(f"Alimento {mascara}")
+        assert (resultado.risco, resultado.classificacao) == (risco, classificacao)
+        assert resultado.descricao == esperada
+        assert ids_regras.get(resultado.descricao) == ids_regras.get(esperada) is not None
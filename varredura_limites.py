@@ -0,0 +1,189 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from agente import AgenteDeRisco, compilar_tabela_decisao
+from catalogo import COLUNAS_CATALOGO, CatalogoNutrientes, codigo_risco
+from database import AlimentoRepository
+
+# Pontos da grade avaliados de uma vez (cada processo recebe blocos deste tamanho)
+PONTOS_POR_BLOCO = 256
+
+# Cada nutriente vira um bit da mascara comparando com o limite, na mesma ordem do calcular_mascara
+# Todos ficam acima do limite para ligar o bit, menos a fibra que liga quando fica abaixo
+ACIMA_DO_LIMITE = (True, True, False, True, True)
+
+# Linhas da grade mostradas no terminal, o resto so vai para o arquivo de saida
+LINHAS_EXIBIDAS = 50
+
+# Dados de cada processo, recebidos uma vez so quando o processo comeca
+_dados_processo = None
+
+
+def montar_grade(valores_por_limite, agente: AgenteDeRisco = None) -> list[tuple]:
+    # Todas as combinacoes dos valores de cada limite, na ordem do AgenteDeRisco.NOMES_LIMITES
+    # Limite sem valores informados fica com o valor atual do agente
+    agente_base = agente or AgenteDeRisco
+    eixos = [valores_por_limite.get(nome) or [getattr(agente_base, nome)] for nome in AgenteDeRisco.NOMES_LIMITES]
+    return [tuple(float(valor) for valor in ponto) for ponto in itertools.product(*eixos)]
+
+
+def resumir_catalogo(catalogo: CatalogoNutrientes, grade, tamanho_bloco=1000000) -> tuple:
+    # Junta os alimentos que caem nos mesmos intervalos entre os limites da grade em todos os nutrientes
+    # Para qualquer ponto da grade esses alimentos ativam a mesma regra, entao basta guardar uma celula e a quantidade
+    # Devolve os limites distintos de cada nutriente, o intervalo de cada celula em cada nutriente e a quantidade
+    import numpy as np
+
+    limites = [np.unique([ponto[indice] for ponto in grade]) for indice in range(len(COLUNAS_CATALOGO))]
+    bases = [len(valores) + 1 for valores in limites]
+
+    codigos = []
+    for _, colunas in catalogo.iterar_blocos(tamanho_bloco):
+        codigo = np.zeros(len(colunas[0]), dtype=np.int64)
+        for valores, base, acima, coluna in zip(limites, bases, ACIMA_DO_LIMITE, colunas):
+            # Quantos limites ficam abaixo do valor (acima) ou abaixo ou iguais a ele (fibra)
+            intervalo = np.searchsorted(valores, coluna, side="left" if acima else "right")
+            codigo = codigo * base + intervalo
+        codigos.append(np.unique(codigo, return_counts=True))
+
+    if codigos:
+        celulas, inverso = np.unique(np.concatenate([codigo for codigo, _ in codigos]), return_inverse=True)
+        quantidades = np.bincount(inverso, weights=np.concatenate([quantidade for _, quantidade in codigos]))
+    else:
+        celulas, quantidades = np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    intervalos = []
+    for base in reversed(bases):
+        intervalos.append(celulas % base)
+        celulas = celulas // base
+    return limites, intervalos[::-1], quantidades.astype(np.int64)
+
+
+def _distribuicoes(dados, pontos) -> list[list[int]]:
+    # Quantidade de alimentos em cada codigo de risco para cada ponto, todos os pontos do bloco de uma vez
+    import numpy as np
+
+    limites, intervalos, quantidades, tabela_riscos, total_riscos = dados
+    pontos = np.asarray(pontos, dtype=float).reshape(-1, len(COLUNAS_CATALOGO))
+    mascaras = np.zeros((len(pontos), len(quantidades)), dtype=np.uint8)
+    for bit, (valores, intervalo, acima) in enumerate(zip(limites, intervalos, ACIMA_DO_LIMITE)):
+        # Posicao do limite do ponto entre os limites distintos, comparada com o intervalo de cada celula
+        posicao = np.searchsorted(valores, pontos[:, bit])[:, None]
+        ligado = intervalo[None, :] > posicao if acima else intervalo[None, :] <= posicao
+        mascaras |= ligado.astype(np.uint8) << bit
+
+    riscos = tabela_riscos[mascaras]
+    deslocamento = np.arange(len(pontos))[:, None] * total_riscos
+    contagem = np.bincount((riscos + deslocamento).ravel(), weights=np.broadcast_to(quantidades, riscos.shape).ravel(),
+                           minlength=len(pontos) * total_riscos)
+    return contagem.reshape(len(pontos), total_riscos).astype(np.int64).tolist()
+
+
+def _iniciar_processo(dados):
+    global _dados_processo
+    _dados_processo = dados
+
+
+def _avaliar_bloco(pontos):
+    return _distribuicoes(_dados_processo, pontos)
+
+
+def varrer_limites(catalogo: CatalogoNutrientes, grade, regras_decisao=None, processos=None,
+                   pontos_por_bloco=PONTOS_POR_BLOCO) -> list[dict]:
+    # Distribuicao dos riscos de todos os alimentos do catalogo para cada combinacao de limites da grade
+    # Os alimentos sao resumidos uma vez (resumir_catalogo) e os blocos de pontos sao divididos entre os processos
+    # Devolve um dicionario por ponto, na ordem da grade, com os limites e a quantidade de alimentos em cada risco
+    import numpy as np
+
+    regras_decisao = tuple(regras_decisao) if regras_decisao is not None else AgenteDeRisco.REGRAS_DECISAO
+    tabela_regras = compilar_tabela_decisao(regras_decisao)
+    tabela_riscos = np.array([codigo_risco(regras_decisao[indice]["risco"]) for indice in tabela_regras],
+                             dtype=np.intp)
+    total_riscos = int(tabela_riscos.max()) + 1
+
+    limites, intervalos, quantidades = resumir_catalogo(catalogo, grade)
+    dados = (limites, intervalos, quantidades, tabela_riscos, total_riscos)
+    blocos = [grade[inicio:inicio + pontos_por_bloco] for inicio in range(0, len(grade), pontos_por_bloco)]
+
+    processos = processos or os.cpu_count()
+    if processos == 1 or len(blocos) <= 1:
+        contagens = [contagem for bloco in blocos for contagem in _distribuicoes(dados, bloco)]
+    else:
+        with ProcessPoolExecutor(max_workers=processos, initializer=_iniciar_processo,
+                                 initargs=(dados,)) as executor:
+            contagens = [contagem for resultado in executor.map(_avaliar_bloco, blocos) for contagem in resultado]
+
+    riscos = list(dict.fromkeys(regra["risco"] for regra in regras_decisao))
+    return [{"limites": dict(zip(AgenteDeRisco.NOMES_LIMITES, ponto)),
+             "distribuicao": {risco: contagem[codigo_risco(risco)] for risco in riscos}}
+            for ponto, contagem in zip(grade, contagens)]
+
+
+def gravar_resultados(resultados, caminho_saida):
+    # Grava em JSON ou, se o arquivo terminar em .csv, numa tabela com uma linha por ponto da grade
+    if not caminho_saida.lower().endswith(".csv"):
+        with open(caminho_saida, "w", encoding="utf-8") as arquivo:
+            json.dump(resultados, arquivo, ensure_ascii=False, indent=2)
+        return
+    riscos = list(resultados[0]["distribuicao"]) if resultados else []
+    with open(caminho_saida, "w", newline="", encoding="utf-8") as arquivo:
+        writer = csv.writer(arquivo)
+        writer.writerow(list(AgenteDeRisco.NOMES_LIMITES) + riscos)
+        writer.writerows(list(resultado["limites"].values()) + list(resultado["distribuicao"].values())
+                         for resultado in resultados)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mostra como a distribuição de riscos muda com outros limites")
+    parser.add_argument("--banco", default="agente_nutricional.db", help="Arquivo do banco sqlite")
+    parser.add_argument("--snapshot", default=None, help="Lê os nutrientes do snapshot colunar em vez do banco")
+    for nome, opcao in zip(AgenteDeRisco.NOMES_LIMITES, ("--sodio", "--gordura", "--fibra", "--proteina",
+                                                          "--carboidrato")):
+        parser.add_argument(opcao, dest=nome, type=float, nargs="+", default=None,
+                            help=f"Valores de {nome} na grade (padrão: {getattr(AgenteDeRisco, nome)})")
+    parser.add_argument("--processos", type=int, default=None, help="Quantidade de processos (padrao: nucleos)")
+    parser.add_argument("--saida", default=None, help="Arquivo .json ou .csv com a distribuição de cada ponto")
+    argumentos = parser.parse_args()
+
+    grade = montar_grade({nome: getattr(argumentos, nome) for nome in AgenteDeRisco.NOMES_LIMITES})
+
+    inicio = time.perf_counter()
+    if argumentos.snapshot:
+        from snapshot import SnapshotAlimentos
+
+        try:
+            catalogo = SnapshotAlimentos(argumentos.snapshot)
+        except (FileNotFoundError, ValueError) as e:
+            parser.error(str(e))
+    else:
+        repo = AlimentoRepository(argumentos.banco, somente_leitura=True)
+        try:
+            catalogo = CatalogoNutrientes.do_repositorio(repo)
+        finally:
+            repo.fechar_conexao()
+    print(f"{len(catalogo)} alimentos lidos em {time.perf_counter() - inicio:.2f}s")
+
+    inicio = time.perf_counter()
+    resultados = varrer_limites(catalogo, grade, processos=argumentos.processos)
+    print(f"{len(grade)} combinações de limites avaliadas em {time.perf_counter() - inicio:.2f}s\n")
+
+    riscos = list(resultados[0]["distribuicao"]) if resultados else []
+    print("".join(f"{nome[len('LIMITE_'):]:>18}" for nome in AgenteDeRisco.NOMES_LIMITES)
+          + "".join(f"{risco:>10}" for risco in riscos))
+    for resultado in resultados[:LINHAS_EXIBIDAS]:
+        print("".join(f"{valor:>18g}" for valor in resultado["limites"].values())
+              + "".join(f"{quantidade:>10}" for quantidade in resultado["distribuicao"].values()))
+    if len(resultados) > LINHAS_EXIBIDAS:
+        print(f"... mais {len(resultados) - LINHAS_EXIBIDAS} combinações (use --saida para gravar todas)")
+
+    if argumentos.saida:
+        gravar_resultados(resultados, argumentos.saida)
+        print(f"\nResultados gravados em {argumentos.saida}")
+
+
+if __name__ == '__main__':
+    main()